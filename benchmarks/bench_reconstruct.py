@@ -0,0 +1,69 @@
+"""
+Throughput of Exp.reconstruct for 10^5 - 10^6 paths.
+
+Compares the batch expansion used by Exp.reconstruct with calling
+timehandling.hub once per file. Run as
+
+    python benchmarks/bench_reconstruct.py
+"""
+
+import time
+from datetime import datetime, timedelta
+
+from dcmdb.src.cls.experiment import Exp
+from dcmdb.src.timehandling import hub
+
+FILE_TEMPLATE = "fc%Y%m%d%H+%LLLh%LMmgrib2_fp"
+PATH_TEMPLATE = "ec:/snh/harmonie/exp/%Y/%m/%d/%H/mbr000/"
+
+
+def synthetic_exp(ndates, nleadtimes, step=900):
+    sdate = datetime(2024, 1, 1)
+    dates = {
+        (sdate + timedelta(hours=6 * i)).strftime("%Y-%m-%d %H:%M:%S"): list(
+            range(0, nleadtimes * step, step)
+        )
+        for i in range(ndates)
+    }
+    val = {
+        "file_templates": [FILE_TEMPLATE],
+        "atos": {"path_template": PATH_TEMPLATE},
+        "domain": {},
+    }
+    return Exp("cases", "bench", "bench", "atos", 0, val, {FILE_TEMPLATE: dates})
+
+
+def per_file(exp):
+    template = f"{exp.path_template}/{FILE_TEMPLATE}"
+    return [
+        hub(template, dtg, leadtime)
+        for dtg, leadtimes in exp.data[FILE_TEMPLATE].items()
+        for leadtime in leadtimes
+    ]
+
+
+def timeit(func, *args):
+    t = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - t, result
+
+
+def main():
+    print(
+        f"{'paths':>9} {'hub/file [s]':>13} {'batch [s]':>10} {'paths/s':>10} {'speedup':>8}"
+    )
+    for ndates, nleadtimes in ((500, 200), (2500, 400)):
+        exp = synthetic_exp(ndates, nleadtimes)
+        t_hub, ref = timeit(per_file, exp)
+        t_batch, res = timeit(exp.reconstruct)
+        assert res == ref
+        print(
+            f"{len(res):9d} {t_hub:13.2f} {t_batch:10.2f} "
+            f"{len(res) / t_batch:10.0f} {t_hub / t_batch:8.1f}"
+        )
+        t_iter, n = timeit(lambda: sum(1 for _ in exp.iter_reconstruct()))
+        print(f"{n:9d} {'':13} {t_iter:10.2f} {n / t_iter:10.0f} (generator)")
+
+
+if __name__ == "__main__":
+    main()
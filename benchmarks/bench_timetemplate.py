@@ -0,0 +1,75 @@
+"""
+Per-call cost of TimeTemplate against the simulation_datetime implementation.
+
+Run as
+
+    python benchmarks/bench_timetemplate.py
+"""
+
+import datetime
+import timeit
+
+from dcmdb.src.timehandling import TimeTemplate, simulation_datetime
+
+TEMPLATE = "%Y/%m/%d/%H/mbr000/fc%Y%m%d%H+%LLLh%LMmgrib2_fp"
+STRING = "2024/09/01/06/mbr000/fc2024090106+003h15mgrib2_fp"
+NOMATCH = "2024/09/01/06/mbr000/fc2024090106+003grib_sfxs"
+DTG = "2024-09-01 06:00:00"
+LEADTIME = 11700
+
+
+def legacy_hub():
+    dtg = simulation_datetime._strptime(DTG, "%Y-%m-%d %H:%M:%S")
+    dtg.leadtime = datetime.timedelta(seconds=LEADTIME)
+    return dtg.strftime(TEMPLATE)
+
+
+def legacy_nomatch():
+    try:
+        simulation_datetime._strptime(NOMATCH, TEMPLATE)
+    except ValueError:
+        pass
+
+
+def main(number=20000):
+    template = TimeTemplate(TEMPLATE)
+    dt = template.parse(STRING)
+    cases = (
+        (
+            "parse",
+            lambda: simulation_datetime._strptime(STRING, TEMPLATE),
+            lambda: template.parse(STRING),
+        ),
+        ("parse, no match", legacy_nomatch, lambda: template.match(NOMATCH)),
+        (
+            "format",
+            lambda: dt.strftime(TEMPLATE),
+            lambda: template.format(dt, LEADTIME),
+        ),
+        ("hub", legacy_hub, lambda: template.format(DTG, LEADTIME)),
+        ("compile", lambda: None, lambda: TimeTemplate(TEMPLATE)),
+    )
+    print(
+        f"{'operation':16} {'legacy [us]':>12} {'TimeTemplate [us]':>18} {'speedup':>8}"
+    )
+    for name, legacy, new in cases:
+        t_legacy = timeit.timeit(legacy, number=number) / number * 1e6
+        t_new = timeit.timeit(new, number=number) / number * 1e6
+        speedup = f"{t_legacy / t_new:8.1f}" if name != "compile" else ""
+        print(f"{name:16} {t_legacy:12.2f} {t_new:18.2f} {speedup}")
+
+    strings = [template.format(DTG, x) for x in range(0, 3600 * 48, 900)] * 100
+    t_many = timeit.timeit(lambda: template.parse_many(strings), number=5) / 5
+    print(f"parse_many: {len(strings) / t_many:.0f} strings/s")
+    t_many = (
+        timeit.timeit(
+            lambda: list(template.format_many([DTG] * 100, range(0, 3600 * 48, 900))),
+            number=5,
+        )
+        / 5
+    )
+    print(f"format_many: {len(strings) / t_many:.0f} paths/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Fixtures of the benchmark suite and the default storage of the results.
+
+Each run is saved below benchmarks/.benchmarks and compared with the last
+saved run of the same machine, see benchmarks/README.md.
+"""
+
+import contextlib
+import io
+import os
+
+import pytest
+from synthetic import register_archive
+
+from dcmdb.src.listing_cache import ListingCache, set_listing_cache
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".benchmarks")
+
+
+def pytest_configure(config):
+    if not hasattr(config.option, "benchmark_storage"):
+        return
+    from pytest_benchmark.utils import get_tag
+
+    if config.option.benchmark_storage == "file://./.benchmarks":
+        config.option.benchmark_storage = f"file://{RESULTS}"
+    # Named after the commit, like --benchmark-autosave
+    if not config.option.benchmark_save:
+        config.option.benchmark_autosave = get_tag()
+    if not config.option.benchmark_compare and os.path.isdir(RESULTS):
+        config.option.benchmark_compare = True
+
+
+@pytest.fixture(autouse=True)
+def listing_cache(tmp_path, monkeypatch):
+    """
+    Keep listings and journals out of ~/.cache and always list the archive
+    """
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    set_listing_cache(ListingCache(mode="refresh"))
+    yield
+    set_listing_cache(None)
+
+
+@pytest.fixture
+def archive():
+    """
+    An empty mock archive for ec: and ectmp:, set its latency attribute
+    for the seconds per call
+    """
+    fs = register_archive()
+    yield fs
+    register_archive()
+
+
+@pytest.fixture
+def quiet():
+    """
+    Drop the printout of the benchmarked function
+    """
+    return contextlib.redirect_stdout(io.StringIO())
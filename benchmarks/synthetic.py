@@ -0,0 +1,211 @@
+"""
+Synthetic cases, archive and GRIB files for the benchmarks.
+
+The file and path templates are taken from the cases in cases/*/meta.yaml,
+with the archive part of the path templates moved below /bench/<case>/<exp>/.
+The archived files live in MockArchiveFileSystem, an in-process fsspec
+filesystem registered for ec: and ectmp: that sleeps a configurable time on
+each call to stand in for the latency of ECFS.
+"""
+
+import glob
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import eccodes
+import fsspec
+import yaml
+from fsspec.implementations.memory import MemoryFileSystem
+
+from dcmdb.src.timehandling import expand_paths
+
+CASES_DIR = os.path.join(os.path.dirname(__file__), "..", "cases")
+PROTOCOLS = ("ec", "ectmp")
+
+
+class MockArchiveFileSystem(MemoryFileSystem):
+    """
+    In-memory stand-in for ECFS with a fixed latency per call
+
+    Paths keep their protocol, so ec:/a and ectmp:/a are different files.
+    """
+
+    protocol = PROTOCOLS
+    root_marker = "/"
+    store = {}
+    pseudo_dirs = [""]
+    latency = 0.0
+    calls = Counter()
+
+    @classmethod
+    def _strip_protocol(cls, path):
+        for protocol in PROTOCOLS:
+            for prefix in (f"{protocol}://", f"{protocol}:"):
+                if path.startswith(prefix):
+                    path = f"/{protocol}/" + path[len(prefix) :].lstrip("/")
+                    break
+            else:
+                continue
+            break
+        return MemoryFileSystem._strip_protocol(path)
+
+    def _wait(self, call):
+        self.calls[call] += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def ls(self, path, detail=True, **kwargs):
+        self._wait("ls")
+        return super().ls(path, detail=detail, **kwargs)
+
+    def info(self, path, **kwargs):
+        self._wait("info")
+        return super().info(path, **kwargs)
+
+    def cat_file(self, path, start=None, end=None, **kwargs):
+        self._wait("cat_file")
+        return super().cat_file(path, start=start, end=end, **kwargs)
+
+
+def register_archive(latency=0.0):
+    """
+    Register an empty MockArchiveFileSystem for ec: and ectmp:
+
+    Returns
+    -------
+    The filesystem instance
+    """
+    for protocol in PROTOCOLS:
+        fsspec.register_implementation(protocol, MockArchiveFileSystem, clobber=True)
+    MockArchiveFileSystem.store.clear()
+    MockArchiveFileSystem.pseudo_dirs[:] = [""]
+    MockArchiveFileSystem.latency = latency
+    MockArchiveFileSystem.calls.clear()
+    return fsspec.filesystem("ec")
+
+
+def case_templates(cases_dir=CASES_DIR):
+    """
+    Return the distinct (file templates, path template) pairs of the cases on atos
+
+    Only templates that can be expanded to file names are kept.
+    """
+    templates = {}
+    for meta in sorted(glob.glob(os.path.join(cases_dir, "*", "meta.yaml"))):
+        with open(meta) as f:
+            content = yaml.safe_load(f) or {}
+        for val in content.values():
+            if not isinstance(val, dict) or "atos" not in val:
+                continue
+            path_template = val["atos"].get("path_template") or ""
+            file_templates = [x for x in val.get("file_templates", []) if "*" not in x]
+            if "%" not in path_template or len(file_templates) == 0:
+                continue
+            key = (tuple(file_templates), path_template[path_template.find("%") :])
+            templates.setdefault(key, None)
+    return [(list(x), y) for x, y in templates]
+
+
+def make_cases(
+    path,
+    ncases=2,
+    nexps=2,
+    ndates=4,
+    nleadtimes=24,
+    step=3600,
+    cycle=6,
+    protocol="ec",
+    file_size=16,
+    archive=None,
+):
+    """
+    Write a synthetic case directory and optionally fill the archive
+
+    Inputs
+    ------
+    path : str
+        Directory of the cases, one directory per case with meta.yaml and data.json
+    ncases, nexps : int
+        Number of cases and experiments per case
+    ndates : int
+        Number of init times per experiment, cycle hours apart
+    nleadtimes : int
+        Number of lead times per init time, step seconds apart
+    protocol : str
+        Archive protocol of the path templates, ec or ectmp
+    file_size : int
+        Bytes of each archived file
+    archive : fsspec.AbstractFileSystem
+        Filesystem the files are written to, e.g. from register_archive
+
+    Returns
+    -------
+    list of the case names
+    """
+    templates = case_templates()
+    sdate = datetime(2024, 9, 1)
+    dates = [
+        (sdate + timedelta(hours=cycle * i)).strftime("%Y-%m-%d %H:%M:%S")
+        for i in range(ndates)
+    ]
+    leadtimes = list(range(0, nleadtimes * step, step))
+    names = []
+    for i in range(ncases):
+        case = f"bench_case{i:03d}"
+        meta = {}
+        data = {"atos": {}}
+        for j in range(nexps):
+            exp = f"bench_exp{j:03d}"
+            file_templates, part_path = templates[(i * nexps + j) % len(templates)]
+            path_template = f"{protocol}:/bench/{case}/{exp}/{part_path}"
+            meta[exp] = {
+                "file_templates": file_templates,
+                "atos": {"path_template": path_template},
+                "lumi": {"path_template": f"/scratch/bench/{case}/{exp}/%Y/%m/%d/%H"},
+                "domain": {"name": exp},
+            }
+            data["atos"][exp] = {
+                x: {date: leadtimes for date in dates} for x in file_templates
+            }
+            if archive is not None:
+                for x in file_templates:
+                    template = os.path.join(path_template, x)
+                    for filename in expand_paths(template, dates, leadtimes):
+                        archive.pipe_file(filename, b"x" * file_size)
+        os.makedirs(os.path.join(path, case), exist_ok=True)
+        with open(os.path.join(path, case, "meta.yaml"), "w") as f:
+            yaml.dump(meta, f)
+        with open(os.path.join(path, case, "data.json"), "w") as f:
+            json.dump(data, f)
+        names.append(case)
+    return names
+
+
+def write_grib_files(
+    path, nfiles=4, levels=(100, 250, 500, 850, 1000), params=("t", "u", "v", "z")
+):
+    """
+    Write small GRIB2 files, one per lead time hour
+
+    Returns
+    -------
+    list of the file names
+    """
+    os.makedirs(path, exist_ok=True)
+    files = []
+    for step in range(nfiles):
+        filename = os.path.join(path, f"fc+{step:04d}h00m00s.grib2")
+        with open(filename, "wb") as f:
+            for param in params:
+                for level in levels:
+                    gid = eccodes.codes_grib_new_from_samples("regular_ll_pl_grib2")
+                    eccodes.codes_set(gid, "shortName", param)
+                    eccodes.codes_set(gid, "step", step)
+                    eccodes.codes_set(gid, "level", level)
+                    eccodes.codes_write(gid, f)
+                    eccodes.codes_release(gid)
+        files.append(filename)
+    return files
@@ -0,0 +1,71 @@
+"""
+Scanning and transfer planning against the mock archive.
+
+The latency of each archive call is a parameter, so the benchmarks show the
+effect of the number of calls as well as the local processing.
+"""
+
+import json
+import os
+
+import pytest
+from synthetic import make_cases
+
+from dcmdb.src.cls.cases import Cases
+from dcmdb.src.helpers import file_stats, find_files
+from dcmdb.src.transfer import plan
+
+LATENCIES = [0, 0.002]
+SIZE = dict(ncases=2, nexps=2, ndates=12, nleadtimes=24)
+
+
+@pytest.fixture(params=LATENCIES, ids=lambda x: f"latency={x}")
+def cases(request, archive, tmp_path):
+    path = str(tmp_path / "cases")
+    names = make_cases(path, archive=archive, **SIZE)
+    archive.latency = request.param
+    return Cases(path=path, selection=names, host="atos", printlev=0)
+
+
+def data(cases):
+    res = {}
+    for name in cases.cases:
+        with open(os.path.join(cases.path, name, "data.json")) as f:
+            res[name] = json.load(f)
+    return res
+
+
+@pytest.mark.parametrize("jobs", [1, 8])
+def test_scan(benchmark, cases, quiet, jobs):
+    expected = data(cases)
+
+    def run():
+        with quiet:
+            cases.scan(jobs=jobs)
+
+    benchmark(run)
+    assert data(cases) == expected
+
+
+def test_find_files(benchmark, cases):
+    exp = next(iter(cases.cases.values())).runs
+    exp = next(iter(exp.values())) if isinstance(exp, dict) else exp
+    path_template = exp.path_template
+    i = path_template.find("%")
+    files = benchmark(lambda: list(find_files(path_template[:i], path_template[i:])))
+    assert len(files) > 0
+
+
+def test_file_stats(benchmark, cases):
+    files = cases.reconstruct()
+    stats = benchmark(file_stats, files)
+    assert all(x["size"] is not None for x in stats)
+
+
+def test_plan(benchmark, cases, tmp_path, quiet):
+    def run():
+        with quiet:
+            return plan(cases, "lumi", str(tmp_path / "scratch"))
+
+    jobs = benchmark(run)
+    assert sum(len(job.files) for job in jobs) == len(cases.reconstruct())
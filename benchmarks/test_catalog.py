@@ -0,0 +1,64 @@
+"""
+Loading, listing and reconstructing the file names of synthetic cases.
+"""
+
+import pytest
+from synthetic import make_cases
+
+from dcmdb.src.catalog import Catalog
+from dcmdb.src.cls.cases import Cases
+
+SIZES = {
+    "small": dict(ncases=4, nexps=2, ndates=20, nleadtimes=24),
+    "large": dict(ncases=20, nexps=3, ndates=120, nleadtimes=49),
+}
+
+
+@pytest.fixture(scope="module", params=SIZES)
+def cases_path(request, tmp_path_factory):
+    path = tmp_path_factory.mktemp(request.param)
+    names = make_cases(str(path), **SIZES[request.param])
+    return str(path), names
+
+
+def test_load(benchmark, cases_path):
+    path, names = cases_path
+    cases = benchmark(Cases, path=path, selection=names, host="atos", printlev=0)
+    assert len(cases.cases) == len(names)
+
+
+def test_list(benchmark, cases_path, quiet):
+    path, names = cases_path
+
+    def run():
+        with quiet:
+            Cases(path=path, selection=names, host="atos", printlev=0).print()
+
+    benchmark(run)
+
+
+def test_list_catalog(benchmark, cases_path, tmp_path, quiet):
+    path, names = cases_path
+    dbfile = str(tmp_path / "catalog.sqlite")
+    Catalog(path, dbfile=dbfile).build()
+
+    def run():
+        with quiet:
+            Cases(
+                path=path, selection=names, host="atos", printlev=0, catalog=dbfile
+            ).print()
+
+    benchmark(run)
+
+
+def test_catalog_build(benchmark, cases_path, tmp_path):
+    path, names = cases_path
+    dbfile = str(tmp_path / "catalog.sqlite")
+    benchmark(lambda: Catalog(path, dbfile=dbfile).build(force=True))
+
+
+def test_reconstruct(benchmark, cases_path):
+    path, names = cases_path
+    cases = Cases(path=path, selection=names, host="atos", printlev=0)
+    files = benchmark(cases.reconstruct)
+    assert len(set(files)) == len(files)
@@ -0,0 +1,83 @@
+"""
+Building TOCs and kerchunk references of small synthetic GRIB files.
+"""
+
+import json
+import os
+from pathlib import Path
+
+import gribscan
+import pytest
+from synthetic import write_grib_files
+
+from dcmdb.src import indexing
+from dcmdb.src.cls.experiment import Exp
+from dcmdb.src.referencing import combine_references
+
+FILE_TEMPLATE = "fc+%LLLLh00m00sgrib2"
+NFILES = 12
+
+
+@pytest.fixture(scope="module")
+def grib_files(tmp_path_factory):
+    return write_grib_files(str(tmp_path_factory.mktemp("grib")), NFILES)
+
+
+@pytest.fixture(scope="module")
+def ref_files(grib_files, tmp_path_factory):
+    path = tmp_path_factory.mktemp("refs")
+    ref_files = []
+    for gribfile in grib_files:
+        idxfile = Path(path / f"{os.path.basename(gribfile)}.index")
+        gribscan.write_index(gribfile=gribfile, idxfile=idxfile, force=True)
+        (refs,) = gribscan.grib_magic(
+            filenames=[str(idxfile)],
+            magician=gribscan.magician.Magician(),
+            global_prefix="",
+        ).values()
+        ref_file = os.path.join(path, os.path.basename(gribfile) + ".json")
+        with open(ref_file, "w") as f:
+            json.dump(refs, f)
+        ref_files.append(ref_file)
+    return ref_files
+
+
+def synthetic_exp(path, grib_files):
+    val = {
+        "file_templates": [FILE_TEMPLATE],
+        "atos": {"path_template": os.path.dirname(grib_files[0])},
+        "domain": {},
+    }
+    os.makedirs(os.path.join(path, "bench"), exist_ok=True)
+    return Exp(str(path), "bench", "bench", "atos", 0, val, {})
+
+
+@pytest.mark.parametrize("toc_format", ["json", "arrow", "parquet"])
+def test_build_toc(benchmark, grib_files, tmp_path, quiet, toc_format):
+    exp = synthetic_exp(tmp_path, grib_files)
+
+    def run():
+        with quiet:
+            exp.build_toc(FILE_TEMPLATE, grib_files, toc_format=toc_format)
+
+    benchmark(run)
+    assert os.path.isfile(exp.toc_file(FILE_TEMPLATE, toc_format))
+
+
+@pytest.mark.skipif(
+    not hasattr(gribscan.magician, "HarmonieMagician"),
+    reason="gribscan without HarmonieMagician",
+)
+def test_grib_references(benchmark, grib_files):
+    refs = benchmark(indexing.grib_references, grib_files[0])
+    assert len(refs) > 0
+
+
+@pytest.mark.parametrize("batch_size", [4, NFILES])
+@pytest.mark.parametrize("toc_filetype", ["json", "parquet"])
+def test_combine_references(benchmark, ref_files, tmp_path, batch_size, toc_filetype):
+    filename = str(tmp_path / f"refs.{toc_filetype}")
+    benchmark(
+        combine_references, ref_files, filename, toc_filetype, batch_size=batch_size
+    )
+    assert os.path.exists(filename)
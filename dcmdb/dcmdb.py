@@ -8,6 +8,8 @@ from argparse import ArgumentParser as ArgumentParserBase
 from argparse import RawDescriptionHelpFormatter, _HelpAction
 from importlib import import_module
 
+from .src import profiling
+from .src.catalog import configure_parser as configure_catalog_parser
 from .src.chase import configure_parser as configure_chase_parser
 
 
@@ -91,6 +93,23 @@ def generate_pre_parser(**kwargs) -> ArgumentParser:
         description="dcmdb is a database containing information and references to DE_330 cases.",
         **kwargs,
     )
+    pre_parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Time the phases of the command, write them as a Chrome trace and "
+        "print a summary at exit",
+    )
+    pre_parser.add_argument(
+        "--profile-trace",
+        default=profiling.DEFAULT_TRACE_FILE,
+        metavar="TRACE",
+        help=f"Trace file of --profile, default {profiling.DEFAULT_TRACE_FILE}",
+    )
+    pre_parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="Record the peak traced memory of each phase, implies --profile",
+    )
 
     return pre_parser
 
@@ -109,6 +128,7 @@ def generate_parser(**kwargs) -> ArgumentParser:
         required=True,
     )
 
+    configure_catalog_parser(sub_parsers)
     configure_chase_parser(sub_parsers)
 
     return parser
@@ -136,4 +156,15 @@ def main(*args, **kwargs):
     parser = generate_parser(add_help=True)
     args = parser.parse_args(args, namespace=pre_args)
 
-    do_call(args, parser)
+    if not (args.profile or args.profile_memory):
+        return do_call(args, parser)
+
+    profiler = profiling.enable(memory=args.profile_memory)
+    try:
+        with profiling.span(args.cmd):
+            return do_call(args, parser)
+    finally:
+        profiling.disable()
+        profiler.write(args.profile_trace)
+        print(profiler.summary())
+        print("Trace written to", args.profile_trace)
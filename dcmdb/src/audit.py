@@ -0,0 +1,115 @@
+"""
+Audit of the group and permissions of archived files.
+
+All ECFS files of the selected cases are grouped by directory and every
+directory is listed once with els -l, with the listings running concurrently
+through the shared ECFS client. Each file is checked to exist, to belong to
+the project group and to be readable by the group. The result is written as
+a tab separated table with one row per file:
+
+    case  exp  file_template  path  owner  group  mode  problem
+
+where problem is empty for files without problems.
+"""
+
+import os
+import re
+
+from .ecfs import ecfs_list_many
+from .ecfs_client import ECFSError
+
+DEFAULT_GROUP = "msdeode"
+COLUMNS = ("case", "exp", "file_template", "path", "owner", "group", "mode", "problem")
+
+
+def parse_els(line):
+    """
+    Return name, mode, owner and group of a line of els -l, None for other lines
+
+    >>> parse_els("-rw-r----- 1 user msdeode 42 Sep 05 06:00 fc+0001h00m")
+    {'name': 'fc+0001h00m', 'mode': '-rw-r-----', 'owner': 'user', 'group': 'msdeode'}
+    >>> parse_els("total 42") is None
+    True
+    """
+    fields = line.split(maxsplit=8)
+    if len(fields) < 9:
+        return None
+    # Links are listed as name -> target
+    name = fields[8].split(" -> ")[0].rstrip("/")
+    return {
+        "name": os.path.basename(name),
+        "mode": fields[0],
+        "owner": fields[2],
+        "group": fields[3],
+    }
+
+
+def problems(entry, group=DEFAULT_GROUP):
+    """
+    Return the problems of a listed file, an empty list if there are none
+
+    >>> problems({"mode": "-rw-------", "group": "other"})
+    ['group other instead of msdeode', 'not readable by group']
+    """
+    res = []
+    if entry["group"] != group:
+        res.append(f"group {entry['group']} instead of {group}")
+    if entry["mode"][4:5] != "r":
+        res.append("not readable by group")
+    return res
+
+
+def audit(files, group=DEFAULT_GROUP):
+    """
+    Check the group and permissions of archived files
+
+    Inputs
+    ------
+    files : list
+        dicts with case, exp, file_template and path of each file, files
+        not in ECFS (ec:/ectmp:) are left out
+    group : str
+        Group all files should belong to
+
+    Returns
+    -------
+    list of dicts with the COLUMNS of each file
+    """
+    files = [x for x in files if re.match("^ec", x["path"])]
+    directories = {}
+    for x in files:
+        directories.setdefault(os.path.dirname(x["path"]), []).append(x)
+
+    listings = ecfs_list_many(list(directories), detail=True)
+    rows = []
+    for (directory, dfiles), listing in zip(directories.items(), listings):
+        entries = {}
+        if not isinstance(listing, ECFSError):
+            for line in listing:
+                entry = parse_els(line)
+                if entry is not None:
+                    entries[entry["name"]] = entry
+        for x in dfiles:
+            row = dict.fromkeys(COLUMNS, "")
+            row.update({k: x[k] for k in ("case", "exp", "file_template", "path")})
+            entry = entries.get(os.path.basename(x["path"]))
+            if isinstance(listing, ECFSError):
+                row["problem"] = f"listing failed: {listing}"
+            elif entry is None:
+                row["problem"] = "missing"
+            else:
+                row.update({k: entry[k] for k in ("owner", "group", "mode")})
+                row["problem"] = "; ".join(problems(entry, group))
+            rows.append(row)
+    return rows
+
+
+def write_table(rows, outfile, problems_only=True):
+    """
+    Write audit rows as a tab separated table with a header line
+    """
+    outfile.write("\t".join(COLUMNS) + "\n")
+    for row in rows:
+        if problems_only and row["problem"] == "":
+            continue
+        outfile.write("\t".join(str(row[k]).replace("\t", " ") for k in COLUMNS) + "\n")
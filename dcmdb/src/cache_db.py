@@ -0,0 +1,34 @@
+"""
+SQLite files kept by dcmdb in the user cache directory.
+
+The listing cache and the transfer journal are stored below
+$XDG_CACHE_HOME/dcmdb, by default ~/.cache/dcmdb, and shared between the
+threads of a process and between processes.
+"""
+
+import os
+import sqlite3
+
+
+def cache_file(name):
+    """
+    Return the path of a file in the dcmdb cache directory
+
+    >>> cache_file("listings.sqlite").endswith("/dcmdb/listings.sqlite")
+    True
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_home, "dcmdb", name)
+
+
+def connect(dbfile, schema):
+    """
+    Open dbfile for use from several threads, creating it with schema
+
+    Callers serialize the use of the connection with their own lock, other
+    processes are waited for up to a minute.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(dbfile)), exist_ok=True)
+    con = sqlite3.connect(dbfile, timeout=60, check_same_thread=False)
+    con.executescript(schema)
+    return con
@@ -0,0 +1,711 @@
+"""
+Compiled SQLite catalog of all cases, experiments and their data availability.
+
+The catalog is a single indexed SQLite file built from all meta.yaml and
+data.json files below the cases directory. It is rebuilt incrementally based
+on the modification times of the source files, so keeping it up to date only
+costs a stat per case.
+"""
+
+import json
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+import yaml
+
+from .datafile import read_data
+from .profiling import span
+from .toc import read_toc, toc_files
+
+CATALOG_FILE = ".catalog.sqlite"
+SCHEMA_VERSION = 3
+
+# Empty entries of data.json are kept as inits rows with NULL in the missing columns
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    case_name TEXT PRIMARY KEY,
+    meta_mtime INTEGER,
+    data_mtime INTEGER,
+    data_version INTEGER
+);
+CREATE TABLE IF NOT EXISTS experiments (
+    case_name TEXT NOT NULL,
+    exp TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    domain_name TEXT,
+    resolution INTEGER,
+    levels INTEGER,
+    props TEXT NOT NULL,
+    PRIMARY KEY (case_name, exp)
+);
+CREATE TABLE IF NOT EXISTS domains (
+    case_name TEXT NOT NULL,
+    exp TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS file_templates (
+    case_name TEXT NOT NULL,
+    exp TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    file_template TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS path_templates (
+    case_name TEXT NOT NULL,
+    exp TEXT NOT NULL,
+    host TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    path_template TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS inits (
+    id INTEGER PRIMARY KEY,
+    case_name TEXT NOT NULL,
+    host TEXT NOT NULL,
+    exp TEXT,
+    file_template TEXT,
+    dtg TEXT
+);
+CREATE TABLE IF NOT EXISTS leadtimes (
+    init_id INTEGER NOT NULL,
+    leadtime INTEGER
+);
+CREATE TABLE IF NOT EXISTS tocs (
+    id INTEGER PRIMARY KEY,
+    case_name TEXT NOT NULL,
+    exp TEXT NOT NULL,
+    file_template TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    mtime INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fields (
+    toc_id INTEGER NOT NULL,
+    message INTEGER NOT NULL,
+    shortName TEXT,
+    paramId INTEGER,
+    typeOfLevel TEXT,
+    level INTEGER,
+    stepType TEXT
+);
+CREATE INDEX IF NOT EXISTS experiments_domain ON experiments (domain_name);
+CREATE INDEX IF NOT EXISTS experiments_resolution ON experiments (resolution);
+CREATE INDEX IF NOT EXISTS domains_case ON domains (case_name, exp);
+CREATE INDEX IF NOT EXISTS file_templates_case ON file_templates (case_name, exp);
+CREATE INDEX IF NOT EXISTS path_templates_case ON path_templates (case_name, exp);
+CREATE INDEX IF NOT EXISTS inits_case ON inits (case_name, exp, file_template, dtg);
+CREATE INDEX IF NOT EXISTS inits_dtg ON inits (dtg);
+CREATE INDEX IF NOT EXISTS leadtimes_init ON leadtimes (init_id);
+CREATE INDEX IF NOT EXISTS tocs_case ON tocs (case_name, exp, file_template);
+CREATE INDEX IF NOT EXISTS fields_toc ON fields (toc_id);
+CREATE INDEX IF NOT EXISTS fields_shortname ON fields (shortName, typeOfLevel, level);
+CREATE INDEX IF NOT EXISTS fields_paramid ON fields (paramId, typeOfLevel, level);
+"""
+
+# Keys of the TOC messages stored in the field index
+FIELD_KEYS = ("shortName", "paramId", "typeOfLevel", "level", "stepType")
+
+CASE_TABLES = (
+    "experiments",
+    "domains",
+    "file_templates",
+    "path_templates",
+    "inits",
+    "sources",
+)
+
+
+def parse_resolution(resolution):
+    """
+    Convert a domain resolution to an integer number of meters
+
+    >>> parse_resolution(500), parse_resolution("1000m"), parse_resolution(None)
+    (500, 1000, None)
+    """
+    if resolution is None:
+        return None
+    if isinstance(resolution, (int, float)):
+        return int(resolution)
+    m = re.fullmatch(r"\s*(\d+)\s*m?\s*", str(resolution))
+    return int(m.group(1)) if m is not None else None
+
+
+def format_dtg(dtg):
+    """
+    Normalise a date given as datetime or string to the data.json dtg format
+
+    >>> format_dtg(datetime(2024, 9, 1, 6))
+    '2024-09-01 06:00:00'
+    >>> format_dtg("2024-09-01 06")
+    '2024-09-01 06:00:00'
+    """
+    if dtg is None:
+        return None
+    if isinstance(dtg, datetime):
+        return dtg.strftime("%Y-%m-%d %H:%M:%S")
+    dtg = str(dtg)
+    return dtg + "2024-01-01 00:00:00"[len(dtg) :]
+
+
+def parse_filter(value):
+    """
+    Convert a command line filter value to a value, list or range for find
+
+    >>> parse_filter("fg10"), parse_filter("10"), parse_filter("t,u"), parse_filter("1:90")
+    ('fg10', 10, ['t', 'u'], range(1, 91))
+    """
+
+    def convert(x):
+        return int(x) if re.fullmatch(r"-?\d+", x) else x
+
+    if "," in value:
+        return [convert(x) for x in value.split(",")]
+    if re.fullmatch(r"-?\d+:-?\d+", value):
+        start, stop = value.split(":")
+        return range(int(start), int(stop) + 1)
+    return convert(value)
+
+
+def filter_clause(column, value):
+    """
+    Return an SQL condition and its arguments for a value, a collection or a range
+    """
+    if isinstance(value, range) and value.step == 1:
+        return f"{column} BETWEEN ? AND ?", [value.start, value.stop - 1]
+    if isinstance(value, (range, list, tuple, set)):
+        value = list(value)
+        return f"{column} IN ({','.join('?' * len(value))})", value
+    return f"{column} = ?", [value]
+
+
+class Catalog:
+    def __init__(self, path=None, dbfile=None, printlev=0):
+
+        self.path = path if path is not None else "cases"
+        self.dbfile = (
+            dbfile if dbfile is not None else os.path.join(self.path, CATALOG_FILE)
+        )
+        self.printlev = printlev
+        self._con = None
+
+    @property
+    def con(self):
+        if self._con is None:
+            self._con = sqlite3.connect(self.dbfile)
+            version = self._con.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                for table in (*CASE_TABLES, "leadtimes", "tocs", "fields"):
+                    self._con.execute(f"DROP TABLE IF EXISTS {table}")
+                self._con.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._con.executescript(SCHEMA)
+        return self._con
+
+    def close(self):
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+
+    def source_files(self):
+        """
+        Return the meta.yaml/data.json modification times of all cases on disk
+        """
+        sources = {}
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.name.startswith(".") or not entry.is_dir():
+                    continue
+                mtimes = []
+                for fname in ("meta.yaml", "data.json"):
+                    try:
+                        st = os.stat(os.path.join(entry.path, fname))
+                        mtimes.append(st.st_mtime_ns)
+                    except FileNotFoundError:
+                        mtimes.append(None)
+                if mtimes[0] is not None:
+                    sources[entry.name] = tuple(mtimes)
+        return sources
+
+    def build(self, force=False):
+        """
+        Compile all meta.yaml/data.json files into the catalog
+
+        Only cases whose source files changed since the last build are
+        re-read unless force is set.
+
+        Returns
+        -------
+        list of the cases (re)compiled or removed
+        """
+        con = self.con
+        known = {
+            row[0]: (row[1], row[2])
+            for row in con.execute(
+                "SELECT case_name, meta_mtime, data_mtime FROM sources"
+            )
+        }
+        sources = self.source_files()
+
+        changed = sorted(
+            case
+            for case, mtimes in sources.items()
+            if force or known.get(case) != mtimes
+        )
+        removed = sorted(set(known) - set(sources))
+
+        with con:
+            for case in removed + changed:
+                self._delete_case(case)
+            for case in changed:
+                if self.printlev > 0:
+                    print(" compile:", case)
+                with span("compile", case=case):
+                    self._insert_case(case, sources[case])
+
+        if self.printlev > 0 and len(removed) > 0:
+            print(" removed:", removed)
+
+        self.build_index(force)
+
+        return changed + removed
+
+    def toc_sources(self):
+        """
+        Return the TOC file and its modification time per case, exp and file template
+        """
+        sources = {}
+        for case, exp, file_template in self.con.execute(
+            "SELECT case_name, exp, file_template FROM file_templates "
+            "ORDER BY case_name, exp, position"
+        ):
+            for filename in toc_files(self.path, case, exp, file_template):
+                try:
+                    st = os.stat(filename)
+                except FileNotFoundError:
+                    continue
+                sources[(case, exp, file_template)] = (filename, st.st_mtime_ns)
+                break
+        return sources
+
+    def build_index(self, force=False):
+        """
+        Update the field index from the TOC files that changed since the last build
+
+        Returns
+        -------
+        list of the (case, exp, file_template) TOCs (re)indexed or removed
+        """
+        con = self.con
+        known = {
+            (row[0], row[1], row[2]): (row[3], row[4], row[5])
+            for row in con.execute(
+                "SELECT case_name, exp, file_template, filename, mtime, id FROM tocs"
+            )
+        }
+        sources = self.toc_sources()
+
+        changed = [
+            key
+            for key, source in sources.items()
+            if force or known.get(key, (None, None))[:2] != source
+        ]
+        removed = [key for key in known if key not in sources]
+
+        with con:
+            for key in changed + removed:
+                if key in known:
+                    toc_id = known[key][2]
+                    con.execute("DELETE FROM fields WHERE toc_id = ?", (toc_id,))
+                    con.execute("DELETE FROM tocs WHERE id = ?", (toc_id,))
+            for key in changed:
+                filename, mtime = sources[key]
+                if self.printlev > 0:
+                    print(" index:", filename)
+                cur = con.execute(
+                    "INSERT INTO tocs (case_name, exp, file_template, filename, mtime) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (*key, filename, mtime),
+                )
+                table = read_toc(filename)
+                columns = [
+                    (
+                        table[k].to_pylist()
+                        if k in table.column_names
+                        else [None] * table.num_rows
+                    )
+                    for k in ("message", *FIELD_KEYS)
+                ]
+                con.executemany(
+                    "INSERT INTO fields VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(cur.lastrowid, *row) for row in zip(*columns)],
+                )
+
+        return changed + removed
+
+    def _delete_case(self, case):
+        con = self.con
+        con.execute(
+            "DELETE FROM leadtimes WHERE init_id IN "
+            "(SELECT id FROM inits WHERE case_name = ?)",
+            (case,),
+        )
+        for table in CASE_TABLES:
+            con.execute(f"DELETE FROM {table} WHERE case_name = ?", (case,))
+
+    def _insert_case(self, case, mtimes):
+        con = self.con
+        with open(os.path.join(self.path, case, "meta.yaml")) as infile:
+            meta = yaml.safe_load(infile) or {}
+
+        for position, (exp, props) in enumerate(meta.items()):
+            domain = props.get("domain") or {}
+            con.execute(
+                "INSERT INTO experiments VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    case,
+                    exp,
+                    position,
+                    domain.get("name"),
+                    parse_resolution(domain.get("resolution")),
+                    domain.get("levels"),
+                    json.dumps(props, default=str),
+                ),
+            )
+            con.executemany(
+                "INSERT INTO domains VALUES (?, ?, ?, ?)",
+                [(case, exp, k, json.dumps(v, default=str)) for k, v in domain.items()],
+            )
+            con.executemany(
+                "INSERT INTO file_templates VALUES (?, ?, ?, ?)",
+                [
+                    (case, exp, i, x)
+                    for i, x in enumerate(props.get("file_templates") or [])
+                ],
+            )
+            for host, store in props.items():
+                if not isinstance(store, dict) or "path_template" not in store:
+                    continue
+                path_templates = store["path_template"]
+                if isinstance(path_templates, str):
+                    path_templates = [path_templates]
+                con.executemany(
+                    "INSERT INTO path_templates VALUES (?, ?, ?, ?, ?)",
+                    [(case, exp, host, i, x) for i, x in enumerate(path_templates)],
+                )
+
+        version = None
+        if mtimes[1] is not None:
+            version, data = read_data(os.path.join(self.path, case, "data.json"))
+            for host, exps in data.items():
+                for exp, templates in exps.items() or [(None, {})]:
+                    for file_template, dates in templates.items() or [(None, {})]:
+                        for dtg, leadtimes in dates.items() or [(None, [])]:
+                            cur = con.execute(
+                                "INSERT INTO inits (case_name, host, exp, file_template, dtg) "
+                                "VALUES (?, ?, ?, ?, ?)",
+                                (case, host, exp, file_template, dtg),
+                            )
+                            con.executemany(
+                                "INSERT INTO leadtimes VALUES (?, ?)",
+                                [(cur.lastrowid, x) for x in leadtimes],
+                            )
+
+        con.execute("INSERT INTO sources VALUES (?, ?, ?, ?)", (case, *mtimes, version))
+
+    def case_names(self):
+        return [
+            row[0]
+            for row in self.con.execute(
+                "SELECT case_name FROM sources ORDER BY case_name"
+            )
+        ]
+
+    def data_version(self, case):
+        """
+        Return the version of data.json for the given case, None if there is none
+        """
+        row = self.con.execute(
+            "SELECT data_version FROM sources WHERE case_name = ?", (case,)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def meta(self, case):
+        """
+        Return the content of meta.yaml for the given case
+        """
+        return {
+            exp: json.loads(props)
+            for exp, props in self.con.execute(
+                "SELECT exp, props FROM experiments WHERE case_name = ? ORDER BY position",
+                (case,),
+            )
+        }
+
+    def data(
+        self, case, host=None, exp=None, file_template=None, sdate=None, edate=None
+    ):
+        """
+        Return the availability information for the given case
+
+        The result has the same layout as data.json, optionally restricted to
+        a host, experiment, file_template and an inclusive date range.
+        """
+        where, args = ["i.case_name = ?"], [case]
+        for col, val in (
+            ("i.host", host),
+            ("i.exp", exp),
+            ("i.file_template", file_template),
+        ):
+            if val is not None:
+                where.append(f"{col} = ?")
+                args.append(val)
+        if sdate is not None:
+            where.append("i.dtg >= ?")
+            args.append(format_dtg(sdate))
+        if edate is not None:
+            where.append("i.dtg <= ?")
+            args.append(format_dtg(edate))
+
+        query = (
+            "SELECT i.host, i.exp, i.file_template, i.dtg, l.init_id, l.leadtime "
+            "FROM inits i LEFT JOIN leadtimes l ON l.init_id = i.id "
+            f"WHERE {' AND '.join(where)} ORDER BY i.id, l.rowid"
+        )
+        data = {}
+        for h, e, f, dtg, init_id, leadtime in self.con.execute(query, args):
+            level = data.setdefault(h, {})
+            for key, empty in ((e, {}), (f, {}), (dtg, [])):
+                if key is None:
+                    break
+                level = level.setdefault(key, empty)
+            if init_id is not None:
+                level.append(leadtime)
+        return data
+
+    def select(
+        self,
+        case=None,
+        exp=None,
+        domain=None,
+        resolution=None,
+        sdate=None,
+        edate=None,
+        host=None,
+    ):
+        """
+        Select experiments by case, experiment, domain name, resolution or date range
+
+        Case, exp and domain accept a single name or a list of names.
+        Resolution is given in meters, either as a single value or as a
+        (min, max) tuple. The dates are inclusive and select experiments with
+        at least one init time within the range.
+
+        Returns
+        -------
+        dict of selected case names with a list of experiments,
+        usable as selection for Cases
+        """
+
+        def as_list(x):
+            return [x] if isinstance(x, str) else list(x)
+
+        where, args = [], []
+        for col, val in (
+            ("e.case_name", case),
+            ("e.exp", exp),
+            ("e.domain_name", domain),
+        ):
+            if val is not None:
+                val = as_list(val)
+                where.append(f"{col} IN ({','.join('?' * len(val))})")
+                args.extend(val)
+        if resolution is not None:
+            if isinstance(resolution, (tuple, list)):
+                where.append("e.resolution BETWEEN ? AND ?")
+                args.extend(parse_resolution(x) for x in resolution)
+            else:
+                where.append("e.resolution = ?")
+                args.append(parse_resolution(resolution))
+        if sdate is not None or edate is not None or host is not None:
+            sub, subargs = ["i.case_name = e.case_name", "i.exp = e.exp"], []
+            if host is not None:
+                sub.append("i.host = ?")
+                subargs.append(host)
+            if sdate is not None:
+                sub.append("i.dtg >= ?")
+                subargs.append(format_dtg(sdate))
+            if edate is not None:
+                sub.append("i.dtg <= ?")
+                subargs.append(format_dtg(edate))
+            where.append(f"EXISTS (SELECT 1 FROM inits i WHERE {' AND '.join(sub)})")
+            args.extend(subargs)
+
+        query = "SELECT e.case_name, e.exp FROM experiments e"
+        if len(where) > 0:
+            query += f" WHERE {' AND '.join(where)}"
+        query += " ORDER BY e.case_name, e.position"
+
+        selection = {}
+        for c, e in self.con.execute(query, args):
+            selection.setdefault(c, []).append(e)
+        return selection
+
+    def find(self, case=None, exp=None, **filters):
+        """
+        Find messages in the TOCs of all cases
+
+        Inputs
+        ------
+        case, exp : str or list
+            Restrict the search to these cases and experiments
+        filters : dict
+            Values to match for any of shortName, paramId, typeOfLevel,
+            level and stepType, given as a single value, a list of values or
+            a range, e.g. shortName="t", typeOfLevel="hybrid", level=range(1, 91)
+
+        Returns
+        -------
+        list of dicts with case, exp, file_template, message position and the
+        indexed keys of each matching message
+        """
+        where, args = [], []
+        for key, value in filters.items():
+            if key not in FIELD_KEYS:
+                raise KeyError(f"{key} is not indexed, use one of {FIELD_KEYS}")
+            clause, values = filter_clause(f"f.{key}", value)
+            where.append(clause)
+            args.extend(values)
+        for column, value in (("t.case_name", case), ("t.exp", exp)):
+            if value is not None:
+                clause, values = filter_clause(
+                    column, [value] if isinstance(value, str) else value
+                )
+                where.append(clause)
+                args.extend(values)
+
+        columns = ("case", "exp", "file_template", "message", *FIELD_KEYS)
+        query = (
+            "SELECT t.case_name, t.exp, t.file_template, f.message, "
+            + ", ".join(f"f.{x}" for x in FIELD_KEYS)
+            + " FROM fields f JOIN tocs t ON t.id = f.toc_id"
+        )
+        if len(where) > 0:
+            query += f" WHERE {' AND '.join(where)}"
+        query += " ORDER BY t.case_name, t.exp, t.file_template, f.message"
+        return [dict(zip(columns, row)) for row in self.con.execute(query, args)]
+
+
+def configure_parser(sub_parsers, **kwargs):
+    parser = sub_parsers.add_parser(
+        "catalog",
+        help="Compiled SQLite catalog of the case meta database",
+        description="Compile all meta.yaml/data.json files into one indexed SQLite file and query it",
+        **kwargs,
+    )
+    parser.add_argument(
+        "action",
+        choices=["build", "query"],
+        help="build: (incrementally) compile the catalog, query: select experiments",
+    )
+    parser.add_argument(
+        "-path",
+        dest="path",
+        help="Path to directory with cases",
+        required=False,
+        default="cases",
+    )
+    parser.add_argument(
+        "-db",
+        dest="dbfile",
+        help=f"Catalog file, default is PATH/{CATALOG_FILE}",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-force",
+        action="store_true",
+        help="Recompile all cases regardless of modification times",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "-case",
+        dest="case",
+        required=False,
+        default=None,
+        help="Select case(s) as -case case1[:case2:...:caseN]",
+    )
+    parser.add_argument(
+        "-exp",
+        dest="exp",
+        required=False,
+        default=None,
+        help="Select exp(s) as -exp exp1[:exp2:...:expN]",
+    )
+    parser.add_argument(
+        "-domain",
+        dest="domain",
+        required=False,
+        default=None,
+        help="Select domain name(s) as -domain name1[:name2:...:nameN]",
+    )
+    parser.add_argument(
+        "-resolution",
+        dest="resolution",
+        required=False,
+        default=None,
+        help="Select resolution in meters as -resolution res or -resolution min:max",
+    )
+    parser.add_argument(
+        "-sdate",
+        dest="sdate",
+        required=False,
+        default=None,
+        help="Select experiments with init times from this date, as YYYY-MM-DD[ HH]",
+    )
+    parser.add_argument(
+        "-edate",
+        dest="edate",
+        required=False,
+        default=None,
+        help="Select experiments with init times until this date, as YYYY-MM-DD[ HH]",
+    )
+    parser.add_argument(
+        "-v",
+        action="append_const",
+        const=int,
+        help="Increase verbosity",
+    )
+
+    parser.set_defaults(func="dcmdb.src.catalog.execute")
+
+    return parser
+
+
+def execute(args, parser=None):
+
+    printlev = len(args.v) if args.v is not None else 0
+    catalog = Catalog(path=args.path, dbfile=args.dbfile, printlev=printlev)
+
+    if args.action == "build":
+        updated = catalog.build(force=args.force)
+        print(f"Catalog {catalog.dbfile}: {len(updated)} case(s) updated")
+    elif args.action == "query":
+        catalog.build()
+        resolution = args.resolution
+        if resolution is not None and ":" in resolution:
+            resolution = tuple(resolution.split(":"))
+        split = [
+            x.split(":") if x is not None else None
+            for x in (args.case, args.exp, args.domain)
+        ]
+        selection = catalog.select(
+            *split,
+            resolution=resolution,
+            sdate=args.sdate,
+            edate=args.edate,
+        )
+        for case, exps in selection.items():
+            print(f"{case}: {', '.join(exps)}")
+
+    catalog.close()
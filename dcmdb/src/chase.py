@@ -4,7 +4,12 @@ import argparse
 import sys
 from argparse import ArgumentParser, Namespace, _SubParsersAction
 
+from .audit import DEFAULT_GROUP
+from .catalog import Catalog, parse_filter
 from .cls.cases import Cases
+from .datafile import DATA_VERSIONS
+from .listing_cache import DEFAULT_TTL, MODES, ListingCache, set_listing_cache
+from .toc import TOC_FORMATS
 
 
 def set_verbosity(a):
@@ -64,6 +69,21 @@ def configure_parser(sub_parsers: _SubParsersAction = None, **kwargs) -> Argumen
         required=False,
         default=False,
     )
+    parser.add_argument(
+        "-incremental",
+        action="store_true",
+        help="Only scan init times from the last one in data.json and merge the result",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "-j",
+        dest="jobs",
+        type=int,
+        help="Number of path templates to scan or processes to build TOCs with concurrently, default is 1",
+        required=False,
+        default=1,
+    )
     parser.add_argument(
         "-toc",
         action="store_true",
@@ -71,6 +91,54 @@ def configure_parser(sub_parsers: _SubParsersAction = None, **kwargs) -> Argumen
         required=False,
         default=False,
     )
+    parser.add_argument(
+        "-toc_format",
+        dest="toc_format",
+        choices=list(TOC_FORMATS),
+        help="Format of the TOC files, default is json",
+        required=False,
+        default="json",
+    )
+    parser.add_argument(
+        "-find",
+        dest="find",
+        nargs="+",
+        metavar="KEY=VALUE",
+        help="Find fields in the TOCs of all cases, e.g. -find shortName=t typeOfLevel=hybrid level=1:90. "
+        + "Values can be lists as t,u or ranges as 1:90",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-migrate",
+        dest="migrate",
+        nargs="?",
+        type=int,
+        const=2,
+        choices=DATA_VERSIONS,
+        help="Rewrite data.json of the given case(s) in the given version, default 2",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-audit",
+        dest="audit",
+        nargs="?",
+        const="-",
+        metavar="FILE",
+        help="Check group and permissions of the archived files of the given case(s) "
+        + "and write the problems as a tab separated table to FILE, default stdout. "
+        + "Add -v to include all files",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-group",
+        dest="group",
+        help=f"Group the archived files should belong to for -audit, default is {DEFAULT_GROUP}",
+        required=False,
+        default=DEFAULT_GROUP,
+    )
     parser.add_argument(
         "-path",
         dest="path",
@@ -78,6 +146,32 @@ def configure_parser(sub_parsers: _SubParsersAction = None, **kwargs) -> Argumen
         required=False,
         default="cases",
     )
+    parser.add_argument(
+        "-catalog",
+        action="store_true",
+        help="Read cases from the compiled catalog, see dcmdb catalog build",
+        required=False,
+        default=False,
+    )
+    parser.add_argument(
+        "-listings",
+        dest="listings",
+        choices=MODES,
+        help="Use of the cached archive listings: refresh lists the archive again, "
+        + "use reuses listings younger than -ttl except for the directories from "
+        + "the -incremental init time on, offline only uses cached listings "
+        + "regardless of their age. Default is refresh",
+        required=False,
+        default="refresh",
+    )
+    parser.add_argument(
+        "-ttl",
+        dest="ttl",
+        type=float,
+        help=f"Seconds cached archive listings are valid, default is {DEFAULT_TTL}",
+        required=False,
+        default=DEFAULT_TTL,
+    )
     parser.add_argument(
         "-v",
         action="append_const",
@@ -96,10 +190,58 @@ def configure_parser(sub_parsers: _SubParsersAction = None, **kwargs) -> Argumen
     return parser
 
 
+def find(args, case=None):
+    """
+    Print the messages in the TOCs of all cases matching the -find filters
+    """
+    filters = {}
+    for item in args.find:
+        key, sep, value = item.partition("=")
+        if sep == "":
+            print(f"Give -find filters as KEY=VALUE, not {item}")
+            sys.exit(1)
+        filters[key] = parse_filter(value)
+
+    catalog = Catalog(path=args.path, printlev=max(set_verbosity(args) - 1, 0))
+    catalog.build()
+    try:
+        found = catalog.find(
+            case=case,
+            exp=args.exp.split(":") if args.exp is not None else None,
+            **filters,
+        )
+    except KeyError as e:
+        print(e.args[0])
+        sys.exit(1)
+    catalog.close()
+
+    groups = {}
+    for row in found:
+        groups.setdefault((row["case"], row["exp"], row["file_template"]), []).append(
+            row
+        )
+    for (c, e, f), rows in groups.items():
+        print(f"{c} {e} {f}: {len(rows)} message(s)")
+        if set_verbosity(args) > 0:
+            for row in rows:
+                print(
+                    "  ",
+                    " ".join(
+                        f"{k}={v}" for k, v in row.items() if k not in ("case", "exp")
+                    ),
+                )
+    print(f"Found {len(found)} message(s) in {len(groups)} TOC(s)")
+
+
 def execute(args: Namespace, parser: ArgumentParser = None) -> int:
-    test = any(vars(args).get(k) for k in ["list", "scan", "case", "toc"])
+    test = any(
+        vars(args).get(k)
+        for k in ["list", "scan", "case", "toc", "migrate", "find", "audit"]
+    )
     if not test:
-        print("Any of the command line options must be set: -list, -scan, -case, -toc")
+        print(
+            "Any of the command line options must be set: -list, -scan, -case, -toc, -migrate, -find, -audit"
+        )
         parser.print_help()
         sys.exit(1)
 
@@ -115,21 +257,36 @@ def execute(args: Namespace, parser: ArgumentParser = None) -> int:
     else:
         selection = []
 
+    if args.find is not None:
+        find(args, case)
+        return
+
+    set_listing_cache(ListingCache(ttl=args.ttl, mode=args.listings))
+
     # Construct the case structure
     myc = Cases(
         selection=selection,
         printlev=set_verbosity(args),
         path=args.path,
         host=args.host,
+        catalog=args.catalog or None,
     )
 
     # Run the actions
     if args.scan:
-        myc.scan()
+        myc.scan(jobs=args.jobs, incremental=args.incremental)
     elif args.list:
         myc.print()
     elif args.toc:
-        myc.toc()
+        myc.toc(workers=args.jobs, toc_format=args.toc_format)
+    elif args.migrate is not None:
+        myc.migrate(args.migrate)
+    elif args.audit is not None:
+        if args.audit == "-":
+            myc.audit(args.group)
+        else:
+            with open(args.audit, "w") as outfile:
+                myc.audit(args.group, outfile)
 
 
 def main(*args):
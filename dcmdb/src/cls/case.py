@@ -1,39 +1,78 @@
+import datetime
 import json
 import os
+import time
+from functools import partial
 
+import yaml
+
+from .. import datafile
+from ..helpers import load_cached
+from ..listing_cache import ListingUnavailable, get_listing_cache
+from ..profiling import span
 from .experiment import Exp
 
 
 class Case:
-    def __init__(self, host, path, printlev, props, case):
+    def __init__(self, host, path, printlev, props, case, catalog=None, exps=None):
 
         self.host, self.path, self.printlev = host, path, printlev
         self.case = case
         self.printlev = printlev
+        self.catalog = catalog
+        self.exps = exps if exps is not None else []
+        self.version = datafile.DATA_VERSION
 
-        self.data = self.load()
-        self.runs = {}
-        if len(props) > 1:
-            for exp, val in props.items():
-                if host in val:
-                    try:
-                        if exp not in self.data[host]:
-                            self.data[host][exp] = {}
-                    except KeyError:
-                        self.data[host] = {}
-                        self.data[host][exp] = {}
-                    self.runs[exp] = Exp(
-                        path, case, exp, host, printlev, val, self.data[host][exp]
-                    )
-        else:
-            for exp, val in props.items():
-                if host in val:
-                    if exp not in self.data[host]:
-                        self.data[host][exp] = {}
-                    self.runs = Exp(
-                        path, case, exp, host, printlev, val, self.data[host][exp]
-                    )
-        self.names = [x for x in props]
+        # meta.yaml, data.json and the runs are loaded on first access
+        self._props = props
+        self._data = None
+        self._runs = None
+
+    @property
+    def props(self):
+        if self._props is None:
+            self._props = self.load_meta()
+        return self._props
+
+    @property
+    def names(self):
+        return [x for x in self.props]
+
+    @property
+    def data(self):
+        if self._data is None:
+            data = self.load()
+            data.setdefault(self.host, {})
+            for exp, val in self.props.items():
+                if self.host in val and exp not in data[self.host]:
+                    data[self.host][exp] = {}
+            self._data = data
+        return self._data
+
+    @property
+    def runs(self):
+        if self._runs is None:
+            runs = {
+                exp: Exp(
+                    self.path,
+                    self.case,
+                    exp,
+                    self.host,
+                    self.printlev,
+                    val,
+                    partial(self.exp_data, exp),
+                )
+                for exp, val in self.props.items()
+                if self.host in val
+            }
+            if len(self.props) > 1 or len(runs) == 0:
+                self._runs = runs
+            else:
+                self._runs = runs.popitem()[1]
+        return self._runs
+
+    def exp_data(self, exp):
+        return self.data[self.host].get(exp, {})
 
     def print(self, printlev=None):
         if printlev is not None:
@@ -49,45 +88,183 @@ class Case:
         else:
             self.runs.print(self.printlev)
 
-    def toc(self, printlev=None):
+    def toc(self, printlev=None, workers=1, toc_format="json"):
         if printlev is not None:
             self.printlev = printlev
 
         if isinstance(self.runs, dict):
             for run, exp in self.runs.items():
-                exp.toc(self.printlev)
+                exp.toc(self.printlev, workers, toc_format)
+        else:
+            self.runs.toc(self.printlev, workers, toc_format)
+
+    def load_meta(self):
+        if self.catalog is not None:
+            meta = self.catalog.meta(self.case)
         else:
-            self.runs.toc(self.printlev)
+            meta = load_cached(f"{self.path}/{self.case}/meta.yaml", yaml.safe_load)
+
+        if len(self.exps) > 0:
+            missing = [x for x in self.exps if x not in meta]
+            if len(missing) > 0:
+                print("\nCould not find exp:", missing, "\n")
+            meta = {k: v for k, v in meta.items() if k in self.exps}
+
+        return meta
 
     def load(self):
         filename = f"{self.path}/{self.case}/data.json"
-        if os.path.isfile(filename):
-            with open(filename, "r") as infile:
-                data = json.load(infile)
-                infile.close()
+        if self.catalog is not None:
+            data = self.catalog.data(self.case)
+            self.version = self.catalog.data_version(self.case) or self.version
+        elif os.path.isfile(filename):
+            with span("read data.json", case=self.case):
+                self.version, data = load_cached(filename, datafile.load)
+            # Copy the two levels modified by the case, the memo is shared
+            data = {host: dict(exps) for host, exps in data.items()}
         else:
             data = {}
             data[self.host] = {}
         return data
 
-    def scan(self):
-        if not self.exp_given:
+    def scan(self, executor=None, incremental=False):
+        """
+        Scan the archive for all experiments and rewrite data.json
+
+        Inputs
+        ------
+        executor : concurrent.futures.Executor
+            Scan the path templates concurrently on the executor
+        incremental : bool
+            Only scan init times from the last one found in data.json and
+            merge the result into the existing data
+        """
+        self.collect_scan(self.submit_scan(executor, incremental))
+
+    @property
+    def checkpoint_file(self):
+        return f"{self.path}/{self.case}/.scan_checkpoint.json"
+
+    def data_mtime(self):
+        filename = f"{self.path}/{self.case}/data.json"
+        return os.path.getmtime(filename) if os.path.isfile(filename) else None
+
+    def load_checkpoint(self, incremental):
+        """
+        Read the results of an interrupted scan of the same kind
+
+        The checkpoint is dropped when data.json changed since the scan
+        started or when it is older than the TTL of the listing cache, as the
+        archive has to be listed again anyway.
+        """
+        state = {
+            "host": self.host,
+            "incremental": incremental,
+            "started": time.time(),
+            "data_mtime": self.data_mtime(),
+            "done": {},
+        }
+        if os.path.isfile(self.checkpoint_file):
+            with open(self.checkpoint_file, "r") as infile:
+                checkpoint = json.load(infile)
+            age = state["started"] - checkpoint.get("started", 0)
+            if not all(
+                checkpoint.get(k) == state[k]
+                for k in ("host", "incremental", "data_mtime")
+            ):
+                print(" ignore checkpoint of another scan", self.checkpoint_file)
+            elif age > get_listing_cache().ttl:
+                print(" ignore outdated checkpoint", self.checkpoint_file)
+            else:
+                print(" resume scan from", self.checkpoint_file)
+                state = checkpoint
+        return state
+
+    def write_checkpoint(self, state):
+        tmpfile = self.checkpoint_file + ".tmp"
+        with open(tmpfile, "w") as outfile:
+            json.dump(state, outfile)
+        os.replace(tmpfile, self.checkpoint_file)
+
+    def last_init(self, exp):
+        """
+        Return the last init time found for all file templates of exp in data.json
+
+        Returns
+        -------
+        datetime.datetime or None if any file template has no data
+        """
+        content = self.data[self.host].get(exp, {})
+        if len(content) == 0 or not all(len(x) > 0 for x in content.values()):
+            return None
+        return min(
+            datetime.datetime.fromisoformat(max(dates)) for dates in content.values()
+        )
+
+    def submit_scan(self, executor=None, incremental=False):
+        """
+        Submit the scan of all experiments, see collect_scan for the result
+        """
+        if not self.exp_given and not incremental:
             if self.data[self.host] != {}:
-                self.data[self.host] = {}
                 print(" rewrite data.json from scratch!")
         if isinstance(self.runs, dict):
-            for name, exp in self.runs.items():
-                result, signal = exp.scan()
-                if signal:
-                    self.data[self.host][name] = result
-                else:
-                    print("  no data found for", name)
+            runs = self.runs.items()
+        else:
+            runs = [(self.names[0], self.runs)]
+
+        state = self.load_checkpoint(incremental)
+        pending = []
+        for name, exp in runs:
+            since = self.last_init(name) if incremental else None
+            futures = exp.submit_scan(executor, since, state["done"].get(name))
+            pending.append((name, exp, futures))
+        return state, pending
+
+    def collect_scan(self, pending):
+        """
+        Store the scan results in data.json
+
+        The result of each path template is checkpointed so that an interrupted
+        scan can be resumed by running it again.
+        """
+        state, pending = pending
+
+        # A full scan replaces the data of the host once all listings are done
+        if self.exp_given or state["incremental"]:
+            data = dict(self.data[self.host])
         else:
-            result, signal = self.runs.scan()
-            if signal:
-                self.data[self.host][self.names[0]] = result
+            data = {}
+        unavailable = []
+        for name, exp, futures in pending:
+
+            def checkpoint(path_template, result, name=name):
+                state["done"].setdefault(name, {})[path_template] = result
+                self.write_checkpoint(state)
+
+            try:
+                result, signal = exp.collect_scan(futures, checkpoint)
+            except ListingUnavailable as e:
+                print("  listing unavailable for", name, ":", e)
+                unavailable.append(name)
+                continue
+            if state["incremental"]:
+                if any(len(x) > 0 for x in result.values()):
+                    data[name] = self.merge(name, result)
+                else:
+                    print("  no new data found for", name)
+            elif signal:
+                data[name] = result
             else:
-                print("  no data found for", self.names)
+                print("  no data found for", name)
+
+        if len(unavailable) > 0:
+            print(
+                f" data.json of {self.case} is left unchanged, "
+                + f"listings unavailable for {unavailable}"
+            )
+            return
+        self.data[self.host] = data
 
         # Print a summary
         if self.printlev > 0:
@@ -95,13 +272,62 @@ class Case:
             self.print()
 
         self.dump()
+        if os.path.isfile(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+
+    def merge(self, exp, result):
+        """
+        Merge new dates and lead times into the data of exp
+
+        >>> case = Case("atos", ".", 0, {}, "mycase")
+        >>> case._data = {"atos": {"e": {"f": {"2024-09-05 00:00:00": [0, 3600]}}}}
+        >>> case.merge("e", {"f": {"2024-09-05 00:00:00": [3600, 7200]}})
+        {'f': {'2024-09-05 00:00:00': [0, 3600, 7200]}}
+        """
+        merged = {}
+        old = self.data[self.host].get(exp, {})
+        for file_template in dict.fromkeys([*old, *result]):
+            # Copy, the loaded data may be shared with other readers
+            dates = dict(old.get(file_template, {}))
+            for dtg, leadtimes in result.get(file_template, {}).items():
+                if dtg in dates:
+                    leadtimes = sorted(
+                        set(dates[dtg]) | set(leadtimes), key=lambda x: (x is None, x)
+                    )
+                dates[dtg] = leadtimes
+            merged[file_template] = dates
+        return merged
+
+    def dump(self, version=None):
+        """
+        Write data.json, by default in the version it was read in
+        """
+        filename = f"{self.path}/{self.case}/data.json"
+        version = version if version is not None else self.version
+        print("  write to:", filename)
+        with span("write data.json", case=self.case):
+            datafile.write_data(filename, self.data, version)
+        self.version = version
 
-    def dump(self):
+    def migrate(self, version=2):
+        """
+        Rewrite data.json in the given version
+        """
         filename = f"{self.path}/{self.case}/data.json"
-        with open(filename, "w") as outfile:
-            print("  write to:", filename)
-            json.dump(self.data, outfile, indent=1)
-            outfile.close()
+        if not os.path.isfile(filename):
+            print("  no data.json for", self.case)
+            return
+        old_version, data = datafile.read_data(filename)
+        if old_version == version:
+            print(f"  {filename} already in version {version}")
+            return
+        size = os.path.getsize(filename)
+        datafile.write_data(filename, data, version)
+        self.version = version
+        print(
+            f"  {filename}: version {old_version} -> {version},",
+            f"{size} -> {os.path.getsize(filename)} bytes",
+        )
 
     def reconstruct(self, dtg=None, leadtime=None, file_template=None):
         res = []
@@ -111,3 +337,10 @@ class Case:
         else:
             res.extend(self.runs.reconstruct(dtg, leadtime, file_template))
         return res
+
+    def iter_reconstruct(self, dtg=None, leadtime=None, file_template=None):
+        if isinstance(self.runs, dict):
+            for run, exp in self.runs.items():
+                yield from exp.iter_reconstruct(dtg, leadtime, file_template)
+        else:
+            yield from self.runs.iter_reconstruct(dtg, leadtime, file_template)
@@ -1,24 +1,43 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
 import os
 import re
 import subprocess
 import sys
 
-import yaml
-
-from ..ecfs import ecfs_copy
-from ..helpers import find_files
+from ..audit import DEFAULT_GROUP, audit, write_table
+from ..catalog import Catalog
+from ..ecfs import ecfs_fetch
+from ..remote import RemoteHost, missing_files
 from .case import Case
 
 
 class Cases:
-    def __init__(self, names=None, path=None, printlev=None, host=None, selection=None):
+    def __init__(
+        self,
+        names=None,
+        path=None,
+        printlev=None,
+        host=None,
+        selection=None,
+        catalog=None,
+    ):
 
         self.path = path if path is not None else "cases"
         self.printlev = printlev if printlev is not None else 1
         self.host = host if host is not None else self.get_hostname()
         self.selection = selection if selection is not None else {}
+        self.remotes = {}
+
+        # Use the compiled catalog, given as Catalog, catalog file or True for the default
+        if catalog is True:
+            catalog = Catalog(self.path)
+        elif isinstance(catalog, str):
+            catalog = Catalog(self.path, dbfile=catalog)
+        self.catalog = catalog
+        if self.catalog is not None:
+            self.catalog.build()
 
         if isinstance(self.selection, dict):
             self.exp_given = False
@@ -40,25 +59,42 @@ class Cases:
         else:
             self.names = names
 
-        self.cases, self.names, self.meta = self.load_cases()
-
-        self.domains = {}
-        for k, v in self.meta.items():
-            self.domains[k] = {}
-            for x, y in v.items():
-                self.domains[k][x] = y["domain"]
+        self.cases, self.names = self.load_cases()
 
         if len(self.names) == 0:
             print("No cases found")
-            print(
-                "Available cases:",
-                [
-                    x.split("/")[0]
-                    for x in find_files(self.path, "meta.yaml", recursive=False)
-                ],
-            )
+            print("Available cases:", self.list_cases())
             sys.exit()
 
+    @property
+    def meta(self):
+        return {name: case.props for name, case in self.cases.items()}
+
+    @property
+    def domains(self):
+        return {
+            name: {exp: val["domain"] for exp, val in meta.items()}
+            for name, meta in self.meta.items()
+        }
+
+    def list_cases(self):
+        """
+        Return the names of all case directories holding a meta.yaml file
+        """
+        if self.catalog is not None:
+            return self.catalog.case_names()
+
+        case_list = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if (
+                    not entry.name.startswith(".")
+                    and entry.is_dir()
+                    and os.path.isfile(os.path.join(entry.path, "meta.yaml"))
+                ):
+                    case_list.append(entry.name)
+        return sorted(case_list)
+
     def get_hostname(self):
 
         import socket
@@ -69,12 +105,73 @@ class Cases:
 
         return None
 
-    def scan(self):
-        if isinstance(self.cases, dict):
-            for case in self.cases:
-                self.cases[case].scan()
+    def scan(self, jobs=1, incremental=False):
+        """
+        Scan the archive for all cases
+
+        Inputs
+        ------
+        jobs : int
+            Number of path templates to scan concurrently. All scans are
+            submitted before the results are collected case by case, so
+            data.json and the printout are the same as for a serial scan.
+        incremental : bool
+            Only scan init times from the last one found in data.json
+        """
+        cases = self.cases.values() if isinstance(self.cases, dict) else [self.cases]
+        if jobs > 1:
+            with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+                pending = [
+                    (case, case.submit_scan(executor, incremental)) for case in cases
+                ]
+                for case, futures in pending:
+                    case.collect_scan(futures)
         else:
-            self.cases.scan()
+            for case in cases:
+                case.scan(incremental=incremental)
+
+    def audit(self, group=DEFAULT_GROUP, outfile=None):
+        """
+        Check group and permissions of all archived files of the cases
+
+        Every archive directory is listed once, see audit.audit. The files
+        with problems, or all files if printlev > 0, are written to outfile
+        as a tab separated table and a summary is printed to stderr.
+
+        Returns
+        -------
+        list of the audit rows of all files
+        """
+        files = []
+        cases = self.cases.values() if isinstance(self.cases, dict) else [self.cases]
+        for case in cases:
+            runs = case.runs.values() if isinstance(case.runs, dict) else [case.runs]
+            for exp in runs:
+                for file_template in exp.data:
+                    files.extend(
+                        {
+                            "case": exp.case,
+                            "exp": exp.name,
+                            "file_template": file_template,
+                            "path": path,
+                        }
+                        for path in exp.iter_reconstruct(file_template=file_template)
+                    )
+
+        rows = audit(files, group)
+        write_table(rows, outfile or sys.stdout, problems_only=self.printlev < 1)
+        nproblems = len([x for x in rows if x["problem"] != ""])
+        ndirs = len({os.path.dirname(x["path"]) for x in rows})
+        print(
+            f"Audited {len(rows)} archived files in {ndirs} directories,",
+            f"{nproblems} with problems",
+            file=sys.stderr,
+        )
+        return rows
+
+    def migrate(self, version=2):
+        for case in self.cases.values():
+            case.migrate(version)
 
     def load_cases(self):
         def intersection(lst1, lst2):
@@ -82,10 +179,7 @@ class Cases:
             lst4 = [value for value in lst1 if value not in lst3]
             return lst3, lst4
 
-        meta_file = "meta.yaml"
-        case_list = [
-            x.split("/")[0] for x in find_files(self.path, meta_file, recursive=False)
-        ]
+        case_list = self.list_cases()
         if self.names is not None:
             if len(self.names) > 0:
                 case_list, missing = intersection(self.names, case_list)
@@ -93,31 +187,23 @@ class Cases:
                     print("\nCould not find cases:", missing, "\n")
 
         if len(case_list) == 0:
-            return {}, [], {}
+            return {}, []
 
+        # The cases only read their meta.yaml/data.json when first used
         res = {}
-        mm = {}
         for x in case_list:
-            p = "{}/{}/{}".format(self.path, x, meta_file)
-            meta = yaml.safe_load(open(p))
-            if x in self.selection:
-                y = self.selection[x]
-                if isinstance(y, str):
-                    y = [y]
-                if len(y) > 0:
-                    exp_list, missing = intersection(y, meta.keys())
-                    if len(missing) > 0:
-                        print("\nCould not find exp:", missing, "\n")
-                    meta = {k: v for k, v in meta.items() if k in exp_list}
-
-            mm[x] = meta
-            res[x] = Case(self.host, self.path, self.printlev, meta, x)
+            exps = self.selection.get(x, [])
+            if isinstance(exps, str):
+                exps = [exps]
+            res[x] = Case(
+                self.host, self.path, self.printlev, None, x, self.catalog, exps
+            )
             res[x].exp_given = self.exp_given
 
         if self.printlev > 0:
             print("Loaded:", case_list)
 
-        return res, case_list, mm
+        return res, case_list
 
     def show(self):
 
@@ -141,7 +227,7 @@ class Cases:
         else:
             self.cases.print(self.printlev)
 
-    def toc(self, printlev=None):
+    def toc(self, printlev=None, workers=1, toc_format="json"):
 
         if printlev is not None:
             self.printlev = printlev
@@ -149,9 +235,9 @@ class Cases:
         if isinstance(self.cases, dict):
             for name, case in self.cases.items():
                 print("\nCase:", name)
-                case.toc(self.printlev)
+                case.toc(self.printlev, workers, toc_format)
         else:
-            self.cases.toc(self.printlev)
+            self.cases.toc(self.printlev, workers, toc_format)
 
     def reconstruct(self, dtg=None, leadtime=None, file_template=None):
 
@@ -164,18 +250,36 @@ class Cases:
 
         return res
 
+    def iter_reconstruct(self, dtg=None, leadtime=None, file_template=None):
+        if isinstance(self.cases, dict):
+            for name, case in self.cases.items():
+                yield from case.iter_reconstruct(dtg, leadtime, file_template)
+        else:
+            yield from self.cases.iter_reconstruct(dtg, leadtime, file_template)
+
     def get(self, files=[], outpath="."):
-        clean = True
+        """
+        Copy archived (ec:/ectmp:) files to outpath and link the other files
+
+        Archived files are copied in batched, concurrent ecp calls.
+
+        Returns
+        -------
+        dict of each file and None on success, the ECFSError of a failed copy
+        or the FileExistsError of a link that was already there
+        """
+        archived = [f for f in files if re.match("^ec", f)]
+        res = ecfs_fetch(archived, outpath, self.printlev) if archived else {}
         for f in files:
-            if re.match("^ec", f):
-                ecfs_copy(f, outpath, self.printlev)
-            else:
-                try:
-                    os.symlink(f, os.path.join(outpath, os.path.basename(f)))
-                except FileExistsError:
-                    clean = False
+            if f in res:
+                continue
+            try:
+                os.symlink(f, os.path.join(outpath, os.path.basename(f)))
+                res[f] = None
+            except FileExistsError as e:
+                res[f] = e
 
-        return clean
+        return {f: res[f] for f in files}
 
     def clean(self, files=[], outpath="."):
 
@@ -184,42 +288,62 @@ class Cases:
             os.remove(f)
             print("  remove:", f)
 
-    def check_remote(self, files=[], remote=None):
-
-        bare_files = [os.path.basename(x) for x in files]
-        listcmd = ["ssh", remote["host"], "ls", "-1", remote["outpath"]]
-        cmd = subprocess.Popen(listcmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        cmd_out, cmd_err = cmd.communicate()
-        if cmd_out is not None:
-            for line in cmd_out.splitlines():
-                fname = line.decode("utf-8")
-                try:
-                    i = bare_files.index(fname)
-                    bare_files.pop(i)
-                except ValueError:
-                    pass
-
-        return bare_files
+    def remote_host(self, host):
+        """
+        Return the RemoteHost of host, all commands to a host share one connection
+        """
+        if host not in self.remotes:
+            self.remotes[host] = RemoteHost(host, printlev=self.printlev)
+        return self.remotes[host]
+
+    def check_remote(self, files=[], remote=None, sizes=None, manifest=None):
+        """
+        Return the base names of files missing on the remote host
+
+        Inputs
+        ------
+        files : list
+            Files to check
+        remote : dict
+            host and outpath on the remote host
+        sizes : list
+            Sizes of files, files of another size on the remote host are missing
+        manifest : dict
+            Remote manifest of outpath or a directory above, fetched if not given
+
+        Returns
+        -------
+        list of base names
+        """
+        if manifest is None:
+            manifest = self.remote_host(remote["host"]).manifest(remote["outpath"])
+        if sizes is None:
+            sizes = [None] * len(files)
+        return missing_files(files, sizes, remote["outpath"], manifest)
 
     def transfer(self, files=[], outpath=".", remote=None):
 
         os.makedirs(outpath, exist_ok=True)
-        missing_files = self.check_remote(files, remote)
+        missing = self.check_remote(files, remote)
 
-        if len(missing_files) > 0:
-            nfiles = len(missing_files)
+        if len(missing) > 0:
+            nfiles = len(missing)
             print(f"  Transfer {nfiles} files this date")
-            clean = self.get(files, outpath)
-            cmd = 'ssh {} "mkdir -p {}"'.format(remote["host"], remote["outpath"])
-            print(cmd)
-            os.system(cmd)
+            missing = set(missing)
+            res = self.get(
+                [f for f in files if os.path.basename(f) in missing], outpath
+            )
+            host = self.remote_host(remote["host"])
+            host.run("mkdir", "-p", remote["outpath"])
             rhost = remote["host"]
             rpath = remote["outpath"]
-            cmd = f"rsync -vaux --copy-unsafe-links {outpath}/ {rhost}:{rpath}/"
-            print(cmd)
-            os.system(cmd)
-            if clean:
-                self.clean(files, outpath)
+            cmd = ["rsync", "-vaux", "--copy-unsafe-links", "-e", host.rsync_shell()]
+            cmd += [f"{outpath}/", f"{rhost}:{rpath}/"]
+            print(" ".join(cmd))
+            subprocess.run(cmd)
+            # Only remove what was fetched here, failed files were never
+            # fetched and existing links are left alone
+            self.clean([f for f, e in res.items() if e is None], outpath)
         else:
             nfiles = len(files)
             print(f"  all {nfiles} files already in place for this date")
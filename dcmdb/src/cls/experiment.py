@@ -1,25 +1,16 @@
-import glob
-import json
+import datetime
 import os
 import re
 import sys
 import tempfile
-from pathlib import Path
+from functools import partial
 
-import fsspec
-import gribscan
-from upath import UPath
-
-from ..eccodes_helpers import grib_ls
-from ..ecfs import ecfs_list
-from ..helpers import find_files, merge_dict_items
-from ..referencing import combine_joined_reference_parquet, export_dict_to_parq
-from ..timehandling import hub, leadtime2hm, simulation_datetime
-
-ECCODES_DEFINITIONS_PATH = gribscan.eccodes.codes_definition_path()
-ECCODES_DEODE_DEF_PATH = Path(__file__).parent.parent / "eccodes" / "definitions"
-ECCODES_DEFINITIONS_PATH = f"{ECCODES_DEODE_DEF_PATH}:{ECCODES_DEFINITIONS_PATH}"
-gribscan.eccodes.codes_set_definitions_path(ECCODES_DEFINITIONS_PATH)
+from .. import referencing, timehandling
+from ..helpers import file_stats, find_files, merge_dict_items, submit
+from ..profiling import span
+from ..referencing import DEFAULT_BATCH_SIZE, DEFAULT_RECORD_SIZE
+from ..timehandling import expand_paths, leadtime2hm, simulation_datetime
+from ..toc import TOC_FORMATS, read_toc, select, toc_files, write_toc
 
 
 class Exp:
@@ -33,7 +24,18 @@ class Exp:
         self.file_templates = val["file_templates"]
         self.path_template = val[host]["path_template"]
         self.domain = val["domain"]
-        self.data = data
+        # data may be given as a callable to defer loading until first use
+        self._data = data
+
+    @property
+    def data(self):
+        if callable(self._data):
+            self._data = self._data()
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
 
     def check_template(self, x):
 
@@ -94,6 +96,15 @@ class Exp:
         -------
         list of filenames
         """
+        return list(self.iter_reconstruct(dtg, leadtime, file_template))
+
+    def iter_reconstruct(self, dtg=None, leadtime=None, file_template=None):
+        """
+        Generate the filenames of reconstruct lazily
+
+        Each file template is compiled once and expanded for all dates and
+        lead times in one pass, see timehandling.expand_paths.
+        """
 
         def matching(files, src):
             res = []
@@ -113,35 +124,29 @@ class Exp:
         else:
             files = [file_template]
 
-        result = []
-        for file in matching(files, self.data.keys()):
+        if leadtime is not None and leadtime != []:
+            leadtime = leadtime if isinstance(leadtime, list) else [leadtime]
+
+        for file in matching(files, list(self.data.keys())):
+            content = self.data[file]
             if dtg is None or dtg == []:
-                dtgs = list(self.data[file].keys())
+                dtgs = list(content.keys())
             else:
                 if isinstance(dtg, str):
                     dtgs = [dtg]
                 else:
                     dtgs = dtg
 
+            template = f"{self.path_template}/{file}"
             for ddd in dtgs:
-                if ddd in self.data[file]:
+                if ddd in content:
                     if leadtime is None or leadtime == []:
-                        leadtimes = self.data[file][ddd]
+                        leadtimes = content[ddd]
                     else:
-                        if isinstance(leadtime, list):
-                            leadtimes = [x for x in leadtime]
-                        else:
-                            leadtimes = [leadtime]
-
-                    result.extend(
-                        [
-                            hub(f"{self.path_template}/{file}", ddd, l)
-                            for l in leadtimes
-                            if l in self.data[file][ddd]
-                        ]
-                    )
+                        available = set(content[ddd])
+                        leadtimes = [x for x in leadtime if x in available]
 
-        return result
+                    yield from expand_paths(template, [ddd], leadtimes)
 
     def print(self, printlev=None):
         if printlev is not None:
@@ -211,154 +216,187 @@ class Exp:
                             dates[0], content[dates[0]][-1], fname
                         )
                     print("    Example:", example)
-                    if re.match("^ec", example[0]):
-                        if self.printlev > 2:
-                            print("Checking", example[0])
-                        listing = ecfs_list(example[0], detail=True)
-
-                        if listing is not None:
-                            for line in listing:
-                                if "msdeode" not in line:
-                                    print(
-                                        "ERROR:Wrong group for",
-                                        self.case,
-                                        ":",
-                                        self.name,
-                                        line,
-                                    )
 
     def build_toc(
         self,
         file_template,
         files_to_scan,
         gribref=False,
-        level_dimension="*",
         toc_filetype="json",
+        workers=1,
+        toc_format="json",
+        batch_size=DEFAULT_BATCH_SIZE,
+        record_size=DEFAULT_RECORD_SIZE,
     ):
 
         isgrib, issfx, grib_version = self.check_file_type(file_template)
-        reference_filefmt = (
-            f"{self.path}/{self.case}/{self.name}_{file_template}_"
-            + "{level_dimension}.refs.{toc_filetype}"
-        )
-
-        reference_files = glob.glob(
-            reference_filefmt.format(
-                level_dimension=level_dimension, toc_filetype=toc_filetype
+        if not isgrib:
+            raise NotImplementedError("Only grib files can be indexed.")
+
+        if isinstance(files_to_scan, str):
+            files_to_scan = [files_to_scan]
+
+        if gribref:
+            self.build_references(
+                file_template,
+                files_to_scan,
+                toc_filetype,
+                workers=workers,
+                batch_size=batch_size,
+                record_size=record_size,
             )
-        )
-        if len(reference_files) > 1:
-            # Local references exist and can be loaded
+            return
+
+        print(f"Create TOC for {file_template}")
+        toc_filename = self.toc_file(file_template, toc_format)
+        if issfx and grib_version == 1:
+            parameters = [
+                "indicatorOfParameter",
+                "level",
+                "typeOfLevel",
+                "timeRangeIndicator",
+            ]
+        elif grib_version == 1:
+            parameters = [
+                "indicatorOfParameter",
+                "level",
+                "typeOfLevel",
+                "timeRangeIndicator",
+                "shortName",
+            ]
+        elif grib_version == 2:
+            parameters = [
+                "discipline",
+                "parameterCategory",
+                "parameterNumber",
+                "level",
+                "typeOfLevel",
+                "stepType",
+                "shortName",
+            ]
+        # Only scan the file of the first timestep
+        if self.printlev > 0:
+            print(" scanning", files_to_scan[0])
+        from .. import indexing
+
+        try:
+            with span("index", files=1):
+                (param_vals,) = indexing.run(
+                    partial(indexing.grib_toc, parameters=parameters),
+                    files_to_scan[:1],
+                    self.edp,
+                )
+        except FileNotFoundError as e:
+            raise FileNotFoundError(f"{e} Abort indexing for {file_template}.")
+        with span("write toc", format=toc_format):
+            write_toc(toc_filename, param_vals, toc_format)
+
+    def reference_file(self, file_template, level_dimension, toc_filetype="json"):
+        return f"{self.path}/{self.case}/{self.name}_{file_template}_{level_dimension}.refs.{toc_filetype}"
+
+    def reference_manifest(self, file_template, toc_filetype="json"):
+        return f"{self.path}/{self.case}/{self.name}_{file_template}.refs.{toc_filetype}.manifest.json"
+
+    def build_references(
+        self,
+        file_template,
+        files_to_scan,
+        toc_filetype="json",
+        workers=1,
+        batch_size=DEFAULT_BATCH_SIZE,
+        record_size=DEFAULT_RECORD_SIZE,
+    ):
+        """
+        Create or update the kerchunk references of files_to_scan
+
+        One reference set is written per level dimension, with files_to_scan
+        concatenated along time. The sets share a manifest of the source files.
+        Only files not in the manifest, or with a different size or mtime, are
+        indexed and added to the existing sets. All files are indexed if files
+        of the manifest are missing or in a different order.
+
+        Inputs
+        ------
+        file_template : str
+            File template of the files
+        files_to_scan : list
+            Files in time order
+        toc_filetype : str
+            Reference file type, json or parquet
+        workers : int
+            Number of worker processes used to index the files
+        batch_size : int
+            Number of files combined at a time
+        record_size : int
+            Number of references per Parquet file
+        """
+        manifest_file = self.reference_manifest(file_template, toc_filetype)
+        manifest = referencing.read_manifest(manifest_file)
+        with span("stat files", files=len(files_to_scan)):
+            stats = file_stats(files_to_scan)
+
+        times = None
+        if manifest is not None and all(
+            os.path.exists(x["file"]) for x in manifest["level_dims"].values()
+        ):
+            times = referencing.refresh_plan(manifest["files"], stats)
+        if times is None:
+            print(f"Create references for {file_template}")
+            times = list(range(len(files_to_scan)))
+            level_dims = {}
+        elif len(times) == 0:
             if self.printlev > 0:
-                print(f"Found local references: {' ,'.join(reference_files)}")
+                print(f"References for {file_template} are up to date")
+            return
         else:
-            print("No local references found. Creating them now.")
-            if isgrib:
-                print(f"Create references for {file_template}")
-
-                if isinstance(files_to_scan, str):
-                    files_to_scan = [files_to_scan]
-
-                file_references = {}
-                for file_to_scan in files_to_scan:
-                    if self.printlev > 0:
-                        print(" scanning", file_to_scan)
-
-                    # Test if file exists (UPath().exists() is not implemented)
-                    p = UPath(file_to_scan)
-                    protocol = p.protocol
-                    fs = fsspec.filesystem(protocol)
-                    file_exists = fs.exists(file_to_scan)
-                    if not file_exists:
-                        print(f"File {file_to_scan} does not exist.")
-                        raise FileNotFoundError(
-                            f"File {file_to_scan} does not exist. Abort indexing for {file_template}."
-                        )
-
-                    if gribref:
-                        with tempfile.NamedTemporaryFile() as idxfile:
-                            gribscan.write_index(
-                                gribfile=file_to_scan,
-                                idxfile=Path(idxfile.name),
-                                force=True,
-                            )
-                            magician = gribscan.magician.HarmonieMagician()
-                            refs = gribscan.grib_magic(
-                                filenames=[idxfile.name],
-                                magician=magician,
-                                global_prefix="",
-                            )
-                            file_references[os.path.basename(file_to_scan)] = refs
-                    else:
-                        json_filename = (
-                            f"{self.path}/{self.case}/{self.name}_{file_template}.json"
-                        )
-                        if issfx and grib_version == 1:
-                            parameters = [
-                                "indicatorOfParameter",
-                                "level",
-                                "typeOfLevel",
-                                "timeRangeIndicator",
-                            ]
-                        elif grib_version == 1:
-                            parameters = [
-                                "indicatorOfParameter",
-                                "level",
-                                "typeOfLevel",
-                                "timeRangeIndicator",
-                                "shortName",
-                            ]
-                        elif grib_version == 2:
-                            parameters = [
-                                "discipline",
-                                "parameterCategory",
-                                "parameterNumber",
-                                "level",
-                                "typeOfLevel",
-                                "stepType",
-                                "shortName",
-                            ]
-                        if p.protocol == "ec" or p.protocol == "ectmp":
-                            # Copy the file to a local directory as eccodes API cannot handle byte streams (e.g. accesses fileno operation)
-                            fs = fsspec.filesystem(p.protocol)
-                            lpath = UPath(os.path.join(fs.ec_cache, p.path.strip("/")))
-                            if not os.path.exists(lpath):
-                                # Trigger copy from ECFS to local cache
-                                p.open().seek(0)
-                            p = lpath
-                        param_vals = grib_ls(p, parameters)
-                        with open(json_filename, "w") as f:
-                            json.dump(param_vals, f, indent=2)
-                        break  # only scan the file of the first timestep
-
-                    # TODO: Delete the local copy of the file after scanning if it is an ecfs file
-
-                if gribref:
-                    # Merge all references into a single file (per height dimension)
-                    level_dims = set().union(
-                        *[reference.keys() for reference in file_references.values()]
+            print(f"Update references for {file_template} with {len(times)} files")
+            level_dims = manifest["level_dims"]
+
+        if self.printlev > 0:
+            for i in times:
+                print(" scanning", files_to_scan[i])
+        from .. import indexing
+
+        # References of each file are kept on disk until combined
+        with tempfile.TemporaryDirectory() as tmpdir:
+            try:
+                with span("index", files=len(times)):
+                    ref_files = indexing.run(
+                        partial(indexing.write_grib_references, outdir=tmpdir),
+                        [files_to_scan[i] for i in times],
+                        self.edp,
+                        workers,
+                    )
+            except FileNotFoundError as e:
+                raise FileNotFoundError(f"{e} Abort indexing for {file_template}.")
+
+            # Merge all references into a single file (per height dimension)
+            for level_dim in sorted(set().union(*ref_files)):
+                level_times = [t for t, x in zip(times, ref_files) if level_dim in x]
+                existing = level_dims.get(level_dim)
+                filename = self.reference_file(file_template, level_dim, toc_filetype)
+                with span("combine", level_dim=level_dim, files=len(level_times)):
+                    referencing.combine_references(
+                        [x[level_dim] for x in ref_files if level_dim in x],
+                        filename,
+                        toc_filetype,
+                        times=level_times,
+                        append=existing is not None,
+                        batch_size=batch_size,
+                        record_size=record_size,
                     )
+                level_dims[level_dim] = {
+                    "file": filename,
+                    "times": sorted(
+                        set(existing["times"] if existing else []) | set(level_times)
+                    ),
+                }
 
-                    for level_dim in level_dims:
-                        level_refs = [
-                            reference[level_dim]
-                            for reference in file_references.values()
-                        ]
-                        # TODO: Do we know the times at this point? Can we pass them to the combine function?
-                        filename = reference_filefmt.format(
-                            level_dimension=level_dim, toc_filetype=toc_filetype
-                        )
-                        combined_refs = combine_joined_reference_parquet(level_refs)
-                        if toc_filetype == "json":
-                            with open(filename, "w") as outfile:
-                                json.dump(combined_refs, outfile)
-                        elif toc_filetype == "parquet":
-                            export_dict_to_parq(combined_refs, filename)
-            else:
-                raise NotImplementedError("Only grib files can be indexed.")
-        os.environ["ECCODES_DEFINITION_PATH"] = f"{self.edp}"
+        referencing.write_manifest(manifest_file, toc_filetype, level_dims, stats)
 
     def check_file_type(self, infile):
+        # Imported here as eccodes and gribscan are slow to load
+        from ..indexing import ECCODES_DEFINITIONS_PATH
 
         isgrib = True
         issfx = False
@@ -373,13 +411,10 @@ class Exp:
             grib_version = 1
         elif "grib2" in infile:
             grib_version = 2
-            os.environ["ECCODES_DEFINITION_PATH"] = (
-                f"{os.getcwd()}/eccodes/definitions:{self.edp}"
-            )
+            # Used by the indexing workers, the environment is left untouched
+            self.edp = f"{os.getcwd()}/eccodes/definitions:{self.edp}"
             if self.printlev > 1:
-                print(
-                    f" Update ECCODES_DEFINITION_PATH:{os.environ['ECCODES_DEFINITION_PATH']}"
-                )
+                print(f" Use ECCODES_DEFINITION_PATH:{self.edp}")
         elif "grib" in infile:
             grib_version = 1
         elif "GRIBPF" in infile:
@@ -392,9 +427,18 @@ class Exp:
 
         return isgrib, issfx, grib_version
 
-    def toc(self, printlev=None):
+    def toc(self, printlev=None, workers=1, toc_format="json"):
         """
         Create TOC of most recent output file for each file_template
+
+        Inputs
+        ------
+        printlev : int
+            Verbosity
+        workers : int
+            Number of worker processes used to index the files
+        toc_format : str
+            Format of the TOC files, json, arrow or parquet
         """
         if printlev is not None:
             self.printlev = printlev
@@ -405,92 +449,154 @@ class Exp:
                 files_to_scan = self.reconstruct(dates[-1], file_template=fname)
 
                 try:
-                    self.build_toc(fname, files_to_scan)
+                    with span("toc", case=self.case, exp=self.name, template=fname):
+                        self.build_toc(
+                            fname, files_to_scan, workers=workers, toc_format=toc_format
+                        )
                 except NotImplementedError as e:
                     print(f"TOC for {fname} failed: {e}")
 
-    def scan(self):
+    def toc_file(self, file_template, toc_format="json"):
+        return f"{self.path}/{self.case}/{self.name}_{file_template}{TOC_FORMATS[toc_format]}"
 
-        print(" scan:", self.name)
+    def fields(self, file_template, **filters):
+        """
+        Select messages from the TOC of a file template
 
-        def subsub(path, subdirs, replace_keys):
-            def pdir(x, replace_keys):
-                y = x
-                for k, v in replace_keys.items():
-                    if k in y:
-                        y = y.replace(k, v)
-                return y
-
-            result = []
-            content = ecfs_list(path)
-            for cc in content:
-                pp = pdir(subdirs[0], replace_keys)
-                mm = [m.start() for m in re.finditer(pp, cc)]
-                if len(mm) > 0:
-                    if len(subdirs) > 1:
-                        subresult = subsub(path + cc, subdirs[1:], replace_keys)
-                    else:
-                        subresult = [path + cc]
-                    result.extend(subresult)
+        The TOC is read from the first existing file in the order arrow,
+        parquet, json, including JSON TOCs named after the file template only.
+
+        Inputs
+        ------
+        file_template : str
+            File template of the TOC
+        filters : dict
+            Key and value(s) to select, e.g. shortName="t", typeOfLevel="hybrid",
+            level=range(1, 91). See toc.select
+
+        Returns
+        -------
+        pyarrow.Table with one row per matching message, including its
+        position in the file in the message column
+        """
+        candidates = toc_files(self.path, self.case, self.name, file_template)
+        for filename in candidates:
+            if os.path.isfile(filename):
+                return select(read_toc(filename), **filters)
+        raise FileNotFoundError(
+            f"No TOC found for {file_template}, create it with dcmdb chase -toc"
+        )
+
+    def scan(self, executor=None, since=None):
+        """
+        Scan the path templates for files matching the file templates
+
+        Inputs
+        ------
+        executor : concurrent.futures.Executor
+            Scan the path templates concurrently on the executor, default is
+            to scan them one by one
+        since : datetime.datetime
+            Skip date directories of the path templates before this init time
+
+        Returns
+        -------
+        findings per file template, True if all file templates were found
+        """
+        return self.collect_scan(self.submit_scan(executor, since))
 
-            return result
+    def submit_scan(self, executor=None, since=None, done=None):
+        """
+        Submit the scan of each path template, see collect_scan for the result
 
+        Path templates found in done, a dict of earlier results per path
+        template, are not scanned again.
+        """
+        print(" scan:", self.name)
         print(
             "  Search for files named {} in {}".format(
                 self.file_templates, self.path_template
             )
         )
+        if since is not None:
+            print("  Skip init times before", since)
 
         # TODO: this needs to go into the constructor
         if isinstance(self.path_template, str):
             self.path_template = [self.path_template]
 
+        done = {} if done is None else done
+        return [
+            (
+                submit(None, done.get, path_template)
+                if path_template in done
+                else submit(executor, self.scan_path_template, path_template, since)
+            )
+            for path_template in self.path_template
+        ]
+
+    def collect_scan(self, pending, checkpoint=None):
+        """
+        Merge the scan results of the path templates in the order given in meta.yaml
+
+        checkpoint, if given, is called with each path template and its result
+        """
         findings = {}
         signal = True
+        for path_template, future in zip(self.path_template, pending):
+            result = future.result()
+            if checkpoint is not None:
+                checkpoint(path_template, result)
+            findings[path_template] = findings.get(path_template, {})
+            for file_template, tmp in result.items():
+                signal = signal and bool(tmp)
+                findings[path_template].update({file_template: tmp})
 
-        for path_template in self.path_template:
-            i = path_template.find("%")
-            base_path = path_template[:i] if i > -1 else path_template
-            part_path = path_template[i:] if i > -1 else ""
-
-            # Fix for path_templates without date directives (e.g. %Y/%m/%d) (Issue #28)
-            # Assuming dateformat is %Y/%m/%d
-            res = re.search(r"\d{4}/\d{2}/\d{2}", base_path)
-            if res is not None:
-                ymd = res.group()
-                date = simulation_datetime.strptime(ymd, "%Y/%m/%d")
-            else:
-                date = None
+        return merge_dict_items(findings), signal
 
-            content = find_files(base_path)
+    def scan_path_template(self, path_template, since=None):
+        i = path_template.find("%")
+        base_path = path_template[:i] if i > -1 else path_template
+        part_path = path_template[i:] if i > -1 else ""
 
-            for file_template in self.file_templates:
-                tmp = {}
-                partial_path_format = os.path.join(part_path, file_template)
-                for partial_path in content:
-                    try:
-                        dt = simulation_datetime.strptime(
-                            partial_path, partial_path_format
-                        )
-                        if date is not None:
+        # Fix for path_templates without date directives (e.g. %Y/%m/%d) (Issue #28)
+        # Assuming dateformat is %Y/%m/%d
+        res = re.search(r"\d{4}/\d{2}/\d{2}", base_path)
+        if res is not None:
+            ymd = res.group()
+            date = simulation_datetime.strptime(ymd, "%Y/%m/%d")
+        else:
+            date = None
+
+        with span("scan", case=self.case, exp=self.name, template=path_template):
+            # Only walk the directories the path template can match
+            depth = max(x.count("/") for x in self.file_templates)
+            content = find_files(base_path, part_path, since, depth)
+
+            # Classify each file against all templates with one combined regex
+            file_templates = list(dict.fromkeys(self.file_templates))
+            matcher = timehandling.TemplateMatcher(
+                [os.path.join(part_path, x) for x in file_templates]
+            )
+            found = [{} for _ in file_templates]
+            for partial_path in content:
+                # A file is recorded for every template it matches
+                for j, dt in matcher.match_all(partial_path):
+                    if date is not None:
+                        try:
                             dt = dt.replace(
                                 year=date.year, month=date.month, day=date.day
                             )
-                    except ValueError:
-                        # TODO: content contains all files even those not matching file_template
-                        continue
-                    dtg = dt.strftime("%Y-%m-%d %H:%M:%S")
+                        except ValueError:
+                            continue
+                    dtg = datetime.datetime.isoformat(dt, sep=" ")
+                    tmp = found[j]
                     if dtg not in tmp:
                         tmp[dtg] = []
                     tmp[dtg].append(int(dt.leadtime.total_seconds()))
 
+            for tmp in found:
                 for k in tmp:
                     tmp[k].sort()
 
-                signal = signal and bool(tmp)
-                findings[path_template] = findings.get(path_template, {})
-                findings[path_template].update({file_template: tmp})
-
-                merged_findings = merge_dict_items(findings)
-
-        return merged_findings, signal
+        return dict(zip(file_templates, found))
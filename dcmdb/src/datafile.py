@@ -0,0 +1,156 @@
+"""
+Reading and writing of the data.json availability files.
+
+Version 1 is the plain layout host -> exp -> file_template -> dtg -> [leadtimes].
+Version 2 stores the same information but encodes each list of lead times as
+arithmetic runs [start, stop, step] (stop inclusive) and shares identical lists
+between init times:
+
+    {
+     "version": 2,
+     "leadtimes": [[[0, 172800, 3600]], ...],
+     "data": {host: {exp: {file_template: {dtg: index into leadtimes}}}}
+    }
+
+Lead times given as null, used when no lead time information is available,
+are kept as null entries in the run list.
+"""
+
+import json
+
+DATA_VERSION = 1
+DATA_VERSIONS = (1, 2)
+
+
+def encode_leadtimes(leadtimes):
+    """
+    Encode a list of lead times as arithmetic runs
+
+    >>> encode_leadtimes([0, 3600, 7200, 10800, 14400, 21600])
+    [[0, 14400, 3600], [21600, 21600, 1]]
+    >>> encode_leadtimes([0, 900, 1800, 3600, 7200, 10800])
+    [[0, 1800, 900], [3600, 10800, 3600]]
+    >>> encode_leadtimes([None])
+    [None]
+    """
+    runs = []
+    for x in leadtimes:
+        if x is None:
+            runs.append(None)
+            continue
+        run = runs[-1] if len(runs) > 0 else None
+        if run is not None and run[0] == run[1]:
+            # A single value run may take any step to the next value
+            if x > run[1]:
+                run[1], run[2] = x, x - run[1]
+                continue
+        elif run is not None and x - run[1] == run[2]:
+            run[1] = x
+            continue
+        runs.append([x, x, 1])
+    return runs
+
+
+def decode_leadtimes(runs):
+    """
+    Expand arithmetic runs to a list of lead times
+
+    >>> decode_leadtimes([[0, 1800, 900], [3600, 10800, 3600]])
+    [0, 900, 1800, 3600, 7200, 10800]
+    """
+    leadtimes = []
+    for run in runs:
+        if run is None:
+            leadtimes.append(None)
+        else:
+            leadtimes.extend(range(run[0], run[1] + 1, run[2]))
+    return leadtimes
+
+
+def to_v2(data):
+    """
+    Convert data.json content from version 1 to version 2
+
+    >>> d = {"atos": {"exp": {"f": {"a": [0, 3600], "b": [0, 3600]}}}}
+    >>> to_v2(d)
+    {'version': 2, 'leadtimes': [[[0, 3600, 3600]]], 'data': {'atos': {'exp': {'f': {'a': 0, 'b': 0}}}}}
+    >>> from_v2(to_v2(d)) == d
+    True
+    """
+    table = {}
+    encoded = {}
+    for host, exps in data.items():
+        encoded[host] = {}
+        for exp, templates in exps.items():
+            encoded[host][exp] = {}
+            for file_template, dates in templates.items():
+                encoded[host][exp][file_template] = {}
+                for dtg, leadtimes in dates.items():
+                    key = tuple(leadtimes)
+                    if key not in table:
+                        table[key] = len(table)
+                    encoded[host][exp][file_template][dtg] = table[key]
+
+    return {
+        "version": 2,
+        "leadtimes": [encode_leadtimes(x) for x in table],
+        "data": encoded,
+    }
+
+
+def from_v2(content):
+    """
+    Convert data.json content from version 2 to version 1
+    """
+    table = [decode_leadtimes(x) for x in content["leadtimes"]]
+    return {
+        host: {
+            exp: {
+                file_template: {dtg: list(table[i]) for dtg, i in dates.items()}
+                for file_template, dates in templates.items()
+            }
+            for exp, templates in exps.items()
+        }
+        for host, exps in content["data"].items()
+    }
+
+
+def load(infile):
+    """
+    Read data.json content in any version from an open file
+
+    Returns
+    -------
+    tuple of the file version and the content in the version 1 layout
+    """
+    content = json.load(infile)
+    version = content.get("version", 1) if "data" in content else 1
+    if version == 1:
+        return 1, content
+    elif version == 2:
+        return 2, from_v2(content)
+    raise ValueError(f"Unknown data.json version {version}")
+
+
+def read_data(filename):
+    with open(filename, "r") as infile:
+        return load(infile)
+
+
+def write_data(filename, data, version=DATA_VERSION):
+    """
+    Write data in the version 1 layout to filename using the given version
+    """
+    with open(filename, "w") as outfile:
+        if version == 1:
+            json.dump(data, outfile, indent=1)
+        elif version == 2:
+            # Keep one line per lead time list and init time to get readable diffs
+            content = to_v2(data)
+            leadtimes = ",\n".join(f"  {json.dumps(x)}" for x in content["leadtimes"])
+            encoded = json.dumps(content["data"], indent=1).replace("\n", "\n ")
+            outfile.write(
+                f'{{\n "version": 2,\n "leadtimes": [\n{leadtimes}\n ],\n "data": {encoded}\n}}'
+            )
+        else:
+            raise ValueError(f"Unknown data.json version {version}")
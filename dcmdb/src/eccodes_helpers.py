@@ -3,14 +3,21 @@
 import eccodes
 import fsspec
 
+from .profiling import count
+
 
 def grib_ls(filepath, parameters, output_format="json"):
+    """
+    Return the values of parameters for each message in a GRIB file like grib_ls
+
+    Only the message headers are read, see grib_headers. The file is opened
+    with a small block size so remote files are accessed with small range
+    reads and the data sections are not fetched by read ahead.
+    """
     results = []
-    with fsspec.open(filepath, "rb").open() as f:
-        while True:
-            gid = eccodes.codes_grib_new_from_file(f)
-            if gid is None:
-                break
+    with fsspec.open(str(filepath), "rb", block_size=HEADER_BLOCK) as f:
+        for header in grib_headers(f):
+            gid = eccodes.codes_new_from_message(header)
             message = {}
             for param in parameters:
                 try:
@@ -24,3 +31,135 @@ def grib_ls(filepath, parameters, output_format="json"):
         return {"messages": results}
 
     return results
+
+
+# Size of the reads used to look for the start of the next message
+SEARCH_CHUNK = 65536
+# Block size of remote files, enough for the headers of most messages
+HEADER_BLOCK = 4096
+
+
+def read_bytes(f, offset, size):
+    f.seek(offset)
+    data = f.read(size)
+    count("bytes read", len(data))
+    if len(data) != size:
+        raise EOFError(f"Truncated GRIB message at byte {offset}")
+    return data
+
+
+def find_message(f, offset):
+    """
+    Return the offset and indicator section of the next message at or after
+    offset, None at the end of the file
+
+    Messages usually follow each other directly, so the 16 bytes at offset
+    are read first and the file is only searched for the next b"GRIB" in
+    chunks of SEARCH_CHUNK bytes when they are not an indicator section.
+    """
+    f.seek(offset)
+    indicator = f.read(16)
+    count("bytes read", len(indicator))
+    if indicator[:4] == b"GRIB" and len(indicator) == 16:
+        return offset, indicator
+    if indicator == b"":
+        return None
+    offset = search_message(f, offset)
+    if offset is None:
+        return None
+    return offset, read_bytes(f, offset, 16)
+
+
+def search_message(f, offset):
+    """
+    Return the offset of the next b"GRIB" at or after offset, None if none
+    """
+    while True:
+        f.seek(offset)
+        chunk = f.read(SEARCH_CHUNK)
+        count("bytes read", len(chunk))
+        i = chunk.find(b"GRIB")
+        if i > -1:
+            return offset + i
+        if len(chunk) < SEARCH_CHUNK:
+            return None
+        # Keep the last bytes in case the marker crosses the chunk border
+        offset += len(chunk) - 3
+
+
+def grib1_header(f, start, total):
+    """
+    Return a GRIB1 message with the data of the binary data section left out
+    """
+    pds = read_bytes(f, start + 8, 3)
+    pds = read_bytes(f, start + 8, int.from_bytes(pds, "big"))
+    pos = start + 8 + len(pds)
+    sections = [pds]
+    for flag in (0x80, 0x40):
+        # Optional grid description and bitmap sections
+        if pds[7] & flag:
+            length = int.from_bytes(read_bytes(f, pos, 3), "big")
+            sections.append(read_bytes(f, pos, length))
+            pos += length
+    bds = read_bytes(f, pos, 11)
+    bds_length = int.from_bytes(bds[:3], "big")
+    if total & 0x800000 and bds_length < 120:
+        # Large GRIB1 special coding, see eccodes src/grib_io.c
+        total = (total & 0x7FFFFF) * 120 - bds_length + 4
+    if bds[3] & 0xC0:
+        # Spherical harmonics and complex packing keep more keys in the section
+        sections.append(read_bytes(f, pos, bds_length))
+    else:
+        sections.append((12).to_bytes(3, "big") + bds[3:] + b"\x00")
+    body = b"".join(sections)
+    length = 8 + len(body) + 4
+    return total, b"GRIB" + length.to_bytes(3, "big") + b"\x01" + body + b"7777"
+
+
+def grib2_header(f, start, total):
+    """
+    Return a GRIB2 message with the data sections emptied
+    """
+    sections = []
+    pos = start + 16
+    end = start + total - 4
+    while pos < end:
+        head = read_bytes(f, pos, 5)
+        length, number = int.from_bytes(head[:4], "big"), head[4]
+        if number == 7:
+            sections.append(b"\x00\x00\x00\x05\x07")
+        else:
+            sections.append(read_bytes(f, pos, length))
+        pos += length
+    body = b"".join(sections)
+    indicator = read_bytes(f, start, 8)
+    length = 16 + len(body) + 4
+    return total, indicator + length.to_bytes(8, "big") + body + b"7777"
+
+
+def grib_headers(f):
+    """
+    Yield each GRIB message of the open binary file f without its data
+
+    Only the section headers are read, using small reads at the message
+    and section boundaries given by the length fields, see find_message.
+    """
+    offset = 0
+    while True:
+        found = find_message(f, offset)
+        if found is None:
+            return
+        offset, indicator = found
+        edition = indicator[7]
+        if edition == 1:
+            total, header = grib1_header(
+                f, offset, int.from_bytes(indicator[4:7], "big")
+            )
+        elif edition == 2:
+            total, header = grib2_header(
+                f, offset, int.from_bytes(indicator[8:16], "big")
+            )
+        else:
+            raise ValueError(f"Unknown GRIB edition {edition} at byte {offset}")
+        yield header
+        offset += total
@@ -1,8 +1,11 @@
 """
 ECMWF file storage (ECFS) operation wrappers.
+
+Blocking wrappers around the shared asynchronous client in ecfs_client.
 """
 
-import subprocess
+from .ecfs_client import DEFAULT_BATCH_SIZE, ECFSError, get_client
+from .profiling import span
 
 
 def ecfs_copy(infile, outfile, printlev=0):
@@ -10,30 +13,47 @@ def ecfs_copy(infile, outfile, printlev=0):
     args = ["ecp", infile, outfile]
     if printlev > 0:
         print(" " + " ".join(args))
-    cmd = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    cmd_out, cmd_err = cmd.communicate()
-
-    if cmd_err is not None and cmd_err != b"":
-        res = cmd_err.decode("utf-8")
-        print(res)
+    client = get_client()
+    try:
+        with span("ecp", files=1):
+            client.call(client.copy(infile, outfile))
+    except ECFSError as e:
+        print(e)
         return False
     else:
         return True
 
 
-def ecfs_list(path, detail=False):
-    if detail:
-        cmd_parts = ["els", "-l", path]
-    else:
-        cmd_parts = ["els", path]
-    cmd = subprocess.Popen(cmd_parts, stdout=subprocess.PIPE)
-    cmd_out, cmd_err = cmd.communicate()
-
-    if cmd_err is not None:
-        if len(cmd_err) > 0:
-            res = cmd_err.decode("utf-8")
-            raise OSError(res)
+def ecfs_fetch(infiles, outpath, printlev=0, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Copy ECFS files to the local directory outpath with batched, concurrent
+    ecp calls
 
-    # Decode and filter output
-    res = [line.decode("utf-8") for line in cmd_out.splitlines()]
+    Returns
+    -------
+    dict of each file and None if it was copied or the ECFSError
+    """
+    if printlev > 0:
+        print(f" ecp {len(infiles)} files to {outpath}")
+    client = get_client()
+    with span("ecp", files=len(infiles)):
+        res = client.call(client.fetch(infiles, outpath, batch_size))
+    for e in res.values():
+        if e is not None:
+            print(e)
     return res
+
+
+def ecfs_list(path, detail=False):
+    client = get_client()
+    with span("els", path=path):
+        return client.call(client.list(path, detail))
+
+
+def ecfs_list_many(paths, detail=False):
+    """
+    List several paths concurrently, returning a listing or an ECFSError per path
+    """
+    client = get_client()
+    with span("els", paths=len(paths)):
+        return client.call(client.list_many(paths, detail))
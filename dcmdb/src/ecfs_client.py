@@ -0,0 +1,274 @@
+"""
+Asynchronous client for the ECMWF file storage (ECFS) commands.
+
+All els/ecp calls are run as subprocesses on one event loop owned by the
+client. The client limits the number of concurrent ECFS commands, kills
+commands running longer than the timeout, retries failed commands with an
+exponential backoff and lets identical listings running at the same time
+share one els call.
+
+Coroutines can be awaited directly from asyncio code, e.g.
+
+    listings = await client.list_many(paths)
+
+while synchronous code uses the blocking wrappers, which run the coroutines
+on a background event loop shared by all threads of the process:
+
+    client = get_client()
+    client.call(client.list(path))
+"""
+
+import asyncio
+import os
+import signal
+import threading
+import weakref
+
+from .profiling import count
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 600
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 1.0
+DEFAULT_BATCH_SIZE = 50
+
+
+class ECFSError(OSError):
+    """
+    An ECFS command failed, timed out or could not be started
+    """
+
+
+class ECFSClient:
+    def __init__(
+        self,
+        concurrency=DEFAULT_CONCURRENCY,
+        timeout=DEFAULT_TIMEOUT,
+        retries=DEFAULT_RETRIES,
+        backoff=DEFAULT_BACKOFF,
+    ):
+        """
+        Inputs
+        ------
+        concurrency : int
+            Maximum number of ECFS commands running at the same time
+        timeout : float
+            Seconds before a single command is killed, None to wait forever
+        retries : int
+            Number of times a failed or timed out command is repeated
+        backoff : float
+            Seconds to wait before the first retry, doubled for each retry
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._inflight = {}
+
+    def _semaphore(self):
+        # Semaphores are bound to the event loop they are first used in
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return self._semaphores[loop]
+
+    async def _exec(self, args):
+        count(f"subprocess:{args[0]}")
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+        try:
+            out, err = await asyncio.wait_for(proc.communicate(), self.timeout)
+        except asyncio.TimeoutError:
+            # Kill the whole process group in case the command is a wrapper script
+            os.killpg(proc.pid, signal.SIGKILL)
+            await proc.wait()
+            raise ECFSError(f"{' '.join(args)} timed out after {self.timeout}s")
+
+        err = err.decode("utf-8")
+        if proc.returncode != 0 or err != "":
+            raise ECFSError(
+                err.strip() or f"{' '.join(args)} returned {proc.returncode}"
+            )
+
+        count("bytes read", len(out))
+        return out
+
+    async def run(self, *args):
+        """
+        Run an ECFS command and return its standard output
+
+        Raises ECFSError when the command still fails after all retries.
+        """
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._semaphore():
+                    return await self._exec(args)
+            except FileNotFoundError as e:
+                raise ECFSError(f"{args[0]} not found, is ECFS available?") from e
+            except OSError as e:
+                if attempt == self.retries:
+                    raise ECFSError(str(e)) from e
+            await asyncio.sleep(delay)
+            delay *= 2
+
+    async def _list(self, path, detail):
+        args = ["els", "-l", path] if detail else ["els", path]
+        out = await self.run(*args)
+        return [line.decode("utf-8") for line in out.splitlines()]
+
+    async def list(self, path, detail=False):
+        """
+        List an ECFS path, lines of els -l if detail is True
+
+        Identical listings requested while one is running share its result.
+        """
+        key = (asyncio.get_running_loop(), path, detail)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._list(path, detail))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shield the shared listing from cancellation of a single caller
+        return list(await asyncio.shield(task))
+
+    async def copy(self, infile, outfile):
+        """
+        Copy a file from or to ECFS
+        """
+        await self.run("ecp", infile, outfile)
+
+    async def list_many(self, paths, detail=False):
+        """
+        List several paths concurrently
+
+        Returns
+        -------
+        listings in the order of paths, or the ECFSError for failed paths
+        """
+        return await asyncio.gather(
+            *[self.list(path, detail) for path in paths], return_exceptions=True
+        )
+
+    async def copy_many(self, pairs):
+        """
+        Copy several (infile, outfile) pairs concurrently
+
+        Returns
+        -------
+        None for each successful copy or the ECFSError, in the order of pairs
+        """
+        return await asyncio.gather(
+            *[self.copy(infile, outfile) for infile, outfile in pairs],
+            return_exceptions=True,
+        )
+
+    async def copy_batch(self, infiles, outdir):
+        """
+        Copy several files into the directory outdir with one ecp call
+        """
+        await self.run("ecp", *infiles, outdir)
+
+    async def _fetch_batch(self, infiles, outdir):
+        try:
+            await self.copy_batch(infiles, outdir)
+        except ECFSError as e:
+            if len(infiles) == 1:
+                return {infiles[0]: e}
+            # Find the failing files of the batch with one call per file
+            res = await self.copy_many([(f, outdir) for f in infiles])
+            return dict(zip(infiles, res))
+        return dict.fromkeys(infiles)
+
+    async def fetch(self, infiles, outdir, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Copy files from ECFS into the local directory outdir
+
+        The files are grouped by archive directory into ecp calls of at most
+        batch_size files, which run concurrently up to the concurrency of the
+        client. The files of a failed call are copied one by one to find
+        the failing ones.
+
+        Returns
+        -------
+        dict of each file and None if it was copied or the ECFSError
+        """
+        directories = {}
+        for f in infiles:
+            directories.setdefault(os.path.dirname(f), []).append(f)
+        batches = [
+            files[i : i + batch_size]
+            for files in directories.values()
+            for i in range(0, len(files), batch_size)
+        ]
+        res = {}
+        for x in await asyncio.gather(
+            *[self._fetch_batch(batch, outdir) for batch in batches]
+        ):
+            res.update(x)
+        return {f: res[f] for f in infiles}
+
+    @property
+    def loop(self):
+        """
+        The background event loop used by call
+        """
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="ecfs", daemon=True
+                )
+                self._thread.start()
+        return self._loop
+
+    def call(self, coro):
+        """
+        Run a coroutine of the client on the background loop and wait for it
+
+        Safe to use from several threads, but not from a coroutine running on
+        the background loop itself.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def close(self):
+        """
+        Stop the background event loop
+        """
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join()
+                self._loop.close()
+                self._loop = None
+                self._thread = None
+
+
+_client = None
+
+
+def get_client():
+    """
+    Return the ECFS client shared by the process
+    """
+    global _client
+    if _client is None:
+        _client = ECFSClient()
+    return _client
+
+
+def set_client(client):
+    """
+    Replace the shared ECFS client, e.g. to change limits or timeouts
+    """
+    global _client
+    _client = client
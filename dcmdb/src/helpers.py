@@ -1,31 +1,198 @@
+import concurrent.futures
 import os
+from collections import defaultdict
 
-import fsspec
-import tqdm
-from upath import UPath
+from .listing_cache import get_listing_cache, normalize_entry
+from .profiling import count
+from .timehandling import time_template
 
+# Process wide memo of parsed files, keyed by path and holding (mtime, size, content)
+_file_memo = {}
 
-def find_files(path, prefix="", level=0, recursive=True):
-    # Scan given path and subdirs and return files matching the pattern
-    result = []
+
+def load_cached(filename, loader):
+    """
+    Parse a file with loader and memoize the result for the lifetime of the process
+
+    The memo is invalidated when the modification time or the size of the
+    file changes. The returned content is shared between callers and must
+    not be modified in place.
+    """
+    key = os.path.abspath(filename)
+    st = os.stat(key)
+    stamp = (st.st_mtime_ns, st.st_size)
+    memo = _file_memo.get(key)
+    if memo is not None and memo[0] == stamp:
+        return memo[1]
+    with open(key, "r") as infile:
+        content = loader(infile)
+    count("bytes read", st.st_size)
+    _file_memo[key] = (stamp, content)
+    return content
+
+
+def get_filesystem(path):
+    """
+    Return the protocol of a path or URL and the fsspec filesystem serving it
+
+    fsspec and universal_pathlib are imported on first use to keep the
+    startup of commands not touching files fast.
+
+    >>> get_filesystem("memory://foo/bar")[0]
+    'memory'
+    """
+    import fsspec
+    from upath import UPath
+
+    protocol = UPath(path).protocol
+    return protocol, fsspec.filesystem(protocol)
+
+
+def find_files(path, part_path="", since=None, depth=None):
+    """
+    Walk path and yield the files in the directories matching part_path
+
+    The walk is guided by the directory part of a path template, e.g.
+    "%Y/%m/%d/%H/". Each directory level is only entered for names matching
+    the corresponding component of part_path and files outside the template
+    directories are not returned. All listings are made with detail=True on
+    one filesystem instance through the listing cache and the result is
+    generated as the walk goes.
+
+    Inputs
+    ------
+    path : str
+        Directory to search, the part of the path template before any directive
+    part_path : str
+        Remaining directory part of the path template
+    since : datetime.datetime
+        Skip date directories before this init time
+    depth : int
+        Number of directory levels below the template directories to search,
+        default is all
+
+    Directories that cannot be listed are skipped, but ListingUnavailable
+    of a listing missing from an offline cache is raised. With since given,
+    all walked directories are at or after since and listed fresh, so new
+    files are found even if the cache reuses listings.
+
+    Yields
+    ------
+    file paths relative to path
+
+    Example
+    -------
+    >>> import fsspec
+    >>> fs = fsspec.filesystem("memory")
+    >>> for x in ("2024/09/05/00", "2024/09/06/00", "2024/09/06/xx"):
+    ...     fs.pipe(f"memory://arch/{x}/fc+000", b"")
+    >>> list(find_files("memory://arch/", "%Y/%m/%d/%H/"))
+    ['2024/09/05/00/fc+000', '2024/09/06/00/fc+000']
+    >>> import datetime
+    >>> since = datetime.datetime(2024, 9, 6)
+    >>> list(find_files("memory://arch/", "%Y/%m/%d/%H/", since=since))
+    ['2024/09/06/00/fc+000']
+    """
+    protocol, fs = get_filesystem(path)
+    components = [time_template(x) for x in part_path.split("/") if x != ""]
+    cache = get_listing_cache()
+    fresh = since is not None
+    yield from _walk(fs, protocol, cache, path, "", components, since, depth, fresh)
+
+
+def _walk(fs, protocol, cache, path, prefix, components, since, depth, fresh):
     try:
-        protocol = UPath(path).protocol
-        fs = fsspec.filesystem(protocol)
-        it = fs.ls(path, detail=False, recursive=recursive)
+        entries = cache.ls(fs, protocol, path, fresh=fresh)
     except OSError:
-        it = []
-    iterator = tqdm.tqdm(it, disable=len(it) <= 10, desc=path, position=level)
-    for entry in iterator:
-        entry = UPath(entry)
-        if not entry.name.startswith(".") and entry.is_file():
-            result.append(os.path.relpath(entry, path))
-        elif not entry.name.startswith(".") and entry.is_dir() and not recursive:
-            subresult = find_files(
-                os.path.join(path, entry.name), prefix, level + 1, False
+        return
+
+    key = None
+    if len(components) > 0:
+        template = components[0]
+        # Init times can only be compared on levels with date directives only
+        if (
+            since is not None
+            and template.supported
+            and len(template.fields) > 0
+            and all(field[0] != "l" for _, _, field in template.fields)
+        ):
+            key = template.format(since, 0)
+
+    # Walk in name order to get the same result on all filesystems
+    for entry in sorted(entries, key=lambda x: x["name"]):
+        name = os.path.basename(entry["name"].rstrip("/"))
+        if name.startswith("."):
+            continue
+        if entry["type"] == "file":
+            if len(components) == 0:
+                yield prefix + name
+            continue
+        if entry["type"] != "directory":
+            continue
+
+        if len(components) > 0:
+            if template.supported and template.regex.fullmatch(name) is None:
+                continue
+            sub_since = since
+            if key is not None:
+                if name < key:
+                    continue
+                sub_since = since if name == key else None
+            yield from _walk(
+                fs,
+                protocol,
+                cache,
+                os.path.join(path, name),
+                prefix + name + "/",
+                components[1:],
+                sub_since,
+                depth,
+                fresh,
+            )
+        elif depth is None or depth > 0:
+            yield from _walk(
+                fs,
+                protocol,
+                cache,
+                os.path.join(path, name),
+                prefix + name + "/",
+                components,
+                None,
+                None if depth is None else depth - 1,
+                fresh,
             )
-            subresult = [entry.name + "/" + e for e in subresult]
-            result.extend(subresult)
-    return result
+
+
+def file_stats(files):
+    """
+    Return path, size and mtime of files, listing each directory once
+
+    Size and mtime are None for missing files or directories that cannot
+    be listed.
+    """
+    directories = defaultdict(set)
+    for filename in files:
+        directories[os.path.dirname(filename)].add(os.path.basename(filename))
+    entries = {}
+    for directory, names in directories.items():
+        _, fs = get_filesystem(directory)
+        try:
+            listing = fs.ls(directory, detail=True)
+        except OSError:
+            continue
+        for entry in map(normalize_entry, listing):
+            name = os.path.basename(entry["name"].rstrip("/"))
+            if name in names:
+                entries[(directory, name)] = entry
+
+    stats = []
+    for filename in files:
+        key = (os.path.dirname(filename), os.path.basename(filename))
+        entry = entries.get(key, {})
+        stats.append(
+            {"path": filename, "size": entry.get("size"), "mtime": entry.get("mtime")}
+        )
+    return stats
 
 
 def merge_dict_items(d: dict):
@@ -60,3 +227,18 @@ def merge_dict_items(d: dict):
             else:
                 merged_dict[sub_dict] = d[key][sub_dict]
     return merged_dict
+
+
+def submit(executor, fn, *args, **kwargs):
+    """
+    Run fn on executor, or right away if executor is None, and return a Future
+    """
+    if executor is not None:
+        return executor.submit(fn, *args, **kwargs)
+
+    future = concurrent.futures.Future()
+    try:
+        future.set_result(fn(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
@@ -0,0 +1,126 @@
+"""
+Building of GRIB TOCs and references in worker processes.
+
+Every worker process sets its own eccodes definitions path in the pool
+initializer, so files needing different definitions can be indexed side by
+side without changing the environment of the parent process.
+
+The module imports eccodes and gribscan, which take most of the startup time
+of dcmdb, so it is only imported by the code paths indexing files.
+"""
+
+import concurrent.futures
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import eccodes
+import fsspec
+import gribscan
+from upath import UPath
+
+from .eccodes_helpers import grib_ls
+
+ECCODES_DEODE_DEF_PATH = Path(__file__).parent.parent / "eccodes" / "definitions"
+ECCODES_DEFINITIONS_PATH = f"{ECCODES_DEODE_DEF_PATH}:{eccodes.codes_definition_path()}"
+
+# Set once the GRIB stack is first used, the workers set their own path
+gribscan.eccodes.codes_set_definitions_path(ECCODES_DEFINITIONS_PATH)
+
+
+def init_worker(definitions):
+    """
+    Set the eccodes definitions path of the current process
+    """
+    os.environ["ECCODES_DEFINITION_PATH"] = definitions
+    eccodes.codes_set_definitions_path(definitions)
+
+
+def check_exists(file_to_scan):
+    # Test if file exists (UPath().exists() is not implemented)
+    fs = fsspec.filesystem(UPath(file_to_scan).protocol)
+    if not fs.exists(file_to_scan):
+        print(f"File {file_to_scan} does not exist.")
+        raise FileNotFoundError(f"File {file_to_scan} does not exist.")
+
+
+def grib_references(file_to_scan):
+    """
+    Return the kerchunk references of a GRIB file built by gribscan
+    """
+    check_exists(file_to_scan)
+    with tempfile.NamedTemporaryFile() as idxfile:
+        gribscan.write_index(
+            gribfile=file_to_scan,
+            idxfile=Path(idxfile.name),
+            force=True,
+        )
+        magician = gribscan.magician.HarmonieMagician()
+        return gribscan.grib_magic(
+            filenames=[idxfile.name],
+            magician=magician,
+            global_prefix="",
+        )
+
+
+def write_grib_references(file_to_scan, outdir):
+    """
+    Write the references of a GRIB file to one JSON file per level dimension
+
+    Only the file names travel back from the worker processes.
+
+    Returns
+    -------
+    dict of level dimension and reference file
+    """
+    ref_files = {}
+    for level_dim, refs in grib_references(file_to_scan).items():
+        fd, ref_file = tempfile.mkstemp(suffix=f".{level_dim}.json", dir=outdir)
+        with os.fdopen(fd, "w") as f:
+            json.dump(refs, f)
+        ref_files[level_dim] = ref_file
+    return ref_files
+
+
+def grib_toc(file_to_scan, parameters):
+    """
+    Return the values of parameters for all messages of a GRIB file
+    """
+    check_exists(file_to_scan)
+    return grib_ls(file_to_scan, parameters)
+
+
+def run(fn, files, definitions, workers=1):
+    """
+    Apply fn to each file with the given eccodes definitions path
+
+    Inputs
+    ------
+    fn : callable
+        Module level function taking a file name, run in worker processes
+    files : list
+        Files to process
+    definitions : str
+        eccodes definitions path
+    workers : int
+        Number of worker processes, 1 to run in the current process
+
+    Returns
+    -------
+    list of the results in the order of files
+    """
+    if workers > 1 and len(files) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+            min(workers, len(files)),
+            initializer=init_worker,
+            initargs=(definitions,),
+        ) as executor:
+            return list(executor.map(fn, files))
+
+    previous = eccodes.codes_definition_path()
+    eccodes.codes_set_definitions_path(definitions)
+    try:
+        return [fn(x) for x in files]
+    finally:
+        eccodes.codes_set_definitions_path(previous)
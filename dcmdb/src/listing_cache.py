@@ -0,0 +1,219 @@
+"""
+Persistent cache of remote directory listings.
+
+Listings made by find_files are stored in a SQLite file, by default
+~/.cache/dcmdb/listings.sqlite, keyed by protocol, path and the recursive flag.
+Each listing keeps name, type, size and mtime of its entries. Listings older
+than the TTL are fetched again and the least recently used listings are
+evicted when the stored listings exceed the size cap.
+
+The cache has three modes:
+
+    use      return listings younger than the TTL, list and store the others
+    refresh  always list and store the result
+    offline  only use stored listings, regardless of their age
+
+A listing missing from the cache in offline mode raises ListingUnavailable,
+which is not an OSError so it is not mistaken for an empty directory.
+
+Local paths are never cached.
+"""
+
+import json
+import threading
+import time
+
+from .cache_db import cache_file, connect
+from .profiling import count, span
+
+DEFAULT_TTL = 3600
+DEFAULT_MAX_BYTES = 256 * 1024**2
+MODES = ("use", "refresh", "offline")
+LOCAL_PROTOCOLS = ("", "file", "local")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    protocol TEXT NOT NULL,
+    path TEXT NOT NULL,
+    recursive INTEGER NOT NULL,
+    listed REAL NOT NULL,
+    used REAL NOT NULL,
+    nbytes INTEGER NOT NULL,
+    entries TEXT NOT NULL,
+    PRIMARY KEY (protocol, path, recursive)
+);
+CREATE INDEX IF NOT EXISTS listings_used ON listings (used);
+"""
+
+
+class ListingUnavailable(Exception):
+    """
+    A listing is not in the cache and the archive may not be listed
+    """
+
+
+def normalize_entry(entry):
+    """
+    Reduce an fsspec ls entry to name, type, size and mtime
+
+    >>> normalize_entry({"name": "ec:/a/b", "type": "file", "size": 42, "uid": 0})
+    {'name': 'ec:/a/b', 'type': 'file', 'size': 42, 'mtime': None}
+    """
+    mtime = entry.get("mtime", entry.get("modified"))
+    if mtime is not None and not isinstance(mtime, (int, float)):
+        mtime = str(mtime)
+    return {
+        "name": entry["name"],
+        "type": entry.get("type"),
+        "size": entry.get("size"),
+        "mtime": mtime,
+    }
+
+
+class ListingCache:
+    def __init__(
+        self, dbfile=None, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, mode="use"
+    ):
+        """
+        Inputs
+        ------
+        dbfile : str
+            Cache file, default is ~/.cache/dcmdb/listings.sqlite
+        ttl : float
+            Seconds a listing is valid
+        max_bytes : int
+            Maximum total size of the stored listings
+        mode : str
+            One of use, refresh or offline
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown listing cache mode {mode}, use one of {MODES}")
+        self.dbfile = dbfile if dbfile is not None else cache_file("listings.sqlite")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self._con = None
+        self._lock = threading.Lock()
+
+    @property
+    def con(self):
+        if self._con is None:
+            self._con = connect(self.dbfile, SCHEMA)
+        return self._con
+
+    def get(self, protocol, path, recursive):
+        """
+        Return the stored listing or None if it is missing or expired
+        """
+        if self.mode == "refresh":
+            return None
+        with self._lock:
+            row = self.con.execute(
+                "SELECT listed, entries FROM listings "
+                "WHERE protocol = ? AND path = ? AND recursive = ?",
+                (protocol, path, int(recursive)),
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if self.mode != "offline" and now - row[0] > self.ttl:
+                return None
+            with self.con:
+                self.con.execute(
+                    "UPDATE listings SET used = ? "
+                    "WHERE protocol = ? AND path = ? AND recursive = ?",
+                    (now, protocol, path, int(recursive)),
+                )
+        return json.loads(row[1])
+
+    def put(self, protocol, path, recursive, entries):
+        """
+        Store a listing and evict the least recently used ones above the size cap
+        """
+        entries = json.dumps([normalize_entry(x) for x in entries])
+        now = time.time()
+        with self._lock, self.con:
+            self.con.execute(
+                "INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (protocol, path, int(recursive), now, now, len(entries), entries),
+            )
+            total = self.con.execute("SELECT SUM(nbytes) FROM listings").fetchone()[0]
+            if total > self.max_bytes:
+                rows = self.con.execute(
+                    "SELECT rowid, nbytes FROM listings ORDER BY used"
+                ).fetchall()
+                evict = []
+                for rowid, nbytes in rows:
+                    if total <= self.max_bytes:
+                        break
+                    evict.append((rowid,))
+                    total -= nbytes
+                self.con.executemany("DELETE FROM listings WHERE rowid = ?", evict)
+
+    def ls(self, fs, protocol, path, recursive=False, fresh=False):
+        """
+        List path on the filesystem fs through the cache
+
+        In use mode a stored listing younger than the TTL is returned, in
+        refresh mode path is always listed again and in offline mode only
+        stored listings are returned, ListingUnavailable is raised for a
+        listing that is not stored. New listings are stored in the cache.
+
+        Inputs
+        ------
+        fresh : bool
+            List path again in use mode as well, e.g. for directories that
+            may have changed since they were cached. Ignored in offline mode.
+
+        Returns
+        -------
+        list of dicts with name, type, size and mtime of each entry
+        """
+        if protocol in LOCAL_PROTOCOLS:
+            entries = fs.ls(path, detail=True, recursive=recursive)
+            return [normalize_entry(x) for x in entries]
+
+        entries = None
+        if not fresh or self.mode == "offline":
+            entries = self.get(protocol, path, recursive)
+        if entries is not None:
+            count("listing cache hits")
+            return entries
+        if self.mode == "offline":
+            raise ListingUnavailable(
+                f"{path} is not in the listing cache {self.dbfile}"
+            )
+
+        count("listings")
+        with span("list", path=path):
+            entries = fs.ls(path, detail=True, recursive=recursive)
+        self.put(protocol, path, recursive, entries)
+        return [normalize_entry(x) for x in entries]
+
+    def clear(self):
+        with self._lock, self.con:
+            self.con.execute("DELETE FROM listings")
+
+
+_cache = None
+
+
+def get_listing_cache():
+    """
+    Return the listing cache shared by the process
+
+    By default listings are stored but not reused, use set_listing_cache with
+    a cache in use mode to reuse them.
+    """
+    global _cache
+    if _cache is None:
+        _cache = ListingCache(mode="refresh")
+    return _cache
+
+
+def set_listing_cache(cache):
+    """
+    Replace the shared listing cache, e.g. to change the mode or the TTL
+    """
+    global _cache
+    _cache = cache
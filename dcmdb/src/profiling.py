@@ -0,0 +1,195 @@
+"""
+Timing spans and counters of a dcmdb run.
+
+Code marks its phases with span() and counts subprocess calls and bytes with
+count(). Both do nothing until a Profiler is enabled, e.g. by
+
+    dcmdb --profile chase -scan
+
+which writes the spans as a Chrome trace (chrome://tracing, Perfetto) to
+--profile-trace and prints a summary per phase at exit. With --profile-memory
+the peak of the memory traced by tracemalloc is recorded for each span as
+well, which is approximate for spans running in parallel threads.
+
+    with span("scan", case=case, exp=exp):
+        ...
+    count("subprocess:els")
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+
+DEFAULT_TRACE_FILE = "dcmdb-profile.json"
+
+_profiler = None
+_null = contextlib.nullcontext()
+
+
+class Profiler:
+    def __init__(self, memory=False):
+        """
+        Inputs
+        ------
+        memory : bool
+            Record the tracemalloc peak of each span, slows the run down
+        """
+        self.memory = memory
+        self.events = []
+        self.counters = Counter()
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _now(self):
+        return (time.perf_counter() - self.start) * 1e6
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        # Each span resets the tracemalloc peak, the peaks of the nested spans
+        # are kept on a per thread stack and added back at the end
+        stack = self._local.__dict__.setdefault("peaks", [])
+        if self.memory:
+            outer = tracemalloc.get_traced_memory()[1]
+            if stack:
+                stack[-1] = max(stack[-1], outer)
+            tracemalloc.reset_peak()
+            stack.append(0)
+        start = self._now()
+        try:
+            yield
+        finally:
+            end = self._now()
+            event = {
+                "name": name,
+                "ph": "X",
+                "ts": start,
+                "dur": end - start,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": {k: str(v) for k, v in args.items()},
+            }
+            if self.memory:
+                peak = max(stack.pop(), tracemalloc.get_traced_memory()[1])
+                if stack:
+                    stack[-1] = max(stack[-1], peak)
+                event["args"]["peak_bytes"] = peak
+            with self._lock:
+                self.events.append(event)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def trace(self):
+        """
+        Return the spans and counters in the Chrome trace event format
+        """
+        events = list(self.events)
+        end = self._now()
+        for name, value in sorted(self.counters.items()):
+            events.append(
+                {
+                    "name": name,
+                    "ph": "C",
+                    "ts": end,
+                    "pid": os.getpid(),
+                    "args": {"value": value},
+                }
+            )
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"counters": dict(self.counters)},
+        }
+
+    def write(self, filename):
+        with open(filename, "w") as outfile:
+            json.dump(self.trace(), outfile)
+
+    def summary(self):
+        """
+        Return the time per phase and the counters as a table
+
+        Nested spans are included in the time of their parents.
+        """
+        phases = defaultdict(list)
+        for event in self.events:
+            phases[event["name"]].append(event)
+        lines = [
+            f"{'phase':<24} {'calls':>7} {'total [s]':>10} {'mean [s]':>10} "
+            f"{'max [s]':>10}" + (f" {'peak [MB]':>10}" if self.memory else "")
+        ]
+        for name, events in sorted(
+            phases.items(), key=lambda x: -sum(e["dur"] for e in x[1])
+        ):
+            durations = [e["dur"] / 1e6 for e in events]
+            line = (
+                f"{name:<24} {len(events):7d} {sum(durations):10.3f} "
+                f"{sum(durations) / len(durations):10.3f} {max(durations):10.3f}"
+            )
+            if self.memory:
+                peak = max(e["args"]["peak_bytes"] for e in events)
+                line += f" {peak / 1024**2:10.1f}"
+            lines.append(line)
+        if self.counters:
+            lines.append("")
+            lines.append(f"{'counter':<24} {'value':>7}")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"{name:<24} {value:7d}")
+        lines.append(f"{'wall time [s]':<24} {self._now() / 1e6:7.3f}")
+        return "\n".join(lines)
+
+
+def enable(memory=False):
+    """
+    Start recording spans and counters of the process
+
+    Returns
+    -------
+    Profiler
+    """
+    global _profiler
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _profiler = Profiler(memory=memory)
+    return _profiler
+
+
+def disable():
+    """
+    Stop recording
+
+    Returns
+    -------
+    The Profiler that was enabled, or None
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None and profiler.memory:
+        tracemalloc.stop()
+    return profiler
+
+
+def span(name, **args):
+    """
+    Context manager timing a phase, args are stored with the span
+
+    >>> with span("scan", case="mycase"):
+    ...     pass
+    """
+    if _profiler is None:
+        return _null
+    return _profiler.span(name, **args)
+
+
+def count(name, n=1):
+    """
+    Add n to the counter name
+    """
+    if _profiler is not None:
+        _profiler.count(name, n)
@@ -1,22 +1,183 @@
-import kerchunk
-from kerchunk.combine import MultiZarrToZarr
+"""
+Combination of per file kerchunk references into one reference set per level
+dimension.
 
+References are concatenated along time, batch_size files at a time, with
+the public MultiZarrToZarr API. Parquet reference sets are written
+incrementally with one directory per variable, each holding records of
+record_size references, so only the references of one batch are held in
+memory. JSON reference sets are built in memory in full.
 
-def export_dict_to_parq(dictionary, fname):
-    """Export dict reference to parquet."""
-    kerchunk.df.refs_to_dataframe(dictionary, fname)
-    return
+The reference sets of a file template share a manifest listing path, size and
+mtime of the source files in time order. It is used to index only new or
+changed files and add them to the existing reference sets.
 
+fsspec and kerchunk are imported by the functions using them, so the module
+can be imported for its defaults without loading them.
+"""
 
-def combine_joined_reference_parquet(ref_files):
-    out_dict = MultiZarrToZarr(
-        ref_files,
+import json
+import os
+
+DEFAULT_BATCH_SIZE = 24
+DEFAULT_RECORD_SIZE = 100000
+IDENTICAL_DIMS = ["lat", "lon", "y", "x", "forecast_offset", "level"]
+
+
+def load_references(ref_file):
+    """
+    Return the references in a JSON file, dicts are returned as is
+    """
+    if isinstance(ref_file, dict):
+        return ref_file
+    with open(ref_file, "r") as f:
+        return json.load(f)
+
+
+def open_references(filename, toc_filetype, record_size=None):
+    """
+    Return an empty, writable reference set
+    """
+    if toc_filetype == "parquet":
+        import fsspec
+        from fsspec.implementations.reference import LazyReferenceMapper
+
+        fs = fsspec.filesystem("file")
+        return LazyReferenceMapper.create(filename, fs=fs, record_size=record_size)
+    elif toc_filetype == "json":
+        return {}
+    raise ValueError(f"Unknown reference file type {toc_filetype}")
+
+
+def combine_references(
+    ref_files,
+    filename,
+    toc_filetype="json",
+    times=None,
+    append=False,
+    batch_size=DEFAULT_BATCH_SIZE,
+    record_size=DEFAULT_RECORD_SIZE,
+):
+    """
+    Concatenate references along time and write them to filename
+
+    The first batch is combined with MultiZarrToZarr and every following
+    batch is added with MultiZarrToZarr.append. Parquet reference sets are
+    extended in place, so only one batch of references is held in memory.
+    JSON reference sets are held in memory in full and written at the end.
+
+    Inputs
+    ------
+    ref_files : list
+        Reference files or dicts, one per lead time in time order
+    filename : str
+        Output JSON file or Parquet directory
+    toc_filetype : str
+        json or parquet
+    times : list
+        Time index of each reference file, default is the position in ref_files
+    append : bool
+        Add to the existing reference set in filename instead of creating a
+        new set. References of times already present are replaced
+    batch_size : int
+        Number of reference sets combined at a time
+    record_size : int
+        Number of references per Parquet file of a new reference set
+    """
+    from kerchunk.combine import MultiZarrToZarr
+
+    if toc_filetype not in ("json", "parquet"):
+        raise ValueError(f"Unknown reference file type {toc_filetype}")
+    if times is None:
+        times = list(range(len(ref_files)))
+    options = dict(
         remote_protocol="file",
         concat_dims=["time"],
-        coo_map={
-            "time": "INDEX"
-        },  # "data:time"}, does not work as time is missing in some/all files
-        identical_dims=["lat", "lon", "y", "x", "forecast_offset", "level"],
-    ).translate()
+        identical_dims=IDENTICAL_DIMS,
+    )
+
+    # The combined references so far, None before the first batch
+    refs = None
+    if append:
+        refs = filename if toc_filetype == "parquet" else load_references(filename)
+
+    for start in range(0, len(ref_files), batch_size):
+        # Loaded here as MultiZarrToZarr does not keep the order of files
+        batch = [load_references(x) for x in ref_files[start : start + batch_size]]
+        # The position of the file, time is missing in some/all files
+        coo_map = {"time": times[start : start + batch_size]}
+        if refs is None:
+            out = open_references(filename, toc_filetype, record_size)
+            mzz = MultiZarrToZarr(batch, out=out, coo_map=coo_map, **options)
+        else:
+            # The times of refs are read back and the coordinate is rewritten
+            mzz = MultiZarrToZarr.append(batch, refs, coo_map=coo_map, **options)
+        out = mzz.translate()
+        refs = filename if toc_filetype == "parquet" else out
+
+    if toc_filetype == "json" and refs is not None:
+        with open(filename, "w") as f:
+            json.dump(refs, f)
+
+
+def refresh_plan(manifest_files, stats):
+    """
+    Return the time indexes of files to index, or None to index all files
+
+    Files can only be added after the files of the manifest, which must be
+    unchanged in number and order. Files of the manifest with a different
+    size or mtime are indexed again.
+
+    >>> old = [{"path": "a", "size": 1, "mtime": 1}, {"path": "b", "size": 1, "mtime": 1}]
+    >>> refresh_plan(old, old + [{"path": "c", "size": 1, "mtime": 2}])
+    [2]
+    >>> refresh_plan(old, [old[0], {"path": "b", "size": 2, "mtime": 3}])
+    [1]
+    >>> refresh_plan(old, old)
+    []
+    >>> refresh_plan(old, old[1:]) is None
+    True
+    """
+    paths = [x["path"] for x in manifest_files]
+    if paths != [x["path"] for x in stats[: len(paths)]]:
+        return None
+    return [
+        i
+        for i, x in enumerate(stats)
+        if i >= len(manifest_files) or x != manifest_files[i]
+    ]
+
+
+def read_manifest(filename):
+    """
+    Return the manifest in filename or None if it does not exist
+    """
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def write_manifest(filename, toc_filetype, level_dims, stats):
+    """
+    Write the manifest of the reference sets of a file template
 
-    return out_dict
+    Inputs
+    ------
+    filename : str
+        Manifest file
+    toc_filetype : str
+        json or parquet
+    level_dims : dict
+        Level dimension and dict of the reference file and the time indexes
+        it holds
+    stats : list
+        path, size and mtime of the source files in time order
+    """
+    manifest = {
+        "toc_filetype": toc_filetype,
+        "level_dims": level_dims,
+        "files": stats,
+    }
+    with open(filename, "w") as f:
+        json.dump(manifest, f, indent=2)
@@ -0,0 +1,151 @@
+"""
+Commands on a remote host over one shared SSH connection.
+
+All ssh and rsync calls to a host go through an OpenSSH control master
+(ControlMaster/ControlPersist), so only the first call pays for the
+connection and authentication. The files already on the remote host are
+taken from one recursive manifest of the destination tree, and missing or
+partial files are decided locally.
+"""
+
+import os
+import shlex
+import subprocess
+
+CONTROL_PATH = os.path.join("~", ".ssh", "dcmdb-%C")
+CONTROL_PERSIST = 600
+
+
+class RemoteHost:
+    def __init__(
+        self,
+        host,
+        ssh="ssh",
+        control_path=CONTROL_PATH,
+        control_persist=CONTROL_PERSIST,
+        printlev=0,
+    ):
+        """
+        Inputs
+        ------
+        host : str
+            Remote host as given to ssh, e.g. user@host or a Host of ~/.ssh/config
+        ssh : str
+            ssh command, e.g. a stand-in for testing
+        control_path : str
+            Socket of the control master, None to not share the connection
+        control_persist : int
+            Seconds the control master is kept open after the last use
+        printlev : int
+            Verbosity
+        """
+        self.host = host
+        self.ssh = ssh
+        self.printlev = printlev
+        self.options = []
+        if control_path is not None:
+            self.options = [
+                "-o",
+                "ControlMaster=auto",
+                "-o",
+                f"ControlPath={os.path.expanduser(control_path)}",
+                "-o",
+                f"ControlPersist={control_persist}",
+            ]
+
+    def command(self, *args):
+        """
+        Return the ssh command running args on the host, args are quoted
+        """
+        return [self.ssh, *self.options, self.host, " ".join(map(shlex.quote, args))]
+
+    def rsync_shell(self):
+        """
+        Return the remote shell for rsync -e, sharing the connection
+        """
+        return " ".join(map(shlex.quote, [self.ssh, *self.options]))
+
+    def run(self, *args, check=True):
+        cmd = self.command(*args)
+        if self.printlev > 0:
+            print(" ".join(cmd))
+        res = subprocess.run(cmd, capture_output=True, text=True)
+        # ssh exits with 255 on connection errors
+        if res.returncode == 255 or (check and res.returncode != 0):
+            raise OSError(
+                f"{' '.join(cmd)} failed with exit code {res.returncode}: "
+                f"{res.stderr.strip()}"
+            )
+        return res
+
+    def manifest(self, path):
+        """
+        List all files below path with one remote call
+
+        Returns
+        -------
+        dict of the path of each file and a dict of its size and mtime,
+        empty if path does not exist
+        """
+        res = self.run(
+            "find", path, "-type", "f", "-printf", r"%p\t%s\t%T@\n", check=False
+        )
+        manifest = {}
+        for line in res.stdout.splitlines():
+            name, size, mtime = line.rsplit("\t", 2)
+            manifest[os.path.normpath(name)] = {
+                "size": int(size),
+                "mtime": float(mtime),
+            }
+        return manifest
+
+    def md5sum(self, paths, chunksize=1000):
+        """
+        Return the md5 checksums of the files paths on the host, with one
+        remote call per chunksize files
+
+        Returns
+        -------
+        dict of the path of each file and its checksum, missing files are
+        left out
+        """
+        res = {}
+        for i in range(0, len(paths), chunksize):
+            out = self.run("md5sum", "--", *paths[i : i + chunksize], check=False)
+            for line in out.stdout.splitlines():
+                md5, name = line.split(None, 1)
+                res[os.path.normpath(name.lstrip("*"))] = md5
+        return res
+
+    def close(self):
+        """
+        Stop the control master
+        """
+        if self.options:
+            subprocess.run(
+                [self.ssh, *self.options, "-O", "exit", self.host],
+                capture_output=True,
+            )
+
+
+def missing_files(files, sizes, outpath, manifest):
+    """
+    Return the base names of files missing in outpath according to manifest
+
+    A file with a different size than on the remote host is missing as well,
+    e.g. after an interrupted transfer. Files of unknown size (None or 0) are
+    only checked for existence.
+
+    >>> manifest = {"/r/a": {"size": 3, "mtime": 0}, "/r/b": {"size": 1, "mtime": 0}}
+    >>> missing_files(["ec:/x/a", "ec:/x/b", "ec:/x/c"], [3, 2, 1], "/r", manifest)
+    ['b', 'c']
+    >>> missing_files(["ec:/x/a", "ec:/x/b"], [None, None], "/r/", manifest)
+    []
+    """
+    missing = []
+    for filename, size in zip(files, sizes):
+        name = os.path.basename(filename)
+        entry = manifest.get(os.path.join(os.path.normpath(outpath), name))
+        if entry is None or (size and entry["size"] != size):
+            missing.append(name)
+    return missing
@@ -1,16 +1,335 @@
 """Collection of time handling functions."""
 
 import datetime
+import functools
 import re
 import sys
 
+# Leadtime directives and their str.format replacements, longest first
+LEADTIME_FIELDS = (
+    ("%LLLL", "{h:04d}"),
+    ("%LLL", "{h:03d}"),
+    ("%LL", "{h:02d}"),
+    ("%LM", "{m:02d}"),
+)
+
+# Directives understood by simulation_datetime.strptime as (length, field, format)
+PARSE_DIRECTIVES = {
+    "%Y": (4, "year", "{d.year:04d}"),
+    "%m": (2, "month", "{d.month:02d}"),
+    "%d": (2, "day", "{d.day:02d}"),
+    "%H": (2, "hour", "{d.hour:02d}"),
+    "%M": (2, "minute", "{d.minute:02d}"),
+    "%S": (2, "second", "{d.second:02d}"),
+    "%LLLL": (4, "leadtime_hour", "{h:04d}"),
+    "%LLL": (3, "leadtime_hour", "{h:03d}"),
+    "%LL": (2, "leadtime_hour", "{h:02d}"),
+    "%LM": (2, "leadtime_minute", "{m:02d}"),
+}
+PARSE_DIRECTIVES_RE = re.compile("|".join(PARSE_DIRECTIVES))
+UNKNOWN_DIRECTIVE_RE = re.compile(r"%(?!LLLL|LLL|LL|LM|[YmdHMS])")
+
 
 def hub(p, dtgs, leadtime=0):
 
-    dtg = simulation_datetime.strptime(dtgs, "%Y-%m-%d %H:%M:%S")
-    dtg.leadtime = datetime.timedelta(seconds=leadtime)
+    return time_template(p).format(dtgs, leadtime)
+
+
+@functools.lru_cache(maxsize=256)
+def leadtime_pattern(p):
+    """
+    Compile a template to a strftime format with str.format fields for the leadtime
+
+    >>> leadtime_pattern("fc%Y%m%d%H+%LLLh%LMmgrib2_fp")
+    'fc%Y%m%d%H+{h:03d}h{m:02d}mgrib2_fp'
+    """
+    p = p.replace("{", "{{").replace("}", "}}")
+    for key, field in LEADTIME_FIELDS:
+        p = p.replace(key, field)
+    return p
+
+
+def expand_paths(p, dtgs, leadtimes):
+    """
+    Generate paths for all combinations of dates and leadtimes
+
+    The date part of the template is expanded once per date and only the
+    leadtime fields are filled in per path. The result is identical to
+    calling hub for each combination.
+
+    Inputs
+    ------
+    p : str
+        Template
+    dtgs : list
+        Dates as "%Y-%m-%d %H:%M:%S" strings or datetime objects
+    leadtimes : list
+        Leadtimes in seconds, applied to every date
+
+    >>> list(expand_paths("%Y%m%d%H/fc+%LLLh%LMm", ["2024-09-01 06:00:00"], [0, 5400]))
+    ['2024090106/fc+000h00m', '2024090106/fc+001h30m']
+    """
+    return time_template(p).format_many(dtgs, leadtimes)
+
+
+def as_datetime(dtg):
+    """
+    Return dtg given as datetime or "%Y-%m-%d %H:%M:%S" string as datetime
+    """
+    if isinstance(dtg, str):
+        return datetime.datetime.fromisoformat(dtg)
+    return dtg
+
+
+class TimeTemplate:
+    """
+    Template with date and leadtime directives compiled for repeated use
+
+    The template is split once into literal parts and fixed width fields.
+    Parsing is a single regular expression match and formatting a single
+    str.format call. Templates with directives beyond those known by
+    simulation_datetime.strptime fall back to strptime/strftime.
+
+    >>> t = TimeTemplate("fc%Y%m%d%H+%LLLh%LMmgrib2_fp")
+    >>> dt = t.parse("fc2024090106+003h15mgrib2_fp")
+    >>> dt, dt.leadtime
+    (simulation_datetime(2024, 9, 1, 6, 0), datetime.timedelta(seconds=11700))
+    >>> t.format("2024-09-01 06:00:00", 11700)
+    'fc2024090106+003h15mgrib2_fp'
+    >>> t.match("fc2024090106+003h75mgrib2_fp") is None
+    True
+    >>> list(t.format_many([dt], [0, 900]))
+    ['fc2024090106+000h00mgrib2_fp', 'fc2024090106+000h15mgrib2_fp']
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self.supported = UNKNOWN_DIRECTIVE_RE.search(template) is None
+
+        # Literal parts and fields in order of appearance
+        self.parts = []
+        self.fields = []
+        self.length = 0
+        pos = 0
+        for match in PARSE_DIRECTIVES_RE.finditer(template):
+            if match.start() > pos:
+                self.parts.append(template[pos : match.start()])
+            self.parts.append(match.group())
+            pos = match.end()
+        if pos < len(template):
+            self.parts.append(template[pos:])
+
+        fmt, date_fmt = [], []
+        for part in self.parts:
+            if part in PARSE_DIRECTIVES:
+                length, field, pyfmt = PARSE_DIRECTIVES[part]
+                self.fields.append((self.length, length, field))
+                self.length += length
+                fmt.append(pyfmt)
+                date_fmt.append(pyfmt if field[0] != "l" else "{" + pyfmt + "}")
+            else:
+                self.length += len(part)
+                literal = part.replace("{", "{{").replace("}", "}}")
+                fmt.append(literal)
+                date_fmt.append(literal.replace("{", "{{").replace("}", "}}"))
+
+        # Fields of the regex groups, repeated directives are back references
+        directives = [x for x in self.parts if x in PARSE_DIRECTIVES]
+        self.group_fields = [PARSE_DIRECTIVES[x][1] for x in dict.fromkeys(directives)]
+
+        if self.supported:
+            self.pyformat = "".join(fmt)
+            self.date_format = "".join(date_fmt)
+            self.regex = re.compile(self.regex_source())
+        else:
+            self.pattern = leadtime_pattern(template)
 
-    return dtg.strftime(p)
+    def regex_source(self, prefix=""):
+        """
+        Return a regular expression with named groups prefix + f0, f1, ...
+        """
+        regex = []
+        seen = {}
+        for part in self.parts:
+            if part not in PARSE_DIRECTIVES:
+                regex.append(re.escape(part))
+            elif part in seen:
+                regex.append(f"(?P={seen[part]})")
+            else:
+                seen[part] = f"{prefix}f{len(seen)}"
+                regex.append(f"(?P<{seen[part]}>\\d{{{PARSE_DIRECTIVES[part][0]}}})")
+        return "".join(regex)
+
+    def from_values(self, values):
+        """
+        Build a simulation_datetime from the matched groups of regex_source
+
+        Returns None if the values are not a valid date and leadtime, i.e.
+        where strptime would fail on its strftime round trip.
+        """
+        time_info = {}
+        for value, field in zip(values, self.group_fields):
+            value = int(value)
+            if time_info.setdefault(field, value) != value:
+                # E.g. %LLL and %LL giving different leadtimes
+                return None
+        minutes = time_info.pop("leadtime_minute", 0)
+        if minutes >= 60:
+            return None
+        leadtime = datetime.timedelta(
+            0, 3600 * time_info.pop("leadtime_hour", 0) + 60 * minutes
+        )
+        try:
+            return simulation_datetime(**time_info, leadtime=leadtime)
+        except ValueError:
+            return None
+
+    def match(self, string):
+        """
+        Parse string, return None if it does not match the template
+        """
+        if not self.supported:
+            try:
+                return simulation_datetime._strptime(string, self.template)
+            except ValueError:
+                return None
+        if len(string) != self.length:
+            return None
+        m = self.regex.fullmatch(string)
+        return self.from_values(m.groups()) if m is not None else None
+
+    def parse(self, string):
+        """
+        Parse string as simulation_datetime.strptime does
+        """
+        dt = self.match(string)
+        if dt is None:
+            raise ValueError(
+                f"String {string} does not match format {self.template} with leadtime"
+            )
+        return dt
+
+    def parse_many(self, strings):
+        """
+        Parse strings, giving None for those not matching the template
+        """
+        return [self.match(x) for x in strings]
+
+    def format(self, dtg, leadtime=0):
+        """
+        Format a date given as datetime or "%Y-%m-%d %H:%M:%S" string and leadtime in seconds
+        """
+        h, m = divmod(int(leadtime or 0) // 60, 60)
+        dtg = as_datetime(dtg)
+        if self.supported:
+            return self.pyformat.format(d=dtg, h=h, m=m)
+        return datetime.datetime.strftime(dtg, self.pattern).format(h=h, m=m)
+
+    def format_many(self, dtgs, leadtimes):
+        """
+        Generate the formatted template for all combinations of dates and leadtimes
+        """
+        hm = [divmod(int(x or 0) // 60, 60) for x in leadtimes]
+        for dtg in dtgs:
+            dtg = as_datetime(dtg)
+            if self.supported:
+                dated = self.date_format.format(d=dtg).format
+            else:
+                dated = datetime.datetime.strftime(dtg, self.pattern).format
+            for h, m in hm:
+                yield dated(h=h, m=m)
+
+
+@functools.lru_cache(maxsize=1024)
+def time_template(template):
+    """
+    Return the compiled TimeTemplate for template, cached
+    """
+    return TimeTemplate(template)
+
+
+class TemplateMatcher:
+    """
+    Classify strings against several templates in a single regex match
+
+    The templates are combined into one regular expression with a named
+    group per template and directive, so strings matching no template are
+    rejected with a single regex match. match_all returns the index of every
+    matching template along with the parsed date and leadtime, giving the
+    same result as calling simulation_datetime.strptime with each template
+    without raising and catching an exception for every string that does
+    not match.
+
+    Templates with directives strptime does not know are matched by
+    calling strptime as a fallback.
+
+    >>> m = TemplateMatcher(["%Y%m%d/fc+%LLLh%LMm", "%Y%m%d/sfx+%LLL"])
+    >>> m.match("20240901/sfx+003")
+    (1, simulation_datetime(2024, 9, 1, 0, 0))
+    >>> m.match("20240901/fc+003h15m")[1].leadtime
+    datetime.timedelta(seconds=11700)
+    >>> m.match("20240901/fc+003h75m") is None
+    True
+    >>> m = TemplateMatcher(["fc+%LLLLh00m", "fc+%LLLLh%LMm"])
+    >>> [i for i, _ in m.match_all("fc+0001h00m")]
+    [0, 1]
+    >>> [i for i, _ in m.match_all("fc+0001h15m")]
+    [1]
+    """
+
+    def __init__(self, templates):
+        self.templates = [time_template(x) for x in templates]
+        self.fallback = [i for i, t in enumerate(self.templates) if not t.supported]
+        parts = []
+        # Position of the groups of each template in the combined match
+        self.groups = {}
+        ngroups = 0
+        for i, t in enumerate(self.templates):
+            if t.supported:
+                parts.append(f"(?P<t{i}>{t.regex_source(f't{i}_')})")
+                self.groups[f"t{i}"] = (
+                    i,
+                    ngroups + 1,
+                    ngroups + 1 + len(t.group_fields),
+                )
+                ngroups += 1 + len(t.group_fields)
+        self.regex = re.compile("|".join(parts)) if len(parts) > 0 else None
+        self.supported = [i for i, t in enumerate(self.templates) if t.supported]
+
+    def match_all(self, string):
+        """
+        Return (template index, simulation_datetime) of all matching templates
+
+        The list is in template order and empty if no template matches.
+        """
+        res = []
+        m = self.regex.fullmatch(string) if self.regex is not None else None
+        if m is not None:
+            # The combined regex matches the first matching template, the
+            # templates after it may match as well
+            i, start, end = self.groups[m.lastgroup]
+            dt = self.templates[i].from_values(m.groups()[start:end])
+            if dt is not None:
+                res.append((i, dt))
+            for j in self.supported:
+                if j > i:
+                    dt = self.templates[j].match(string)
+                    if dt is not None:
+                        res.append((j, dt))
+
+        for i in self.fallback:
+            dt = self.templates[i].match(string)
+            if dt is not None:
+                res.append((i, dt))
+        return sorted(res, key=lambda x: x[0])
+
+    def match(self, string):
+        """
+        Return (template index, simulation_datetime) of the first matching
+        template or None if no template matches
+        """
+        res = self.match_all(string)
+        return res[0] if len(res) > 0 else None
 
 
 def expand_dates(sdate, edate, step):
@@ -99,6 +418,9 @@ class simulation_datetime(datetime.datetime):
         return instance
 
     def strptime(string, format):
+        return time_template(format).parse(string)
+
+    def _strptime(string, format):
         standard_directives = {
             "%Y": {"len": 4, "id": "year"},
             "%m": {"len": 2, "id": "month"},
@@ -0,0 +1,150 @@
+"""
+Reading, writing and querying of the GRIB message TOCs.
+
+A TOC lists the values of a few keys (shortName, level, ...) for every
+message of the first file of a file template. Besides the original JSON
+format, {"messages": [{key: value, ...}, ...]}, TOCs can be stored as
+columnar Arrow IPC or Parquet files with dictionary encoded string columns.
+Arrow files are memory mapped when read.
+
+All formats are read into a pyarrow Table with one row per message and a
+"message" column holding the position of the message in the file.
+"""
+
+import json
+import os
+
+TOC_FORMATS = {"json": ".json", "arrow": ".arrow", "parquet": ".parquet"}
+
+
+def toc_files(path, case, exp, file_template):
+    """
+    Return the possible TOC files of a file template in order of preference
+
+    >>> toc_files("cases", "mycase", "myexp", "fc%Y%m%d%H+%LLL")[::3]
+    ['cases/mycase/myexp_fc%Y%m%d%H+%LLL.arrow', 'cases/mycase/fc%Y%m%d%H+%LLL.json']
+    """
+    files = [
+        f"{path}/{case}/{exp}_{file_template}{TOC_FORMATS[x]}"
+        for x in ("arrow", "parquet", "json")
+    ]
+    # TOCs created before the experiment was added to the name
+    files.append(f"{path}/{case}/{file_template}.json")
+    return files
+
+
+def to_table(toc):
+    """
+    Convert a TOC in the JSON layout to a table, dictionary encoding strings
+
+    >>> toc = {"messages": [{"shortName": "t", "level": 1}, {"shortName": "u"}]}
+    >>> to_table(toc).to_pylist()
+    [{'shortName': 't', 'level': 1}, {'shortName': 'u', 'level': None}]
+    """
+    import pyarrow as pa
+
+    messages = toc["messages"]
+    keys = dict.fromkeys(k for message in messages for k in message)
+    columns = {}
+    for key in keys:
+        column = pa.array([message.get(key) for message in messages])
+        if pa.types.is_string(column.type):
+            column = column.dictionary_encode()
+        columns[key] = column
+    return pa.table(columns)
+
+
+def to_json(table):
+    """
+    Convert a table to a TOC in the JSON layout, leaving out missing keys
+    """
+    return {
+        "messages": [
+            {k: v for k, v in row.items() if v is not None}
+            for row in table.drop_columns(
+                [x for x in ("message",) if x in table.column_names]
+            ).to_pylist()
+        ]
+    }
+
+
+def write_toc(filename, toc, toc_format="json"):
+    """
+    Write a TOC in the JSON layout to filename in the given format
+    """
+    if toc_format == "json":
+        with open(filename, "w") as f:
+            json.dump(toc, f, indent=2)
+    elif toc_format == "arrow":
+        import pyarrow as pa
+
+        table = to_table(toc)
+        with pa.OSFile(filename, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    elif toc_format == "parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(to_table(toc), filename)
+    else:
+        raise ValueError(f"Unknown TOC format {toc_format}, use one of {TOC_FORMATS}")
+
+
+def read_toc(filename):
+    """
+    Read a TOC in any format to a table with a message column
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    ext = os.path.splitext(filename)[1]
+    if ext == TOC_FORMATS["arrow"]:
+        table = pa.ipc.open_file(pa.memory_map(filename, "r")).read_all()
+    elif ext == TOC_FORMATS["parquet"]:
+        table = pq.read_table(filename, memory_map=True)
+    else:
+        with open(filename, "r") as f:
+            table = to_table(json.load(f))
+    return table.append_column("message", pa.array(range(table.num_rows)))
+
+
+def select(table, **filters):
+    """
+    Select the messages of a TOC matching all filters
+
+    A filter value can be a single value, a list/tuple/set of values or a
+    range, e.g. level=range(1, 91) for levels 1 to 90.
+
+    >>> toc = {"messages": [
+    ...     {"shortName": "t", "typeOfLevel": "hybrid", "level": 1},
+    ...     {"shortName": "t", "typeOfLevel": "hybrid", "level": 91},
+    ...     {"shortName": "u", "typeOfLevel": "hybrid", "level": 1},
+    ... ]}
+    >>> table = to_table(toc)
+    >>> select(table, shortName="t", level=range(1, 91)).to_pylist()
+    [{'shortName': 't', 'typeOfLevel': 'hybrid', 'level': 1}]
+    >>> select(table, shortName=["t", "u"], level=1).num_rows
+    2
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    mask = None
+    for key, value in filters.items():
+        if key not in table.column_names:
+            raise KeyError(f"{key} is not in the TOC, available: {table.column_names}")
+        column = table[key]
+        if pa.types.is_dictionary(column.type):
+            column = column.cast(column.type.value_type)
+        if isinstance(value, range) and value.step == 1:
+            cond = pc.and_(
+                pc.greater_equal(column, value.start), pc.less(column, value.stop)
+            )
+        elif isinstance(value, (range, list, tuple, set)):
+            cond = pc.is_in(column, value_set=pa.array(list(value), column.type))
+        else:
+            cond = pc.equal(column, value)
+        mask = cond if mask is None else pc.and_(mask, cond)
+    if mask is None:
+        return table
+    return table.filter(pc.fill_null(mask, False))
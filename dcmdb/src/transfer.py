@@ -0,0 +1,603 @@
+"""
+Pipelined transfer of case data to a remote host.
+
+The files of each case, experiment and date form a transfer job. A job is
+fetched from ECFS to a scratch directory, pushed to the remote host with
+rsync and removed from scratch again. The three stages run concurrently over
+the queue of jobs, so ECFS recalls of the next dates overlap with the rsync of
+the current one. Fetching waits while the fetched files would exceed the
+scratch budget, and each job is pushed by several rsync streams with the files
+balanced by size.
+
+The state of each file is kept in a TransferJournal. Pushed files are checked
+for their size (and checksum) on the remote host before they are removed from
+scratch, and a transfer that is run again skips the verified files and reuses
+the files still on scratch.
+"""
+
+import os
+import queue
+import re
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+
+from .helpers import file_stats
+from .timehandling import hub
+from .transfer_journal import DONE, TransferJournal, md5sum
+
+DEFAULT_SCRATCH_BUDGET = 100 * 1024**3
+DEFAULT_PUSH_STREAMS = 4
+UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_bytes(size):
+    """
+    Convert a size like 500G to bytes
+
+    >>> parse_bytes("1.5G")
+    1610612736
+    >>> parse_bytes(1000)
+    1000
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+    size = size.strip().upper().rstrip("B")
+    if size[-1] in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1]])
+    return int(size)
+
+
+def format_bytes(nbytes):
+    """
+    >>> format_bytes(1610612736)
+    '1.5 GB'
+    >>> format_bytes(10)
+    '10 B'
+    """
+    for unit in ("T", "G", "M", "K"):
+        if nbytes >= UNITS[unit]:
+            return f"{nbytes / UNITS[unit]:.1f} {unit}B"
+    return f"{nbytes} B"
+
+
+def balance(files, sizes, nstreams):
+    """
+    Split files into at most nstreams groups of about equal total size
+
+    The largest files are assigned first, each to the group with the
+    smallest total so far.
+
+    >>> balance(["a", "b", "c", "d"], [5, 4, 3, 3], 2)
+    [['a', 'd'], ['b', 'c']]
+    >>> balance(["a"], [1], 4)
+    [['a']]
+    """
+    groups = [[] for _ in range(min(nstreams, len(files)))]
+    totals = [0] * len(groups)
+    for size, f in sorted(zip(sizes, files), key=lambda x: -x[0]):
+        i = totals.index(min(totals))
+        groups[i].append(f)
+        totals[i] += size
+    return groups
+
+
+class ScratchBudget:
+    def __init__(self, nbytes):
+        """
+        Bytes on scratch shared by the fetch and clean stages
+
+        Inputs
+        ------
+        nbytes : int
+            Maximum number of fetched bytes on scratch
+        """
+        self.nbytes = nbytes
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes):
+        """
+        Wait until nbytes fit in the budget
+
+        A job larger than the budget waits until scratch is empty.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.used == 0 or self.used + nbytes <= self.nbytes
+            )
+            self.used += nbytes
+
+    def release(self, nbytes):
+        with self._cond:
+            self.used -= nbytes
+            self._cond.notify_all()
+
+
+class TransferJob:
+    def __init__(self, case, exp, date, files, sizes, scratch, host, outpath):
+        """
+        The files of one case, experiment and date
+
+        Inputs
+        ------
+        files : list
+            Source files, archived (ec:/ectmp:) files are fetched, other files
+            are linked to scratch
+        sizes : list
+            Size of each file, None if unknown
+        scratch : str
+            Scratch directory of the job
+        host : str
+            Remote host
+        outpath : str
+            Remote directory
+        """
+        self.case = case
+        self.exp = exp
+        self.date = date
+        self.files = files
+        self.sizes = [x or 0 for x in sizes]
+        self.scratch = scratch
+        self.host = host
+        self.outpath = outpath
+        self.in_place = 0
+        self.clean = True
+        self.ok = True
+        # Files that could not be fetched by base name
+        self.errors = {}
+        self.reserved = 0
+        # Journal state of the files by base name
+        self.states = {}
+
+    @property
+    def nbytes(self):
+        return sum(self.sizes)
+
+    @property
+    def scratch_bytes(self):
+        return sum(s for f, s in zip(self.files, self.sizes) if re.match("^ec", f))
+
+    @property
+    def remote(self):
+        return {"host": self.host, "outpath": self.outpath}
+
+    @property
+    def names(self):
+        return [os.path.basename(f) for f in self.files]
+
+    def dest(self, name):
+        """
+        Return the remote path of the file name
+        """
+        return os.path.join(os.path.normpath(self.outpath), name)
+
+    def entries(self, names, md5s={}):
+        """
+        Return the journal entries of the files names
+        """
+        names = set(names)
+        return [
+            {"dest": self.dest(n), "source": f, "size": s, "md5": md5s.get(n)}
+            for n, f, s in zip(self.names, self.files, self.sizes)
+            if n in names
+        ]
+
+    def select(self, names):
+        """
+        Keep only the files with the given base names
+        """
+        names = set(names)
+        keep = [i for i, f in enumerate(self.files) if os.path.basename(f) in names]
+        self.files = [self.files[i] for i in keep]
+        self.sizes = [self.sizes[i] for i in keep]
+
+    def __str__(self):
+        return f"{self.case}/{self.exp} {self.date}"
+
+
+def plan(cases, remote, scratch, dates=None, leadtimes=None, file_template=None):
+    """
+    Return the transfer jobs of the selected cases, one per experiment and date
+
+    Inputs
+    ------
+    cases : Cases
+        Selected cases and experiments
+    remote : str
+        Remote host, its path template is taken from meta.yaml
+    scratch : str
+        Root of the scratch directories
+    dates : list
+        datetimes to transfer, all if empty
+    leadtimes : list
+        Lead times to transfer, all if empty
+    file_template : str
+        File template to transfer, all if None. A ValueError is raised if
+        a selected experiment has no such file template
+
+    Returns
+    -------
+    list of TransferJob
+    """
+    selected = []
+    for case_name, case in cases.cases.items():
+        runs = case.runs.values() if isinstance(case.runs, dict) else [case.runs]
+        for exp in runs:
+            if remote not in case.props[exp.name]:
+                print(f"  {remote} not defined for {case_name}/{exp.name}")
+                continue
+            outpath_template = case.props[exp.name][remote]["path_template"]
+            scratch_template = os.path.join(
+                scratch, case_name, exp.name, "%Y/%m/%d/%H/"
+            )
+            if file_template and file_template not in exp.file_templates:
+                raise ValueError(
+                    f"No match for: {file_template} in {case_name}/{exp.name}, "
+                    + f"file templates are {exp.file_templates}"
+                )
+            templates = [file_template] if file_template else exp.file_templates
+            exp_dates = sorted(
+                set().union(*[exp.data[x] for x in templates if x in exp.data])
+            )
+            if len(exp_dates) == 0:
+                print(f"  no data available for {case_name}/{exp.name}")
+                continue
+
+            for date in exp_dates:
+                if dates:
+                    if datetime.strptime(date, "%Y-%m-%d %H:%M:%S") not in dates:
+                        continue
+                files = exp.reconstruct(
+                    dtg=date, leadtime=leadtimes, file_template=file_template
+                )
+                selected.append(
+                    (
+                        case_name,
+                        exp.name,
+                        date,
+                        files,
+                        hub(scratch_template, date),
+                        hub(outpath_template, date),
+                    )
+                )
+
+    # The sizes of all files at once, listing each directory once
+    stats = iter(file_stats([f for x in selected for f in x[3]]))
+    jobs = []
+    for case_name, exp_name, date, files, scratch_path, outpath in selected:
+        sizes = [next(stats)["size"] for _ in files]
+        jobs.append(
+            TransferJob(
+                case_name, exp_name, date, files, sizes, scratch_path, remote, outpath
+            )
+        )
+    return jobs
+
+
+def print_plan(jobs):
+    for job in jobs:
+        print(
+            f" {job}: {len(job.files)} files, {format_bytes(job.nbytes)}"
+            f" -> {job.host}:{job.outpath}"
+        )
+    nfiles = sum(len(job.files) for job in jobs)
+    nbytes = sum(job.nbytes for job in jobs)
+    print(f"Total: {len(jobs)} dates, {nfiles} files, {format_bytes(nbytes)}")
+
+
+class TransferEngine:
+    def __init__(
+        self,
+        cases,
+        scratch_budget=DEFAULT_SCRATCH_BUDGET,
+        push_streams=DEFAULT_PUSH_STREAMS,
+        journal=None,
+        checksum=False,
+        printlev=1,
+    ):
+        """
+        Run transfer jobs through concurrent fetch, push and clean stages
+
+        Inputs
+        ------
+        cases : Cases
+            Used to check the remote host, fetch and clean files
+        scratch_budget : int or str
+            Maximum number of fetched bytes on scratch, e.g. 500G
+        push_streams : int
+            Number of concurrent rsync streams per job
+        journal : TransferJournal
+            State of the transferred files, default ~/.cache/dcmdb/transfers.sqlite
+        checksum : bool
+            Record the md5 checksum of fetched files and compare it on the
+            remote host, otherwise only sizes are compared
+        printlev : int
+            Verbosity
+        """
+        self.cases = cases
+        self.budget = ScratchBudget(parse_bytes(scratch_budget))
+        self.push_streams = push_streams
+        self.journal = journal if journal is not None else TransferJournal()
+        self.checksum = checksum
+        self.printlev = printlev
+
+    def run(self, jobs):
+        """
+        Transfer all jobs
+
+        Returns
+        -------
+        list of the jobs that failed to push or verify
+        """
+        self.resume(jobs)
+        self.check_remote(jobs)
+        fetched = queue.Queue()
+        pushed = queue.Queue()
+        failed = []
+        stages = [
+            threading.Thread(target=self.push_stage, args=(fetched, pushed)),
+            threading.Thread(target=self.clean_stage, args=(pushed, failed)),
+        ]
+        for stage in stages:
+            stage.start()
+        try:
+            self.fetch_stage(jobs, fetched)
+        finally:
+            fetched.put(None)
+            for stage in stages:
+                stage.join()
+        return failed
+
+    def resume(self, jobs):
+        """
+        Drop the files verified on the remote host according to the journal
+        and keep the state of the others
+
+        Files are only resumed if their size has not changed since.
+        """
+        for job in jobs:
+            known = self.journal.get(job.host, [job.dest(x) for x in job.names])
+            done = []
+            job.states = {}
+            for name, size in zip(job.names, job.sizes):
+                entry = known.get(job.dest(name))
+                if entry is None or entry["size"] != size:
+                    continue
+                if entry["state"] in DONE:
+                    done.append(name)
+                else:
+                    job.states[name] = entry["state"]
+            job.in_place = len(done)
+            job.select([x for x in job.names if x not in done])
+
+    def manifest(self, host, jobs):
+        """
+        List the files on host once for the directory holding all
+        destinations of jobs
+        """
+        remote = self.cases.remote_host(host)
+        outpaths = sorted({job.outpath for job in jobs})
+        root = os.path.commonpath(outpaths)
+        # Do not list the whole file system for unrelated destinations
+        roots = outpaths if root == os.sep else [root]
+        manifest = {}
+        for x in roots:
+            manifest.update(remote.manifest(x))
+        return manifest
+
+    def check_remote(self, jobs):
+        """
+        Keep only the files missing on the remote hosts and create the
+        remote directories
+
+        The files on each host are listed once, and all directories are
+        created in one call. Hosts with nothing left to transfer according
+        to the journal are not contacted.
+        """
+        hosts = {}
+        for job in jobs:
+            if job.files:
+                hosts.setdefault(job.host, []).append(job)
+        for host, host_jobs in hosts.items():
+            manifest = self.manifest(host, host_jobs)
+            create = set()
+            for job in host_jobs:
+                missing = set(
+                    self.cases.check_remote(job.files, job.remote, job.sizes, manifest)
+                )
+                # Files that failed a verification are sent again
+                missing.update(n for n, s in job.states.items() if s == "failed")
+                in_place = [x for x in job.names if x not in missing]
+                self.journal.record(job.host, job.entries(in_place), "verified")
+                # Remove what an interrupted run left on scratch
+                sizes = dict(zip(job.names, job.sizes))
+                leftover = [x for x in in_place if self.on_scratch(job, x, sizes[x])]
+                if leftover:
+                    self.cases.clean(leftover, job.scratch)
+                    self.journal.record(job.host, job.entries(leftover), "cleaned")
+                job.in_place += len(in_place)
+                job.select(missing)
+                if job.files:
+                    create.add(job.outpath)
+            if create:
+                self.cases.remote_host(host).run("mkdir", "-p", *sorted(create))
+
+    def mismatches(self, job, manifest):
+        """
+        Compare the files of job on the remote host with their sizes and
+        the checksums in the journal
+
+        Returns
+        -------
+        dict of the base names of the bad files and the reason
+        """
+        bad = {}
+        for name, size in zip(job.names, job.sizes):
+            entry = manifest.get(job.dest(name))
+            if entry is None:
+                bad[name] = "missing"
+            elif size and entry["size"] != size:
+                bad[name] = f"size {entry['size']} instead of {size}"
+        if self.checksum:
+            known = self.journal.get(job.host, [job.dest(x) for x in job.names])
+            expected = {
+                dest: x["md5"]
+                for dest, x in known.items()
+                if x["md5"] and os.path.basename(dest) not in bad
+            }
+            remote = self.cases.remote_host(job.host).md5sum(sorted(expected))
+            for dest, md5 in expected.items():
+                if remote.get(dest) != md5:
+                    bad[os.path.basename(dest)] = "checksum mismatch"
+        return bad
+
+    def verify(self, jobs):
+        """
+        Check the files of jobs on the remote hosts without transferring them
+
+        Good files are verified in the journal, bad files are marked as
+        failed and sent again by the next transfer.
+
+        Returns
+        -------
+        list of (job, base name, reason) of the bad files
+        """
+        hosts = {}
+        for job in jobs:
+            hosts.setdefault(job.host, []).append(job)
+        problems = []
+        for host, host_jobs in hosts.items():
+            manifest = self.manifest(host, host_jobs)
+            for job in host_jobs:
+                bad = self.mismatches(job, manifest)
+                known = self.journal.get(job.host, [job.dest(x) for x in job.names])
+                good = [
+                    x
+                    for x in job.names
+                    if x not in bad
+                    and known.get(job.dest(x), {}).get("state") != "cleaned"
+                ]
+                self.journal.record(job.host, job.entries(good), "verified")
+                self.journal.record(job.host, job.entries(bad), "failed")
+                print(
+                    f" verify: {job}: {len(job.files) - len(bad)} ok,"
+                    f" {len(bad)} bad of {len(job.files)} files"
+                )
+                for name, reason in bad.items():
+                    print(f"  {name}: {reason}")
+                    problems.append((job, name, reason))
+        return problems
+
+    def on_scratch(self, job, name, size):
+        """
+        Check if a file fetched by an earlier run is still on scratch
+        """
+        if job.states.get(name) not in ("fetched", "pushed", "failed"):
+            return False
+        filename = os.path.join(job.scratch, name)
+        if os.path.islink(filename):
+            return os.path.exists(filename)
+        return os.path.isfile(filename) and os.path.getsize(filename) == size
+
+    def fetch_stage(self, jobs, outq):
+        for job in jobs:
+            print(" fetch:", job)
+            if len(job.files) == 0:
+                print(f"  all {job.in_place} files already in place for this date")
+                continue
+            print(f"  Transfer {len(job.files)} files this date")
+            # Blocks until earlier jobs are cleaned from scratch
+            job.reserved = job.scratch_bytes
+            self.budget.acquire(job.reserved)
+            os.makedirs(job.scratch, exist_ok=True)
+            fetch = [
+                f
+                for f, n, s in zip(job.files, job.names, job.sizes)
+                if not self.on_scratch(job, n, s)
+            ]
+            if len(fetch) < len(job.files):
+                print(f"  {len(job.files) - len(fetch)} files already on scratch")
+            res = self.cases.get(fetch, job.scratch)
+            job.clean = not any(isinstance(e, FileExistsError) for e in res.values())
+            job.errors = {
+                os.path.basename(f): e
+                for f, e in res.items()
+                if e is not None and not isinstance(e, FileExistsError)
+            }
+            # Push what could be fetched, failed files are fetched again by
+            # the next run
+            job.select([x for x in job.names if x not in job.errors])
+            # Files that were already on scratch are not ours to resume
+            if job.clean:
+                names = [os.path.basename(f) for f in fetch]
+                names = [x for x in names if x in job.names]
+                md5s = {}
+                if self.checksum:
+                    md5s = {n: md5sum(os.path.join(job.scratch, n)) for n in names}
+                self.journal.record(job.host, job.entries(names, md5s), "fetched")
+            outq.put(job)
+
+    def push_stage(self, inq, outq):
+        with ThreadPoolExecutor(self.push_streams) as executor:
+            while (job := inq.get()) is not None:
+                try:
+                    groups = balance(job.names, job.sizes, self.push_streams)
+                    results = list(executor.map(partial(self.rsync, job), groups))
+                    for names, ok in zip(groups, results):
+                        if ok:
+                            self.journal.record(job.host, job.entries(names), "pushed")
+                    job.ok = all(results)
+                except OSError as e:
+                    print(f"  push of {job} failed: {e}")
+                    job.ok = False
+                outq.put(job)
+        outq.put(None)
+
+    def clean_stage(self, inq, failed):
+        while (job := inq.get()) is not None:
+            if not job.ok:
+                failed.append(job)
+                print(f"  push of {job} failed, keep {job.scratch}")
+                self.budget.release(job.reserved)
+                continue
+            # Only remove files found complete on the remote host
+            try:
+                manifest = self.cases.remote_host(job.host).manifest(job.outpath)
+                bad = self.mismatches(job, manifest)
+            except OSError as e:
+                bad = {x: str(e) for x in job.names}
+            verified = [x for x in job.names if x not in bad]
+            self.journal.record(job.host, job.entries(verified), "verified")
+            self.journal.record(job.host, job.entries(bad), "failed")
+            if bad or job.errors:
+                job.ok = False
+                failed.append(job)
+                for name, reason in bad.items():
+                    print(f"  verification of {name} failed: {reason}, keep it")
+            if job.clean:
+                self.cases.clean(verified, job.scratch)
+                self.journal.record(job.host, job.entries(verified), "cleaned")
+            self.budget.release(job.reserved)
+
+    def rsync(self, job, names):
+        """
+        Push the files names in the scratch directory of job in one rsync call
+        """
+        # Without -u, partial files on the remote host are newer than the source
+        cmd = [
+            "rsync",
+            "-ax",
+            "--copy-unsafe-links",
+            "--files-from=-",
+            "-e",
+            self.cases.remote_host(job.host).rsync_shell(),
+            f"{job.scratch}/",
+            f"{job.host}:{job.outpath}/",
+        ]
+        if self.printlev > 0:
+            print(" ".join(cmd), f"({len(names)} files)")
+        res = subprocess.run(cmd, input="\n".join(names), text=True)
+        return res.returncode == 0
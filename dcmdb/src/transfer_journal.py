@@ -0,0 +1,124 @@
+"""
+Journal of the state of transferred files.
+
+Each file sent to a remote host is recorded in a SQLite file, by default
+~/.cache/dcmdb/transfers.sqlite, keyed by host and destination path with its
+source, size, md5 checksum and the last state reached:
+
+    fetched   copied or linked to scratch
+    pushed    sent to the remote host
+    verified  found on the remote host with the right size (and checksum)
+    cleaned   verified and removed from scratch
+    failed    found incomplete on the remote host, sent again
+
+A transfer that is run again skips verified files and continues the others
+from their last state.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+from .cache_db import cache_file, connect
+
+STATES = ("fetched", "pushed", "verified", "cleaned", "failed")
+DONE = ("verified", "cleaned")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    host TEXT NOT NULL,
+    dest TEXT NOT NULL,
+    source TEXT NOT NULL,
+    size INTEGER,
+    md5 TEXT,
+    state TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (host, dest)
+);
+"""
+
+
+def md5sum(filename, blocksize=2**20):
+    """
+    Return the md5 checksum of a local file
+    """
+    md5 = hashlib.md5()
+    with open(filename, "rb") as f:
+        while block := f.read(blocksize):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class TransferJournal:
+    def __init__(self, dbfile=None):
+        """
+        Inputs
+        ------
+        dbfile : str
+            Journal file, default is ~/.cache/dcmdb/transfers.sqlite
+        """
+        self.dbfile = dbfile if dbfile is not None else cache_file("transfers.sqlite")
+        self._con = None
+        self._lock = threading.Lock()
+
+    @property
+    def con(self):
+        if self._con is None:
+            self._con = connect(self.dbfile, SCHEMA)
+            self._con.row_factory = sqlite3.Row
+        return self._con
+
+    def get(self, host, dests):
+        """
+        Return the journal entries of the destination paths on host
+
+        Returns
+        -------
+        dict of destination path and dict of source, size, md5 and state
+        """
+        res = {}
+        with self._lock:
+            for dest in dests:
+                row = self.con.execute(
+                    "SELECT * FROM files WHERE host = ? AND dest = ?", (host, dest)
+                ).fetchone()
+                if row is not None:
+                    res[dest] = dict(row)
+        return res
+
+    def record(self, host, entries, state):
+        """
+        Set the state of files, keeping known checksums
+
+        Inputs
+        ------
+        host : str
+            Remote host
+        entries : list
+            dicts with dest, source, size and optionally md5 of each file
+        state : str
+            One of STATES
+        """
+        if state not in STATES:
+            raise ValueError(f"Unknown transfer state {state}, use one of {STATES}")
+        now = time.time()
+        with self._lock, self.con:
+            self.con.executemany(
+                "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (host, dest) DO UPDATE SET source = excluded.source, "
+                "size = excluded.size, md5 = COALESCE(excluded.md5, md5), "
+                "state = excluded.state, updated = excluded.updated",
+                [
+                    (
+                        host,
+                        x["dest"],
+                        x["source"],
+                        x["size"],
+                        x.get("md5"),
+                        state,
+                        now,
+                    )
+                    for x in entries
+                ],
+            )
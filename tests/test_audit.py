@@ -0,0 +1,111 @@
+"""
+Test the audit of archived files against a fake els listing a local directory.
+"""
+
+import csv
+import grp
+import json
+import os
+import stat
+import textwrap
+
+import pytest
+import yaml
+
+from dcmdb.dcmdb import main
+from dcmdb.src.ecfs_client import ECFSClient, set_client
+
+FAKE_ELS = """\
+#!/bin/sh
+# List ec:/PATH as $FAKE_ECFS_ROOT/PATH with ls -l
+echo "$@" >> "$FAKE_ECFS_LOG"
+for last in "$@"; do :; done
+dir="$FAKE_ECFS_ROOT/${last#ec:}"
+if [ ! -d "$dir" ]; then
+  echo "els: $last: No such file or directory" >&2; exit 1
+fi
+ls -l "$dir"
+"""
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    exe = bindir / "els"
+    exe.write_text(textwrap.dedent(FAKE_ELS))
+    exe.chmod(exe.stat().st_mode | stat.S_IXUSR)
+    log = tmp_path / "calls.log"
+    log.touch()
+    root = tmp_path / "ecfs"
+    monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_ECFS_LOG", str(log))
+    monkeypatch.setenv("FAKE_ECFS_ROOT", str(root))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
+    meta = {
+        "myexp": {
+            "file_templates": ["fc+%LLLL"],
+            "atos": {"path_template": "ec:/arch/%Y/%m/%d/%H"},
+            "domain": {"name": "mydomain"},
+        }
+    }
+    dates = ["2024-08-11 00:00:00", "2024-08-11 06:00:00"]
+    data = {"atos": {"myexp": {"fc+%LLLL": {x: [0, 3600, 7200] for x in dates}}}}
+    (tmp_path / "cases" / "mycase").mkdir(parents=True)
+    (tmp_path / "cases" / "mycase" / "meta.yaml").write_text(yaml.dump(meta))
+    (tmp_path / "cases" / "mycase" / "data.json").write_text(json.dumps(data))
+    # Only the first init time is archived, with one file missing and one
+    # file not readable by the group
+    (root / "arch/2024/08/11/00").mkdir(parents=True)
+    for leadtime in ("0000", "0001"):
+        (root / "arch/2024/08/11/00" / f"fc+{leadtime}").write_text("data")
+    os.chmod(root / "arch/2024/08/11/00/fc+0001", 0o600)
+    monkeypatch.chdir(tmp_path)
+
+    client = ECFSClient(retries=0)
+    set_client(client)
+    yield log
+    client.close()
+    set_client(None)
+
+
+def test_audit(archive, tmp_path, capsys):
+    group = grp.getgrgid(os.getgid()).gr_name
+    args = ["chase", "-host", "atos", "-case", "mycase"]
+    main(*args, "-audit", "audit.tsv", "-group", group, "-v")
+
+    with open(tmp_path / "audit.tsv") as f:
+        rows = {row["path"]: row for row in csv.DictReader(f, delimiter="\t")}
+    failed = "listing failed: els: ec:/arch/2024/08/11/06: No such file or directory"
+    assert {k: v["problem"] for k, v in rows.items()} == {
+        "ec:/arch/2024/08/11/00/fc+0000": "",
+        "ec:/arch/2024/08/11/00/fc+0001": "not readable by group",
+        "ec:/arch/2024/08/11/00/fc+0002": "missing",
+        "ec:/arch/2024/08/11/06/fc+0000": failed,
+        "ec:/arch/2024/08/11/06/fc+0001": failed,
+        "ec:/arch/2024/08/11/06/fc+0002": failed,
+    }
+    assert rows["ec:/arch/2024/08/11/00/fc+0000"]["group"] == group
+    # One listing per directory
+    assert archive.read_text().splitlines() == [
+        "-l ec:/arch/2024/08/11/00",
+        "-l ec:/arch/2024/08/11/06",
+    ]
+    assert "Audited 6 archived files in 2 directories, 5 with problems" in (
+        capsys.readouterr().err
+    )
+
+    # Without -v only the files with problems are written, any other group
+    # is reported for all listed files
+    main(*args, "-audit")
+    out = capsys.readouterr().out.splitlines()
+    assert out[0].split("\t")[-1] == "problem"
+    assert len(out) == 1 + 6
+    assert out[1].endswith(f"group {group} instead of msdeode")
+
+    # Listing the case does not touch the archive
+    archive.write_text("")
+    main(*args, "-list", "-v", "-v")
+    assert "Example: ['ec:/arch/2024/08/11/00/fc+0002']" in capsys.readouterr().out
+    assert archive.read_text() == ""
@@ -0,0 +1,122 @@
+"""
+Test that the compiled catalog returns the content of meta.yaml and data.json
+and finds the same messages as reading all TOCs.
+"""
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+import yaml
+
+from dcmdb.src.catalog import FIELD_KEYS, Catalog
+from dcmdb.src.datafile import read_data
+from dcmdb.src.toc import read_toc
+
+CASES = Path(__file__).parents[1] / "cases"
+CASE_NAMES = sorted(x.parent.name for x in CASES.glob("*/meta.yaml"))
+
+
+@pytest.fixture(scope="module")
+def catalog(tmp_path_factory):
+    catalog = Catalog(CASES, dbfile=tmp_path_factory.mktemp("catalog") / "db.sqlite")
+    catalog.build()
+    yield catalog
+    catalog.close()
+
+
+def test_case_names(catalog):
+    assert catalog.case_names() == CASE_NAMES
+
+
+@pytest.mark.parametrize("case", CASE_NAMES)
+def test_case(catalog, case):
+    with open(CASES / case / "meta.yaml") as f:
+        assert catalog.meta(case) == (yaml.safe_load(f) or {})
+    if (CASES / case / "data.json").exists():
+        version, data = read_data(CASES / case / "data.json")
+        assert catalog.data(case) == data
+        assert catalog.data_version(case) == version
+    else:
+        assert catalog.data(case) == {}
+
+
+def test_select(catalog):
+    case = CASE_NAMES[0]
+    exps = list(catalog.meta(case))
+    assert catalog.select(case=case) == {case: exps}
+    for exp in exps:
+        domain = catalog.meta(case)[exp]["domain"]["name"]
+        assert exp in catalog.select(domain=domain)[case]
+    assert catalog.select(case=case, sdate="2100-01-01") == {}
+
+
+def test_incremental_build(tmp_path):
+    for case in CASE_NAMES[:2]:
+        shutil.copytree(CASES / case, tmp_path / case)
+    catalog = Catalog(tmp_path, dbfile=tmp_path / "db.sqlite")
+    assert catalog.build() == CASE_NAMES[:2]
+    assert catalog.build() == []
+
+    # Only the changed case is read again
+    meta = tmp_path / CASE_NAMES[1] / "meta.yaml"
+    mtime = meta.stat().st_mtime_ns
+    os.utime(meta, ns=(mtime + 10**9, mtime + 10**9))
+    assert catalog.build() == [CASE_NAMES[1]]
+
+    shutil.rmtree(tmp_path / CASE_NAMES[0])
+    assert catalog.build() == [CASE_NAMES[0]]
+    assert catalog.case_names() == [CASE_NAMES[1]]
+    catalog.close()
+
+
+def index_brute_force(catalog, **filters):
+    """
+    Return the messages of all TOCs matching filters, read one by one
+    """
+    found = []
+    for (case, exp, file_template), (filename, _) in catalog.toc_sources().items():
+        for row in read_toc(filename).to_pylist():
+            if all(row.get(k) in v for k, v in filters.items()):
+                entry = {"case": case, "exp": exp, "file_template": file_template}
+                entry.update({k: row.get(k) for k in ("message", *FIELD_KEYS)})
+                found.append(entry)
+    return sorted(found, key=lambda x: [x[k] for k in list(x)[:4]])
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [
+        {"shortName": ["fg", "10efg"]},
+        {"shortName": ["t"], "typeOfLevel": ["hybrid"], "level": range(1, 91)},
+        {"typeOfLevel": ["heightAboveGround"], "level": [2, 10]},
+    ],
+)
+def test_find(catalog, filters):
+    expected = index_brute_force(catalog, **filters)
+    assert len(expected) > 0
+    assert catalog.find(**filters) == expected
+
+
+def test_incremental_index(tmp_path):
+    case = "Ianos_2020"
+    shutil.copytree(CASES / case, tmp_path / case)
+    catalog = Catalog(tmp_path, dbfile=tmp_path / "db.sqlite")
+    catalog.build()
+    n = len(catalog.find(case=case))
+    assert n > 0
+    assert catalog.build_index() == []
+
+    # A changed TOC is indexed again
+    filename, _ = next(iter(catalog.toc_sources().values()))
+    toc = json.loads(Path(filename).read_text())
+    toc["messages"].append({"shortName": "newfield", "level": 0})
+    Path(filename).write_text(json.dumps(toc))
+    mtime = os.stat(filename).st_mtime_ns + 10**9
+    os.utime(filename, ns=(mtime, mtime))
+    assert len(catalog.build_index()) == 1
+    assert len(catalog.find(case=case)) == n + 1
+    assert [x["case"] for x in catalog.find(shortName="newfield")] == [case]
+    catalog.close()
@@ -0,0 +1,31 @@
+"""
+Test that every data.json of the cases survives a round trip through version 2.
+"""
+
+import json
+from pathlib import Path
+
+import pytest
+
+from dcmdb.src.datafile import read_data, write_data
+
+CASES = Path(__file__).parents[1] / "cases"
+DATA_FILES = sorted(CASES.glob("*/data.json"))
+
+
+@pytest.mark.parametrize("filename", DATA_FILES, ids=lambda x: x.parent.name)
+def test_round_trip(tmp_path, filename):
+    version, data = read_data(filename)
+    for new_version in (2, 1):
+        write_data(tmp_path / "data.json", data, new_version)
+        assert read_data(tmp_path / "data.json") == (new_version, data)
+    if version == 1:
+        assert data == json.loads(filename.read_text())
+
+
+def test_unknown_version(tmp_path):
+    (tmp_path / "data.json").write_text(json.dumps({"version": 3, "data": {}}))
+    with pytest.raises(ValueError):
+        read_data(tmp_path / "data.json")
+    with pytest.raises(ValueError):
+        write_data(tmp_path / "data.json", {}, 3)
@@ -0,0 +1,152 @@
+"""
+Test the ECFS client against fake els/ecp commands on PATH.
+"""
+
+import asyncio
+import os
+import stat
+import textwrap
+import time
+
+import pytest
+
+from dcmdb.src import ecfs
+from dcmdb.src.ecfs_client import ECFSClient, ECFSError, set_client
+
+FAKE_ELS = """\
+#!/bin/sh
+# Log each call, sleep if asked to and fail for paths containing "missing"
+echo "$@" >> "$FAKE_ECFS_LOG"
+sleep "${FAKE_ECFS_SLEEP:-0}"
+for last in "$@"; do :; done
+case "$last" in
+  *missing*) echo "els: $last: No such file or directory" >&2; exit 1 ;;
+  *flaky*)
+    if [ ! -e "$FAKE_ECFS_LOG.flaky" ]; then
+      touch "$FAKE_ECFS_LOG.flaky"; exit 1
+    fi ;;
+esac
+if [ "$1" = "-l" ]; then
+  echo "-rw-r----- 1 user msdeode 42 Sep 05 06:00 $last/a"
+else
+  echo a
+  echo b
+fi
+"""
+
+FAKE_ECP = """\
+#!/bin/sh
+# Copy all sources to the last argument, failing for paths containing "missing"
+echo "$@" >> "$FAKE_ECFS_LOG"
+for last in "$@"; do :; done
+status=0
+while [ $# -gt 1 ]; do
+  case "$1" in
+    *missing*) echo "ecp: $1: No such file or directory" >&2; status=1 ;;
+    *) cp "$1" "$last" ;;
+  esac
+  shift
+done
+exit $status
+"""
+
+
+@pytest.fixture
+def fake_ecfs(tmp_path, monkeypatch):
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    for name, script in (("els", FAKE_ELS), ("ecp", FAKE_ECP)):
+        exe = bindir / name
+        exe.write_text(textwrap.dedent(script))
+        exe.chmod(exe.stat().st_mode | stat.S_IXUSR)
+    log = tmp_path / "calls.log"
+    log.touch()
+    monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_ECFS_LOG", str(log))
+
+    client = ECFSClient(concurrency=4, timeout=5, retries=1, backoff=0.01)
+    set_client(client)
+    yield log
+    client.close()
+    set_client(None)
+
+
+def calls(log):
+    return log.read_text().splitlines()
+
+
+def test_list(fake_ecfs):
+    assert ecfs.ecfs_list("ec:/foo") == ["a", "b"]
+    assert ecfs.ecfs_list("ec:/foo", detail=True)[0].endswith("ec:/foo/a")
+    assert calls(fake_ecfs) == ["ec:/foo", "-l ec:/foo"]
+
+
+def test_list_error(fake_ecfs):
+    with pytest.raises(ECFSError, match="No such file"):
+        ecfs.ecfs_list("ec:/missing")
+    # The failed call is retried once
+    assert len(calls(fake_ecfs)) == 2
+
+
+def test_retry(fake_ecfs):
+    assert ecfs.ecfs_list("ec:/flaky") == ["a", "b"]
+    assert len(calls(fake_ecfs)) == 2
+
+
+def test_timeout(fake_ecfs, monkeypatch):
+    monkeypatch.setenv("FAKE_ECFS_SLEEP", "5")
+    client = ECFSClient(timeout=0.2, retries=0)
+    start = time.perf_counter()
+    with pytest.raises(ECFSError, match="timed out"):
+        asyncio.run(client.list("ec:/slow"))
+    assert time.perf_counter() - start < 2
+
+
+def test_single_flight(fake_ecfs, monkeypatch):
+    monkeypatch.setenv("FAKE_ECFS_SLEEP", "0.2")
+    client = ECFSClient()
+    res = asyncio.run(client.list_many(["ec:/foo"] * 5 + ["ec:/bar"]))
+    assert res == [["a", "b"]] * 6
+    assert sorted(calls(fake_ecfs)) == ["ec:/bar", "ec:/foo"]
+
+
+def test_concurrency_limit(fake_ecfs, monkeypatch):
+    monkeypatch.setenv("FAKE_ECFS_SLEEP", "0.3")
+    client = ECFSClient(concurrency=2)
+    start = time.perf_counter()
+    res = asyncio.run(client.list_many([f"ec:/d{i}" for i in range(4)]))
+    elapsed = time.perf_counter() - start
+    assert res == [["a", "b"]] * 4
+    # Four calls of 0.3s with two at a time take two rounds
+    assert 0.6 <= elapsed < 1.2
+
+
+def test_copy(fake_ecfs, tmp_path, capsys):
+    src = tmp_path / "src"
+    src.write_text("data")
+    assert ecfs.ecfs_copy(str(src), str(tmp_path / "dst"))
+    assert (tmp_path / "dst").read_text() == "data"
+    assert not ecfs.ecfs_copy("ec:/missing", str(tmp_path / "dst"))
+    assert "No such file" in capsys.readouterr().out
+
+
+def test_fetch(fake_ecfs, tmp_path):
+    infiles = []
+    for d in ("d1", "d2"):
+        (tmp_path / d).mkdir()
+        for i in range(3):
+            (tmp_path / d / f"f{i}").write_text(f"{d}{i}")
+            infiles.append(str(tmp_path / d / f"f{i}"))
+    infiles.append(str(tmp_path / "d2" / "missing"))
+    outdir = tmp_path / "out"
+    outdir.mkdir()
+
+    res = ecfs.ecfs_fetch(infiles, str(outdir), batch_size=2)
+    assert list(res) == infiles
+    assert [type(e) for e in res.values()] == [type(None)] * 6 + [ECFSError]
+    assert (outdir / "f2").read_text() in ("d12", "d22")
+    # Two calls per directory, the failing call of d2 is retried once and
+    # split into single files
+    assert len(calls(fake_ecfs)) == 2 + 2 + 1 + 1 + 2
+    assert len([x for x in calls(fake_ecfs) if len(x.split()) > 2]) == 4
+    assert calls(fake_ecfs).count(f"{infiles[-1]} {outdir}") == 2
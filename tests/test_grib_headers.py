@@ -0,0 +1,85 @@
+"""
+Test that the header only GRIB scan gives the same TOC as reading full messages.
+"""
+
+import eccodes
+import numpy as np
+import pytest
+
+from dcmdb.src import profiling
+from dcmdb.src.eccodes_helpers import grib_ls
+
+PARAMETERS = {
+    1: [
+        "indicatorOfParameter",
+        "level",
+        "typeOfLevel",
+        "timeRangeIndicator",
+        "shortName",
+    ],
+    2: [
+        "discipline",
+        "parameterCategory",
+        "parameterNumber",
+        "level",
+        "typeOfLevel",
+        "stepType",
+        "shortName",
+    ],
+}
+
+
+def grib_ls_full(filepath, parameters):
+    results = []
+    with open(filepath, "rb") as f:
+        while (gid := eccodes.codes_grib_new_from_file(f)) is not None:
+            results.append({k: eccodes.codes_get(gid, k) for k in parameters})
+            eccodes.codes_release(gid)
+    return {"messages": results}
+
+
+@pytest.mark.parametrize(
+    "sample",
+    [
+        "regular_ll_sfc_grib1",
+        "sh_ml_grib1",
+        "regular_ll_pl_grib2",
+        "reduced_gg_ml_grib2",
+        "sh_ml_grib2",
+    ],
+)
+def test_grib_ls(tmp_path, sample):
+    filepath = tmp_path / "test.grib"
+    with open(filepath, "wb") as f:
+        for level in range(1, 4):
+            gid = eccodes.codes_grib_new_from_samples(sample)
+            eccodes.codes_set(gid, "level", level)
+            eccodes.codes_write(gid, f)
+            eccodes.codes_release(gid)
+            # Messages do not have to follow each other directly
+            f.write(b"padding")
+
+    parameters = PARAMETERS[int(sample[-1])]
+    assert grib_ls(filepath, parameters) == grib_ls_full(filepath, parameters)
+
+
+@pytest.mark.parametrize("sample", ["regular_ll_sfc_grib1", "regular_ll_pl_grib2"])
+def test_grib_ls_bytes_read(tmp_path, sample):
+    filepath = tmp_path / "test.grib"
+    with open(filepath, "wb") as f:
+        for level in range(1, 4):
+            gid = eccodes.codes_grib_new_from_samples(sample)
+            eccodes.codes_set(gid, "bitsPerValue", 24)
+            size = eccodes.codes_get(gid, "numberOfValues")
+            eccodes.codes_set_values(gid, np.random.default_rng(level).random(size))
+            eccodes.codes_set(gid, "level", level)
+            eccodes.codes_write(gid, f)
+            eccodes.codes_release(gid)
+
+    profiler = profiling.enable()
+    try:
+        grib_ls(filepath, ["level"])
+    finally:
+        profiling.disable()
+    # Only the sections before the data of each message are read
+    assert 0 < profiler.counters["bytes read"] < filepath.stat().st_size / 4
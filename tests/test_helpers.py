@@ -0,0 +1,92 @@
+"""
+Test that find_files only walks the directories matching the path template.
+"""
+
+import datetime
+
+import fsspec
+import pytest
+
+from dcmdb.src import listing_cache, profiling
+from dcmdb.src.helpers import find_files
+from dcmdb.src.timehandling import time_template
+
+FILES = [
+    "2024/09/05/00/fc+0000",
+    "2024/09/05/00/fc+0001",
+    "2024/09/05/12/sfx/fc+0000",
+    "2024/09/06/00/fc+0000",
+    "2024/09/06/00/.hidden",
+    "2024/09/06/xx/fc+0000",
+    "2024/09/6/00/fc+0000",
+    "2024/readme.txt",
+    "logs/2024/09/05/00/fc+0000",
+]
+
+
+@pytest.fixture
+def archive(tmp_path):
+    listing_cache.set_listing_cache(
+        listing_cache.ListingCache(tmp_path / "listings.sqlite", mode="refresh")
+    )
+    fs = fsspec.filesystem("memory")
+    for name in FILES:
+        fs.pipe(f"memory://walk/{name}", b"")
+    yield fs
+    fs.rm("/walk", recursive=True)
+    listing_cache.set_listing_cache(None)
+
+
+def walk(*args, **kwargs):
+    profiler = profiling.enable()
+    try:
+        files = list(find_files("memory://walk/", *args, **kwargs))
+    finally:
+        profiling.disable()
+    listed = [x["args"]["path"] for x in profiler.events if x["name"] == "list"]
+    return files, sorted(x.split("walk", 1)[1].strip("/") for x in listed)
+
+
+def brute_force(part_path):
+    """
+    Return all files below the directories matching part_path
+    """
+    components = [time_template(x) for x in part_path.split("/") if x != ""]
+    return sorted(
+        name
+        for name in FILES
+        if not any(x.startswith(".") for x in name.split("/"))
+        and len(name.split("/")) > len(components)
+        and all(
+            t.regex.fullmatch(x) is not None
+            for t, x in zip(components, name.split("/"))
+        )
+    )
+
+
+def test_pruned_walk(archive):
+    files, listed = walk("%Y/%m/%d/%H/")
+    assert files == brute_force("%Y/%m/%d/%H/")
+    # Directories not matching the template are never listed
+    assert listed == [
+        "",
+        "2024",
+        "2024/09",
+        "2024/09/05",
+        "2024/09/05/00",
+        "2024/09/05/12",
+        "2024/09/05/12/sfx",
+        "2024/09/06",
+        "2024/09/06/00",
+    ]
+
+    files, listed = walk("%Y/%m/%d/%H/", depth=0)
+    assert files == [x for x in brute_force("%Y/%m/%d/%H/") if "sfx" not in x]
+    assert "2024/09/05/12/sfx" not in listed
+
+
+def test_since(archive):
+    since = datetime.datetime(2024, 9, 5, 12)
+    files, listed = walk("%Y/%m/%d/%H/", since=since)
+    assert files == ["2024/09/05/12/sfx/fc+0000", "2024/09/06/00/fc+0000"]
+    assert "2024/09/05/00" not in listed
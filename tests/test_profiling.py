@@ -0,0 +1,77 @@
+"""
+Test the profiling spans and the --profile option of the dcmdb entry point.
+"""
+
+import json
+
+import yaml
+
+from dcmdb.dcmdb import main
+from dcmdb.src import profiling
+
+
+def test_disabled():
+    assert profiling.span("phase") is profiling.span("other")
+    profiling.count("calls")
+
+
+def test_spans(tmp_path):
+    profiler = profiling.enable(memory=True)
+    try:
+        with profiling.span("outer", case="mycase"):
+            with profiling.span("inner"):
+                data = bytearray(2 * 1024**2)
+            del data
+            profiling.count("subprocess:els", 3)
+    finally:
+        assert profiling.disable() is profiler
+
+    inner, outer = profiler.events
+    assert outer["args"]["case"] == "mycase"
+    assert outer["ts"] <= inner["ts"] and inner["dur"] <= outer["dur"]
+    # The peak of the nested span is part of the outer peak
+    assert outer["args"]["peak_bytes"] >= inner["args"]["peak_bytes"] >= 2 * 1024**2
+    summary = profiler.summary()
+    assert "outer" in summary and "subprocess:els" in summary
+
+    filename = tmp_path / "trace.json"
+    profiler.write(filename)
+    trace = json.loads(filename.read_text())
+    assert [x["ph"] for x in trace["traceEvents"]] == ["X", "X", "C"]
+    assert trace["otherData"]["counters"] == {"subprocess:els": 3}
+
+
+def test_profile_option(tmp_path, monkeypatch, capsys):
+    meta = {
+        "myexp": {
+            "file_templates": ["fc+%LLLL"],
+            "atos": {"path_template": f"{tmp_path}/src/%Y/%m/%d/%H/"},
+            "domain": {"name": "mydomain"},
+        }
+    }
+    data = {"atos": {"myexp": {"fc+%LLLL": {"2024-08-11 00:00:00": [0, 3600]}}}}
+    (tmp_path / "cases" / "mycase").mkdir(parents=True)
+    (tmp_path / "cases" / "mycase" / "meta.yaml").write_text(yaml.dump(meta))
+    (tmp_path / "cases" / "mycase" / "data.json").write_text(json.dumps(data))
+    for leadtime in ("0000", "0001"):
+        (tmp_path / "src/2024/08/11/00").mkdir(parents=True, exist_ok=True)
+        (tmp_path / "src/2024/08/11/00" / f"fc+{leadtime}").touch()
+    monkeypatch.chdir(tmp_path)
+
+    main(
+        "--profile",
+        "chase",
+        "-path",
+        "cases",
+        "-host",
+        "atos",
+        "-case",
+        "mycase",
+        "-scan",
+    )
+    out = capsys.readouterr().out
+    assert "Trace written to dcmdb-profile.json" in out
+    trace = json.loads((tmp_path / "dcmdb-profile.json").read_text())
+    names = {x["name"] for x in trace["traceEvents"]}
+    assert {"chase", "read data.json", "scan", "write data.json"} <= names
+    assert profiling.span("phase") is profiling.span("other")
@@ -0,0 +1,91 @@
+"""
+Test that combining references in batches gives the references of a single combine.
+"""
+
+import json
+from pathlib import Path
+
+import eccodes
+import fsspec
+import gribscan
+import pytest
+from kerchunk.combine import MultiZarrToZarr
+
+from dcmdb.src.referencing import IDENTICAL_DIMS, combine_references
+
+
+@pytest.fixture(scope="module")
+def ref_files(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("refs")
+    ref_files = []
+    for step in range(5):
+        gribfile = tmp_path / f"fc+{step:03d}.grib2"
+        with open(gribfile, "wb") as f:
+            for level in (500, 850):
+                gid = eccodes.codes_grib_new_from_samples("regular_ll_pl_grib2")
+                eccodes.codes_set(gid, "step", step)
+                eccodes.codes_set(gid, "level", level)
+                eccodes.codes_write(gid, f)
+                eccodes.codes_release(gid)
+        idxfile = Path(f"{gribfile}.index")
+        gribscan.write_index(gribfile=str(gribfile), idxfile=idxfile, force=True)
+        (refs,) = gribscan.grib_magic(
+            filenames=[str(idxfile)],
+            magician=gribscan.magician.Magician(),
+            global_prefix="",
+        ).values()
+        ref_file = tmp_path / f"fc+{step:03d}.json"
+        ref_file.write_text(json.dumps(refs))
+        ref_files.append(str(ref_file))
+    return ref_files
+
+
+@pytest.fixture(scope="module")
+def expected(ref_files):
+    return MultiZarrToZarr(
+        [json.loads(Path(x).read_text()) for x in ref_files],
+        remote_protocol="file",
+        concat_dims=["time"],
+        coo_map={"time": "INDEX"},
+        identical_dims=IDENTICAL_DIMS,
+    ).translate()
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 5])
+def test_combine_json(tmp_path, ref_files, expected, batch_size):
+    filename = tmp_path / "refs.json"
+    combine_references(ref_files, filename, "json", batch_size=batch_size)
+    assert json.loads(filename.read_text()) == expected
+
+
+def test_combine_parquet(tmp_path, ref_files, expected):
+    filename = tmp_path / "refs.parquet"
+    combine_references(ref_files, str(filename), "parquet", batch_size=2, record_size=3)
+    # One directory per variable with records of 3 references
+    assert len(list((filename / "t").glob("refs.*.parq"))) == 4
+
+    keys = [k for k in expected["refs"] if not k.rsplit("/", 1)[-1].startswith(".")]
+    fs = fsspec.filesystem("reference", fo=str(filename), remote_protocol="file")
+    expected_fs = fsspec.filesystem("reference", fo=expected, remote_protocol="file")
+    assert fs.cat(keys) == expected_fs.cat(keys)
+
+
+@pytest.mark.parametrize("toc_filetype", ["json", "parquet"])
+def test_append(tmp_path, ref_files, expected, toc_filetype):
+    filename = str(tmp_path / f"refs.{toc_filetype}")
+    combine_references(ref_files[:3], filename, toc_filetype, record_size=3)
+    # Replace the last time and add the others
+    combine_references(
+        ref_files[2:],
+        filename,
+        toc_filetype,
+        times=[2, 3, 4],
+        append=True,
+        batch_size=2,
+    )
+
+    keys = [k for k in expected["refs"] if not k.rsplit("/", 1)[-1].startswith(".")]
+    fs = fsspec.filesystem("reference", fo=filename, remote_protocol="file")
+    expected_fs = fsspec.filesystem("reference", fo=expected, remote_protocol="file")
+    assert fs.cat(keys) == expected_fs.cat(keys)
+    assert json.loads(fs.cat("t/.zarray"))["shape"][0] == 5
@@ -0,0 +1,125 @@
+"""
+Test scanning an in-memory archive through the listing cache.
+"""
+
+import json
+import os
+import time
+
+import fsspec
+import pytest
+import yaml
+
+from dcmdb.dcmdb import main
+from dcmdb.src import datafile, listing_cache
+
+SCAN = ("chase", "-path", "cases", "-host", "atos", "-case", "mycase", "-scan")
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    meta = {
+        "expA": {
+            "file_templates": ["fc+%LLLL"],
+            "atos": {"path_template": "memory://arch/%Y/%m/%d/%H/"},
+            "domain": {"name": "mydomain"},
+        }
+    }
+    (tmp_path / "cases" / "mycase").mkdir(parents=True)
+    (tmp_path / "cases" / "mycase" / "meta.yaml").write_text(yaml.dump(meta))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
+    fs = fsspec.filesystem("memory")
+    if fs.exists("/arch"):
+        fs.rm("/arch", recursive=True)
+    for leadtime in ("0000", "0001"):
+        fs.pipe(f"memory://arch/2024/09/02/00/fc+{leadtime}", b"")
+    yield fs
+    fs.rm("/arch", recursive=True)
+    listing_cache.set_listing_cache(None)
+
+
+def read_data(tmp_path):
+    return datafile.read_data(tmp_path / "cases" / "mycase" / "data.json")[1]
+
+
+def test_offline_cache_miss(archive, tmp_path):
+    main(*SCAN)
+    data = read_data(tmp_path)
+    assert list(data["atos"]) == ["expA"]
+
+    # Without cached listings the data is kept instead of found empty
+    (tmp_path / "cache").rename(tmp_path / "cache.old")
+    main(*SCAN, "-listings", "offline")
+    assert read_data(tmp_path) == data
+
+
+def test_incremental_cached(archive, tmp_path):
+    main(*SCAN, "-listings", "use")
+    # The run goes on: more lead times of the last init time and a new one
+    for name in ("02/00/fc+0002", "02/00/fc+0003", "03/00/fc+0000"):
+        archive.pipe(f"memory://arch/2024/09/{name}", b"")
+
+    # Cached listings are reused for a full scan with -listings use
+    main(*SCAN, "-listings", "use")
+    data = read_data(tmp_path)
+    assert list(data["atos"]["expA"]["fc+%LLLL"]) == ["2024-09-02 00:00:00"]
+
+    # but not for the directories an incremental scan visits
+    main(*SCAN, "-incremental", "-listings", "use")
+    data = read_data(tmp_path)
+    assert data["atos"]["expA"]["fc+%LLLL"] == {
+        "2024-09-02 00:00:00": [0, 3600, 7200, 10800],
+        "2024-09-03 00:00:00": [0],
+    }
+
+    # and a scan lists the archive again by default
+    archive.pipe("memory://arch/2024/09/04/00/fc+0000", b"")
+    main(*SCAN)
+    data = read_data(tmp_path)
+    assert len(data["atos"]["expA"]["fc+%LLLL"]) == 3
+
+
+def test_overlapping_templates(archive, tmp_path):
+    templates = ["GRIBPF+%LLLLh00m00s", "GRIBPF+%LLLLh%LMm00s"]
+    meta = yaml.safe_load((tmp_path / "cases/mycase/meta.yaml").read_text())
+    meta["expA"]["file_templates"] = templates
+    (tmp_path / "cases/mycase/meta.yaml").write_text(yaml.dump(meta))
+    for name in ("0000h00m00s", "0001h00m00s", "0001h15m00s", "0001h75m00s"):
+        archive.pipe(f"memory://arch/2024/09/02/00/GRIBPF+{name}", b"")
+
+    main(*SCAN)
+    data = read_data(tmp_path)["atos"]["expA"]
+    # Files matching both templates are found for both
+    assert data[templates[0]] == {"2024-09-02 00:00:00": [0, 3600]}
+    assert data[templates[1]] == {"2024-09-02 00:00:00": [0, 3600, 4500]}
+
+
+def test_checkpoint(archive, tmp_path):
+    main(*SCAN)
+    data_file = tmp_path / "cases" / "mycase" / "data.json"
+    result = {"fc+%LLLL": {"2024-09-01 00:00:00": [0]}}
+    checkpoint = {
+        "host": "atos",
+        "incremental": False,
+        "started": time.time(),
+        "data_mtime": data_file.stat().st_mtime,
+        "done": {"expA": {"memory://arch/%Y/%m/%d/%H/": result}},
+    }
+
+    def scan_with(**kwargs):
+        with open(tmp_path / "cases" / "mycase" / ".scan_checkpoint.json", "w") as f:
+            json.dump(dict(checkpoint, **kwargs), f)
+        main(*SCAN)
+        return read_data(tmp_path)["atos"]["expA"]["fc+%LLLL"]
+
+    # An interrupted scan is resumed with the result of the checkpoint
+    assert list(scan_with()) == ["2024-09-01 00:00:00"]
+    assert not os.path.exists(tmp_path / "cases" / "mycase" / ".scan_checkpoint.json")
+    # but not after data.json was written by another scan
+    assert list(scan_with()) == ["2024-09-02 00:00:00"]
+    # or when the checkpoint is older than the listing TTL
+    started = time.time() - listing_cache.DEFAULT_TTL - 1
+    mtime = data_file.stat().st_mtime
+    assert list(scan_with(started=started, data_mtime=mtime)) == ["2024-09-02 00:00:00"]
@@ -0,0 +1,67 @@
+"""
+Test that listing a case stays fast by not loading the GRIB and Arrow stacks.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import yaml
+
+# Loaded only when TOCs or references are built
+HEAVY_MODULES = (
+    "cfgrib",
+    "eccodes",
+    "fsspec",
+    "gribscan",
+    "kerchunk",
+    "pandas",
+    "pyarrow",
+    "upath",
+    "xarray",
+)
+
+# Seconds for a cold start and listing of a case in a fresh interpreter,
+# generous to allow for slow CI machines
+STARTUP_BUDGET = float(os.environ.get("DCMDB_STARTUP_BUDGET", 2.0))
+
+LIST_CASE = """
+import json, sys
+from dcmdb.dcmdb import main
+main("chase", "-path", "cases", "-host", "atos", "-case", "mycase", "-list")
+print(json.dumps(sorted(sys.modules)), file=sys.stderr)
+"""
+
+
+def test_list_startup(tmp_path):
+    meta = {
+        "myexp": {
+            "file_templates": ["fc+%LLLL"],
+            "atos": {"path_template": f"{tmp_path}/src/%Y/%m/%d/%H/"},
+            "domain": {"name": "mydomain"},
+        }
+    }
+    data = {"atos": {"myexp": {"fc+%LLLL": {"2024-08-11 00:00:00": [0, 3600]}}}}
+    (tmp_path / "cases" / "mycase").mkdir(parents=True)
+    (tmp_path / "cases" / "mycase" / "meta.yaml").write_text(yaml.dump(meta))
+    (tmp_path / "cases" / "mycase" / "data.json").write_text(json.dumps(data))
+
+    env = dict(os.environ, XDG_CACHE_HOME=str(tmp_path / "cache"))
+    start = time.perf_counter()
+    res = subprocess.run(
+        [sys.executable, "-c", LIST_CASE],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    elapsed = time.perf_counter() - start
+
+    assert "myexp" in res.stdout
+    modules = json.loads(res.stderr.splitlines()[-1])
+    loaded = sorted({x.split(".")[0] for x in modules} & set(HEAVY_MODULES))
+    assert loaded == []
+    assert elapsed < STARTUP_BUDGET
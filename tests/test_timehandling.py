@@ -0,0 +1,68 @@
+"""
+Test the compiled time templates against strptime/strftime of simulation_datetime
+for all templates of the cases.
+"""
+
+import datetime
+from pathlib import Path
+
+import pytest
+import yaml
+
+from dcmdb.src import timehandling
+from dcmdb.src.timehandling import TimeTemplate, simulation_datetime
+
+CASES = Path(__file__).parents[1] / "cases"
+DTGS = ["2024-09-01 06:00:00", "2016-02-29 23:00:00"]
+LEADTIMES = [0, 900, 3600, 5400, 86400 + 2700, 999 * 3600]
+
+
+def case_templates():
+    templates = set()
+    for filename in CASES.glob("*/meta.yaml"):
+        with open(filename) as f:
+            meta = yaml.safe_load(f) or {}
+        for props in meta.values():
+            templates.update(props.get("file_templates") or [])
+            for store in props.values():
+                if isinstance(store, dict) and "path_template" in store:
+                    path_template = store["path_template"]
+                    if isinstance(path_template, str):
+                        path_template = [path_template]
+                    templates.update(path_template)
+    return sorted(templates)
+
+
+def reference_format(template, dtg, leadtime):
+    dt = simulation_datetime(*datetime.datetime.fromisoformat(dtg).timetuple()[:6])
+    dt.leadtime = datetime.timedelta(seconds=leadtime)
+    return dt.strftime(template)
+
+
+def reference_match(string, template):
+    try:
+        return simulation_datetime._strptime(string, template)
+    except ValueError:
+        return None
+
+
+@pytest.mark.parametrize("template", case_templates())
+def test_template(template):
+    t = TimeTemplate(template)
+    assert t.supported
+    paths = list(timehandling.expand_paths(template, DTGS, LEADTIMES))
+    expected = [reference_format(template, x, y) for x in DTGS for y in LEADTIMES]
+    assert paths == expected
+    assert [
+        timehandling.hub(template, x, y) for x in DTGS for y in LEADTIMES
+    ] == expected
+    assert [t.format(x, y) for x in DTGS for y in LEADTIMES] == expected
+
+    # Leadtimes too long for the template do not parse back, like with strptime
+    assert t.parse(expected[0]).leadtime == datetime.timedelta(0)
+    for path in expected:
+        for other in (path, path + "x", "x" + path[1:], path.replace("0", "a", 1)):
+            dt, ref = t.match(other), reference_match(other, template)
+            assert dt == ref
+            if ref is not None:
+                assert dt.leadtime == ref.leadtime
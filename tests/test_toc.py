@@ -0,0 +1,55 @@
+"""
+Test the TOC formats and selection against the JSON TOCs of the cases.
+"""
+
+import json
+from pathlib import Path
+
+import pytest
+
+from dcmdb.src.toc import TOC_FORMATS, read_toc, select, to_json, write_toc
+
+CASES = Path(__file__).parents[1] / "cases"
+TOCS = sorted(x for x in CASES.glob("*/*.json") if x.name != "data.json")
+
+
+def matches(message, filters):
+    for key, value in filters.items():
+        if isinstance(value, (range, list)):
+            if message.get(key) not in value:
+                return False
+        elif message.get(key) != value:
+            return False
+    return True
+
+
+@pytest.mark.parametrize("filename", TOCS, ids=lambda x: f"{x.parent.name}/{x.name}")
+def test_toc(tmp_path, filename):
+    toc = json.loads(filename.read_text())
+    messages = toc["messages"]
+    first = messages[0]
+
+    queries = [
+        {"typeOfLevel": first["typeOfLevel"]},
+        {"typeOfLevel": "hybrid", "level": range(1, 91)},
+        {"level": [first["level"], 2], "typeOfLevel": first["typeOfLevel"]},
+    ]
+    if "shortName" in first:
+        queries.append({"shortName": [first["shortName"], "t"]})
+
+    for toc_format, ext in TOC_FORMATS.items():
+        tocfile = str(tmp_path / f"toc{ext}")
+        write_toc(tocfile, toc, toc_format)
+        table = read_toc(tocfile)
+        assert to_json(table) == toc
+        assert table["message"].to_pylist() == list(range(len(messages)))
+
+        for filters in queries:
+            expected = [i for i, x in enumerate(messages) if matches(x, filters)]
+            assert select(table, **filters)["message"].to_pylist() == expected
+
+
+def test_unknown_key(tmp_path):
+    write_toc(tmp_path / "toc.json", {"messages": [{"shortName": "t"}]})
+    with pytest.raises(KeyError):
+        select(read_toc(tmp_path / "toc.json"), paramId=130)
@@ -0,0 +1,225 @@
+"""
+Test the transfer pipeline against fake ssh/rsync commands on PATH.
+"""
+
+import json
+import os
+import stat
+import textwrap
+import threading
+
+import pytest
+import yaml
+
+from dcmdb.src.cls.cases import Cases
+from dcmdb.src.remote import RemoteHost
+from dcmdb.src.transfer import ScratchBudget, TransferEngine, plan, print_plan
+from dcmdb.src.transfer_journal import TransferJournal
+
+# Run the remote command locally, skipping the options and the host
+FAKE_SSH = """\
+#!/bin/sh
+echo "ssh $*" >> "$FAKE_LOG"
+while [ $# -gt 0 ]; do
+  case "$1" in
+    -o) shift 2 ;;
+    -O) exit 0 ;;
+    *) break ;;
+  esac
+done
+shift
+exec sh -c "$*"
+"""
+
+# Copy the files read from stdin from the source to the local part of the
+# destination, failing for the file named by FAKE_FAIL
+FAKE_RSYNC = """\
+#!/usr/bin/env python3
+import os, shutil, sys
+src, dest = sys.argv[-2:]
+with open(os.environ["FAKE_LOG"], "a") as f:
+    f.write("rsync " + " ".join(sys.argv[1:]) + "\\n")
+status = 0
+for name in sys.stdin.read().split():
+    if name == os.environ.get("FAKE_FAIL"):
+        status = 23
+        continue
+    shutil.copy(os.path.join(src, name), os.path.join(dest.split(":", 1)[1], name))
+sys.exit(status)
+"""
+
+DATES = ["2024-08-11 00:00:00", "2024-08-11 12:00:00"]
+LEADTIMES = [0, 3600, 7200, 10800]
+
+
+@pytest.fixture
+def cases(tmp_path, monkeypatch):
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    for name, script in (("ssh", FAKE_SSH), ("rsync", FAKE_RSYNC)):
+        exe = bindir / name
+        exe.write_text(textwrap.dedent(script))
+        exe.chmod(exe.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_LOG", str(tmp_path / "calls.log"))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
+    meta = {
+        "myexp": {
+            "file_templates": ["fc+%LLLL"],
+            "atos": {"path_template": f"{tmp_path}/src/%Y/%m/%d/%H/"},
+            "lumi": {"path_template": f"{tmp_path}/remote/%Y/%m/%d/%H"},
+            "domain": {"name": "mydomain"},
+        }
+    }
+    data = {"atos": {"myexp": {"fc+%LLLL": {d: LEADTIMES for d in DATES}}}}
+    (tmp_path / "cases" / "mycase").mkdir(parents=True)
+    (tmp_path / "cases" / "mycase" / "meta.yaml").write_text(yaml.dump(meta))
+    (tmp_path / "cases" / "mycase" / "data.json").write_text(json.dumps(data))
+    for date in ("2024/08/11/00", "2024/08/11/12"):
+        (tmp_path / "src" / date).mkdir(parents=True)
+        for i, leadtime in enumerate(("0000", "0001", "0002", "0003")):
+            (tmp_path / "src" / date / f"fc+{leadtime}").write_bytes(b"x" * (i + 1))
+
+    return Cases(path=str(tmp_path / "cases"), selection="mycase", host="atos")
+
+
+def calls(tmp_path, command):
+    log = tmp_path / "calls.log"
+    lines = log.read_text().splitlines() if log.exists() else []
+    return [x for x in lines if x.startswith(f"{command} ")]
+
+
+def test_plan(tmp_path, cases, capsys):
+    jobs = plan(cases, "lumi", str(tmp_path / "scratch"))
+    assert [job.date for job in jobs] == DATES
+    assert jobs[0].sizes == [1, 2, 3, 4]
+    assert jobs[1].outpath == f"{tmp_path}/remote/2024/08/11/12"
+    print_plan(jobs)
+    assert "Total: 2 dates, 8 files, 20 B" in capsys.readouterr().out
+
+    jobs = plan(cases, "lumi", str(tmp_path / "scratch"), file_template="fc+%LLLL")
+    assert len(jobs) == 2
+    with pytest.raises(ValueError, match="No match for: fc%LLLL"):
+        plan(cases, "lumi", str(tmp_path / "scratch"), file_template="fc%LLLL")
+
+
+def test_transfer(tmp_path, cases):
+    jobs = plan(cases, "lumi", str(tmp_path / "scratch"))
+    engine = TransferEngine(cases, scratch_budget=10, push_streams=2, printlev=0)
+    assert engine.run(jobs) == []
+
+    for date in ("2024/08/11/00", "2024/08/11/12"):
+        remote = sorted(os.listdir(tmp_path / "remote" / date))
+        assert remote == ["fc+0000", "fc+0001", "fc+0002", "fc+0003"]
+        # Only the links to the local files were on scratch
+        assert os.listdir(tmp_path / "scratch" / "mycase" / "myexp" / date) == []
+    # Two streams per date
+    assert len(calls(tmp_path, "rsync")) == 4
+    # One manifest of all dates, one mkdir and one verification per date
+    assert len(calls(tmp_path, "ssh")) == 4
+    journal = TransferJournal(str(tmp_path / "cache" / "dcmdb" / "transfers.sqlite"))
+    dest = f"{tmp_path}/remote/2024/08/11/12/fc+0003"
+    assert journal.get("lumi", [dest])[dest]["state"] == "cleaned"
+
+    # The journal has all files, the remote host is not contacted
+    assert engine.run(plan(cases, "lumi", str(tmp_path / "scratch"))) == []
+    assert len(calls(tmp_path, "rsync")) == 4
+    assert len(calls(tmp_path, "ssh")) == 4
+
+    # A partial file is found by a verification and sent again
+    partial = tmp_path / "remote" / "2024/08/11/12" / "fc+0003"
+    partial.write_bytes(b"x")
+    problems = engine.verify(plan(cases, "lumi", str(tmp_path / "scratch")))
+    assert [(job.date, name) for job, name, _ in problems] == [(DATES[1], "fc+0003")]
+    assert journal.get("lumi", [dest])[dest]["state"] == "failed"
+    engine.run(plan(cases, "lumi", str(tmp_path / "scratch")))
+    assert partial.read_bytes() == b"xxxx"
+    assert len(calls(tmp_path, "rsync")) == 5
+
+
+def test_resume(tmp_path, cases, monkeypatch):
+    scratch = tmp_path / "scratch" / "mycase" / "myexp" / "2024/08/11/00"
+    engine = TransferEngine(cases, push_streams=1, printlev=0)
+    monkeypatch.setenv("FAKE_FAIL", "fc+0002")
+    failed = engine.run(plan(cases, "lumi", str(tmp_path / "scratch")))
+    assert [job.date for job in failed] == DATES
+    # The fetched files are kept on scratch
+    assert len(os.listdir(scratch)) == 4
+
+    monkeypatch.delenv("FAKE_FAIL")
+    assert engine.run(plan(cases, "lumi", str(tmp_path / "scratch"))) == []
+    # The files on scratch are reused and removed after the verification
+    assert os.listdir(scratch) == []
+    assert len(os.listdir(tmp_path / "remote" / "2024/08/11/00")) == 4
+
+
+def test_verify_checksum(tmp_path, cases):
+    engine = TransferEngine(cases, checksum=True, printlev=0)
+    assert engine.run(plan(cases, "lumi", str(tmp_path / "scratch"))) == []
+    # Same size, other content
+    (tmp_path / "remote" / "2024/08/11/00" / "fc+0001").write_bytes(b"yy")
+    problems = engine.verify(plan(cases, "lumi", str(tmp_path / "scratch")))
+    assert [(name, reason) for _, name, reason in problems] == [
+        ("fc+0001", "checksum mismatch")
+    ]
+
+
+def test_remote_manifest(tmp_path, cases):
+    remote = RemoteHost("myhost", control_path=str(tmp_path / "%C"))
+    manifest = remote.manifest(f"{tmp_path}/src/2024/08/11")
+    assert manifest[f"{tmp_path}/src/2024/08/11/12/fc+0002"]["size"] == 3
+    assert len(manifest) == 8
+    assert remote.manifest(f"{tmp_path}/missing") == {}
+    # The connection is shared by ssh and rsync
+    assert f"ControlPath={tmp_path}/%C" in calls(tmp_path, "ssh")[0]
+    assert "ControlPersist=" in remote.rsync_shell()
+
+
+def test_scratch_budget():
+    budget = ScratchBudget(10)
+    budget.acquire(6)
+    acquired = threading.Event()
+
+    def fetch():
+        budget.acquire(6)
+        acquired.set()
+
+    thread = threading.Thread(target=fetch)
+    thread.start()
+    assert not acquired.wait(0.1)
+    budget.release(6)
+    assert acquired.wait(1)
+    thread.join()
+    # A job larger than the budget is let through on an empty scratch
+    budget.release(6)
+    budget.acquire(20)
+    assert budget.used == 20
+
+
+def test_cases_transfer(tmp_path, cases, monkeypatch):
+    rsync = tmp_path / "bin" / "rsync"
+    rsync.write_text('#!/bin/sh\necho "rsync $*" >> "$FAKE_LOG"\n')
+    src = tmp_path / "src" / "2024/08/11/00"
+    files = [str(src / f"fc+{x}") for x in ("0000", "0001", "0002", "0003")]
+    outpath = tmp_path / "scratch"
+    remote = {"host": "lumi", "outpath": str(tmp_path / "remote")}
+    (tmp_path / "remote").mkdir()
+    (tmp_path / "remote" / "fc+0000").write_bytes(b"x")
+    outpath.mkdir()
+    (outpath / "fc+0001").symlink_to(files[1])
+
+    # The copy of fc+0002 fails, as an ecp would
+    get = cases.get
+
+    def failing_get(files, outpath):
+        res = get(files, outpath)
+        os.remove(os.path.join(outpath, "fc+0002"))
+        res[files[1]] = OSError("ecp failed")
+        return res
+
+    monkeypatch.setattr(cases, "get", failing_get)
+    cases.transfer(files, str(outpath), remote)
+    # fc+0000 is in place and not fetched, the existing link is kept
+    assert sorted(os.listdir(outpath)) == ["fc+0001"]
+    assert len(calls(tmp_path, "rsync")) == 1
@@ -18,7 +18,9 @@ from datetime import datetime, timedelta
 import yaml
 
 from dcmdb.src.cls.cases import Cases
-from dcmdb.src.timehandling import expand_dates, expand_times, hub
+from dcmdb.src.timehandling import expand_dates, expand_times
+from dcmdb.src.transfer import TransferEngine, plan, print_plan
+from dcmdb.src.transfer_journal import TransferJournal
 
 REQUIRED = ("selection", "remote")
 GROUPS = {
@@ -83,69 +85,47 @@ def step2td(step):
         )
 
 
-def transfer(cfg):
+def transfer(cfg, dry_run=False, verify=False):
 
     print("Config:", cfg["selection"])
 
-    # Load the metadata
-    example = Cases(selection=cfg["selection"], printlev=0, host="atos")
-
-    for case in example.names:
-        for exp in example.cases.names:
-            if cfg["remote"] not in example.meta[case][exp]:
-                print(f"  {cfg['remote']} not defined for {case}/{exp}")
-                continue
-
-            outpath_template = example.meta[case][exp][cfg["remote"]]["path_template"]
-            print(" transfer data to:", outpath_template)
-
-            scratch_template = os.path.join(
-                os.environ["SCRATCH"], case, exp, "%Y/%m/%d/%H/"
-            )
-
-            i = 0
-            file_template_used = None
-            if "file_template" in cfg:
-                file_template_used = cfg["file_template"]
-                try:
-                    i = example.cases.runs.file_templates.index(cfg["file_template"])
-                except ValueError:
-                    print("No match for:", cfg["file_template"])
-                    sys.exit()
-            file_template = example.cases.runs.file_templates[i]
-
-            x = example.cases.runs.data
-
-            if file_template not in x:
-                print(" no data available for:", file_template)
-                continue
-
-            for date in x[file_template].keys():
-                if len(cfg["dates"]) > 0:
-                    cdate = datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
-                    if cdate not in cfg["dates"]:
-                        continue
-
-                print(" fetch:", date)
-
-                # Parse the paths and expand the dates
-                remote_outpath = hub(outpath_template, date)
-                scratch_outpath = hub(scratch_template, date)
-
-                # Get a list of files
-                files = example.reconstruct(
-                    dtg=date,
-                    leadtime=cfg["leadtimes"],
-                    file_template=file_template_used,
-                )
-
-                # Do the actual copy from ecf to scratch and rsync to lumi,
-                # and clean the intermediate files
-                example.transfer(
-                    files,
-                    scratch_outpath,
-                    {"host": cfg["remote"], "outpath": remote_outpath},
-                )
+    # Load the metadata once for all cases and runs
+    cases = Cases(selection=cfg["selection"], printlev=0, host="atos")
+
+    try:
+        jobs = plan(
+            cases,
+            cfg["remote"],
+            os.environ["SCRATCH"],
+            dates=cfg["dates"],
+            leadtimes=cfg["leadtimes"],
+            file_template=cfg.get("file_template"),
+        )
+    except ValueError as e:
+        # A file template not in meta.yaml is a configuration error
+        print(e)
+        sys.exit(1)
+    if dry_run:
+        print_plan(jobs)
+        return True
+
+    # Fetch from ecfs to scratch, rsync to lumi and clean the intermediate
+    # files as concurrent stages
+    # Limits missing in the config keep the defaults of the engine
+    limits = {k: cfg[k] for k in ("scratch_budget", "push_streams") if k in cfg}
+    engine = TransferEngine(
+        cases,
+        journal=TransferJournal(cfg.get("journal")),
+        checksum=cfg.get("checksum", False),
+        **limits,
+    )
+    if verify:
+        return len(engine.verify(jobs)) == 0
+
+    failed = engine.run(jobs)
+    for job in failed:
+        print(" failed:", job)
+    return len(failed) == 0
 
 
 def main(argv):
@@ -161,18 +141,30 @@ def main(argv):
         default=None,
         help="Config file for data transfers",
     )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        dest="dry_run",
+        action="store_true",
+        help="Print the files and bytes to transfer without transferring them",
+    )
+    parser.add_argument(
+        "--verify",
+        dest="verify",
+        action="store_true",
+        help="Compare the sizes and checksums of the transferred files on the "
+        "remote host without transferring, bad files are sent by the next run",
+    )
 
     args = parser.parse_args()
     config = yaml.safe_load(open(args.config))
     config = check_config(config)
 
+    ok = True
     for trans, vals in config.items():
-        selection = vals["selection"]
-        show = Cases(selection=selection, printlev=0, host="atos")
-        for case in show.names:
-            for run in show.cases.names:
-                vals["selection"] = {case: run}
-                transfer(vals)
+        ok = transfer(vals, args.dry_run, args.verify) and ok
+
+    return 0 if ok else 1
 
 
 if __name__ == "__main__":